@@ -0,0 +1,78 @@
+'''
+Benchmark the alarm scheduler over a store of events with reminders: how long
+it takes to load a window, how many alarms it holds, and how much CPU it uses
+while it waits for the next one.
+
+    python -m bench.bench_alarms [--events N] [--idle SECONDS]
+'''
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import pytz
+
+from harmony.alarms import Alarm, AlarmScheduler
+from harmony.calendar import Calendar, Event
+from harmony.persistence import db, schema
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def populate(count):
+    '''{count} events, one every 15 minutes from an hour from now, each with
+    a reminder 10 minutes before it starts.'''
+    cal = Calendar.create(name='Busy')
+    now = datetime.datetime.now(pytz.utc).replace(microsecond=0)
+    with db.db.transaction():
+        for i in range(count):
+            start = now + datetime.timedelta(hours=1, minutes=15 * i)
+            event = Event(summary=u'Event {:d}'.format(i), calendar=cal,
+                          start=start, end=start + datetime.timedelta(minutes=15))
+            event.save()
+            alarm = Alarm(event=event, offset=-600)
+            alarm.schedule(event)
+            alarm.save()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--idle', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        db.initialize_sqlite(os.path.join(tmp, 'alarms.db'))
+        schema.migrate()
+        populate(args.events)
+
+        scheduler = AlarmScheduler(lambda alarm: None)
+        start = time.time()
+        scheduler.start()
+        print('{:d} alarms; loaded {:d} in {:.1f} ms'.format(
+                args.events, len(scheduler), (time.time() - start) * 1e3))
+        try:
+            before = cpu_time()
+            time.sleep(args.idle)
+            used = cpu_time() - before
+        finally:
+            scheduler.stop()
+        print('CPU while waiting {:.0f} s for the first: {:.2f} ms'.format(
+                args.idle, used * 1e3))
+        db.db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+Benchmark how much room the original iCalendar data of events takes in the
+store, and what reading it back costs, stored raw, zlib-compressed, and
+compressed against the built-in and a trained dictionary.
+
+    python -m bench.bench_blobs [--events N]
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import zlib
+
+from harmony import blobs
+
+
+NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley',
+         'Jamie', 'Avery', 'Quinn', 'Robin', 'Drew']
+WORDS = ('agenda review project budget quarterly planning sync notes follow up '
+         'action items please read the doc before the meeting dial in link '
+         'room').split()
+
+
+def make_event(i, rng):
+    '''A big-account sort of event: a long description and a long list of
+    attendees.'''
+    attendees = rng.sample(NAMES, rng.randint(2, len(NAMES)))
+    description = ' '.join(rng.choice(WORDS)
+                           for _ in range(rng.randint(20, 200)))
+    lines = ['BEGIN:VCALENDAR', 'PRODID:-//Example Corp//Calendar//EN',
+             'VERSION:2.0', 'BEGIN:VEVENT',
+             'DTSTART;TZID=America/Los_Angeles:2013{:02d}{:02d}T{:02d}0000'.format(
+                     rng.randint(1, 12), rng.randint(1, 28), rng.randint(8, 18)),
+             'DTEND;TZID=America/Los_Angeles:20130301T100000',
+             'DTSTAMP:20130226T090000Z',
+             'ORGANIZER;CN={0}:mailto:{1}@example.com'.format(
+                     attendees[0], attendees[0].lower()),
+             'UID:{:08x}-{:d}@example.com'.format(rng.getrandbits(32), i)]
+    for name in attendees:
+        lines.append('ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;'
+                     'PARTSTAT=NEEDS-ACTION;RSVP=TRUE;CN={0};X-NUM-GUESTS=0:'
+                     'mailto:{1}@example.com'.format(name, name.lower()))
+    lines.extend(['CREATED:20130220T120000Z',
+                  'DESCRIPTION:{}'.format(description),
+                  'LAST-MODIFIED:20130225T120000Z', 'LOCATION:Room 4',
+                  'SEQUENCE:0', 'STATUS:CONFIRMED',
+                  'SUMMARY:Meeting {:d}'.format(i), 'TRANSP:OPAQUE',
+                  'END:VEVENT', 'END:VCALENDAR', ''])
+    return '\r\n'.join(lines)
+
+
+def store(path, data):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE blob (id INTEGER PRIMARY KEY, data BLOB)')
+    conn.executemany('INSERT INTO blob (data) VALUES (?)',
+                     ((buffer(d),) for d in data))
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+
+def read_all(path, decode):
+    conn = sqlite3.connect(path)
+    start = time.time()
+    total = 0
+    for (data,) in conn.execute('SELECT data FROM blob'):
+        total += len(decode(str(data)))
+    elapsed = time.time() - start
+    conn.close()
+    return elapsed, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(1)
+    events = [make_event(i, rng) for i in range(args.events)]
+    raw_bytes = sum(len(e) for e in events)
+    trained = blobs.Codec(blobs.train(events[:2000]))
+    default = blobs.Codec(blobs.DEFAULT_DICTIONARY)
+    schemes = [
+        ('raw', lambda d: d, lambda d: d),
+        ('zlib', lambda d: zlib.compress(d, 9), zlib.decompress),
+        ('zlib + built-in dictionary', default.compress, default.decompress),
+        ('zlib + trained dictionary', trained.compress, trained.decompress),
+    ]
+
+    print('{:d} events, {:.1f} MB of iCalendar data'.format(
+            len(events), raw_bytes / 1e6))
+    print('{:<28} {:>10} {:>8} {:>14}'.format('', 'db size', 'ratio',
+                                              'read, per blob'))
+    tmp = tempfile.mkdtemp()
+    try:
+        raw_size = None
+        for name, encode, decode in schemes:
+            path = os.path.join(tmp, name.replace(' ', '_') + '.db')
+            size = store(path, [encode(e) for e in events])
+            if raw_size is None:
+                raw_size = size
+            elapsed, total = read_all(path, decode)
+            assert total == raw_bytes
+            print('{:<28} {:>7.1f} MB {:>7.2f}x {:>11.1f} us'.format(
+                    name, size / 1e6, float(raw_size) / size,
+                    elapsed / len(events) * 1e6))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''
+Benchmark harmony.dateparse against the strptime loops it replaces.
+
+    python -m bench.bench_dateparse
+'''
+
+from __future__ import print_function
+
+import datetime
+import random
+import timeit
+
+from harmony import dateparse, lang
+
+
+def strptime_loop(s, fmts):
+    '''What lang.transform_datetime used to do.'''
+    for fmt in fmts:
+        try:
+            return datetime.datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    raise ValueError(s)
+
+
+def report(name, slow, fast, number):
+    slow_t = min(timeit.repeat(slow, number=number, repeat=3))
+    fast_t = min(timeit.repeat(fast, number=number, repeat=3))
+    print('{:<32} strptime {:8.1f} us   fast {:8.1f} us   {:5.1f}x'.format(
+            name, slow_t / number * 1e6, fast_t / number * 1e6, slow_t / fast_t))
+
+
+def main():
+    start = datetime.datetime(2000, 1, 1)
+    dts = [start + datetime.timedelta(seconds=random.randint(0, 10 ** 9))
+           for _ in range(10000)]
+    stored = [dateparse.format_stored(dt) for dt in dts]
+    us_dates = [dt.strftime('%m/%d/%Y') for dt in dts]
+    ical = [dt.strftime(dateparse.ICAL_DATETIME_FORMAT) for dt in dts]
+
+    print('Per call:')
+    report('lang ISO date', lambda: strptime_loop('2013-03-01', lang.DATE_FMTS),
+           lambda: lang.transform_datetime('2013-03-01', lang.DATE_FMTS), 20000)
+    report('lang US date (3rd format)',
+           lambda: strptime_loop('12/31/2013', lang.DATE_FMTS),
+           lambda: lang.transform_datetime('12/31/2013', lang.DATE_FMTS), 20000)
+    report('lang time', lambda: strptime_loop('13:45', lang.TIME_FMTS),
+           lambda: lang.transform_datetime('13:45', lang.TIME_FMTS), 20000)
+    report('stored format',
+           lambda: datetime.datetime.strptime(stored[0], dateparse.STORAGE_FORMAT),
+           lambda: dateparse.parse_stored(stored[0]), 20000)
+
+    print('Batch of {} (per batch):'.format(len(dts)))
+    report('stored format',
+           lambda: [datetime.datetime.strptime(s, dateparse.STORAGE_FORMAT)
+                    for s in stored],
+           lambda: [dateparse.parse_stored(s) for s in stored], 1)
+    report('US dates, detected',
+           lambda: [strptime_loop(s, lang.DATE_FMTS) for s in us_dates],
+           lambda: dateparse.Parser(lang.DATE_FMTS).parse_many(us_dates), 1)
+    report('iCalendar timestamps',
+           lambda: [datetime.datetime.strptime(s, dateparse.ICAL_DATETIME_FORMAT)
+                    for s in ical],
+           lambda: dateparse.Parser([dateparse.ICAL_DATETIME_FORMAT]).parse_many(ical),
+           1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Benchmark how long it takes to start Harmony's CLI, and guard against it
+getting slower.
+
+    python -m bench.bench_import [--budget MS] [--runs N] [module ...]
+
+Each module is imported in a fresh interpreter, several times over, and the
+median wall time is reported. On interpreters that support -X importtime
+(Python 3.7 and up), the slowest imports underneath are listed too. Exits with
+status 1 if a module takes longer than the budget, or pulls in one of the
+modules that are supposed to be deferred.
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+# Modules the CLI must not import at startup. They're only needed once a
+# command actually does something with timezones, iCalendar data or a server.
+DEFERRED = ('pytz', 'pkg_resources', 'icalendar', 'requests', 'urlobject',
+            'sqlite3')
+
+PROBE = '''
+import sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(elapsed)
+print(' '.join(sorted(set(m.split('.')[0] for m in sys.modules))))
+'''
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module, runs):
+    '''Import {module} in {runs} fresh interpreters.
+
+    @returns: The median import time in seconds, and the top-level modules
+    that were loaded. (tuple of float and set)
+    '''
+    times = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       PROBE.format(module=module)], cwd=SRC)
+        elapsed, modules = out.decode('utf-8').splitlines()
+        times.append(float(elapsed))
+        loaded = set(modules.split())
+    times.sort()
+    return times[len(times) // 2], loaded
+
+
+def importtime_breakdown(module, top=10):
+    '''The slowest imports under {module}, by cumulative time, according to
+    -X importtime. Empty on interpreters without it.'''
+    if sys.version_info < (3, 7):
+        return []
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                             'import {}'.format(module)], cwd=SRC,
+                            stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    _, err = proc.communicate()
+    rows = []
+    for line in err.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [f.strip() for f in line[12:].split('|')]
+        rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('modules', nargs='*', default=['harmony.cli'])
+    parser.add_argument('--budget', type=float, default=60.0,
+                        help='import time budget in milliseconds')
+    parser.add_argument('--runs', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    ok = True
+    for module in args.modules:
+        median, loaded = measure(module, args.runs)
+        print('{:<24} {:8.1f} ms'.format(module, median * 1000))
+        for cumulative, name in importtime_breakdown(module):
+            print('    {:<36} {:8.1f} ms'.format(name, cumulative / 1000.0))
+        eager = sorted(loaded.intersection(DEFERRED))
+        if eager:
+            print('    imports deferred modules: {}'.format(', '.join(eager)))
+            ok = False
+        if median * 1000 > args.budget:
+            print('    over budget of {:.0f} ms'.format(args.budget))
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
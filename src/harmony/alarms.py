@@ -0,0 +1,306 @@
+'''
+Event reminders, and a scheduler that fires them on time.
+
+Each alarm stores when it's due, worked out from its trigger and its event's
+times, so the next ones can be found with an index instead of by looking at
+every event. The scheduler keeps only the alarms due in the next window of time
+in a heap, sleeps until the first of them, and loads the next window when it
+gets to the end of this one. Alarms saved and deleted while it runs are added
+to or dropped from the heap as they change, so it never polls the store.
+'''
+
+import errno
+import heapq
+import logging
+import os
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .calendar import Event
+from .persistence.model import (DateTimeField, ForeignKeyField, IntegerField,
+                                Model, TextField)
+from .tz import epoch, get_timezone
+
+
+log = logging.getLogger(__name__)
+
+# How far ahead the scheduler loads alarms, in seconds.
+DEFAULT_WINDOW = 6 * 60 * 60
+
+_NEVER = float('inf')
+
+
+class Alarm(Model):
+    '''A reminder for an event, like an iCalendar VALARM.'''
+
+    event = ForeignKeyField(Event)
+    # DISPLAY, AUDIO or EMAIL.
+    action = TextField(default=u'DISPLAY')
+    description = TextField(null=True)
+    # The trigger: either seconds from the event's start or end, depending on
+    # {related}, negative for before; or, if {at} is set, a fixed time.
+    offset = IntegerField(default=0)
+    related = TextField(default=u'start')
+    at = DateTimeField(null=True)
+    # When the alarm goes off, from the trigger and the event's times.
+    due = DateTimeField()
+
+    class Meta:
+        journal = False
+        indexes = (('due',), ('event',))
+
+    @classmethod
+    def for_event(cls, event):
+        '''@returns: The alarms of {event}. (list of Alarm)'''
+        event_id = getattr(event, 'id', event)
+        if event_id is None:
+            return []
+        return list(cls.select(event=event_id))
+
+    def drop(self):
+        '''Don't save the alarm after all, if it hasn't been already. For
+        alarms handed out to be saved, that turn out not to be wanted.'''
+        if self.id is None:
+            self.__dict__['_dropped'] = True
+
+    def save(self):
+        if not self.__dict__.get('_dropped'):
+            Model.save(self)
+
+    def schedule(self, event):
+        '''Work out when the alarm is due, from {event}'s times.'''
+        if self.at is not None:
+            self.due = self.at
+        else:
+            base = event.end if self.related == u'end' else event.start
+            self.due = base + timedelta(seconds=self.offset or 0)
+
+    def __unicode__(self):
+        return u'{0.action} alarm at {0.due}'.format(self)
+
+
+def _event_changed(action, event):
+    if event.id is None:
+        return
+    if action == 'delete':
+        alarms = Alarm.for_event(event)
+    else:
+        dirty = event.dirty_fields
+        # A new copy of an imported event brings its own alarms; see
+        # ical.import_events.
+        if 'content_hash' in dirty:
+            alarms = Alarm.for_event(event)
+        else:
+            if 'start' in dirty or 'end' in dirty:
+                for alarm in Alarm.for_event(event):
+                    alarm.schedule(event)
+                    alarm.save()
+            return
+    # One at a time, so the scheduler hears about each.
+    for alarm in alarms:
+        alarm.delete()
+
+
+Event._meta.listeners.append(_event_changed)
+
+
+def _stored(seconds):
+    '''A time in seconds since the epoch, as Alarm.due stores it.'''
+    dt = datetime.utcfromtimestamp(seconds).replace(tzinfo=get_timezone('UTC'))
+    return Alarm._meta.fields['due'].db_value(dt)
+
+
+class AlarmScheduler(object):
+    '''
+    Calls {fire} with each alarm as it comes due, in a thread of its own.
+
+    The heap holds every alarm due after {fired_until}, when the alarms before
+    were fired, and before {loaded_until}, the end of the loaded window. Heap
+    entries are (due, alarm id) pairs; when an alarm changes, its old entry is
+    left where it is, and skipped when it gets to the top.
+    '''
+
+    def __init__(self, fire, window=DEFAULT_WINDOW, clock=time.time):
+        '''
+        @param fire: Called with each alarm that comes due. (callable)
+        @param window: How far ahead to load alarms, in seconds. (int)
+        @param clock: Returns the time in seconds since the epoch. (callable)
+        '''
+        self.fire = fire
+        self.window = window
+        self.clock = clock
+        self._heap = []
+        # Due time of each alarm in the heap, by id.
+        self._due = {}
+        self.fired_until = None
+        self.loaded_until = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._wake_r = self._wake_w = None
+
+    def __len__(self):
+        '''Number of alarms loaded.'''
+        return len(self._due)
+
+    def load(self, now=None):
+        '''Start afresh from {now}: alarms due before then won't fire. Call
+        this again when other processes may have changed alarms.'''
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self._heap = []
+            self._due = {}
+            self.fired_until = now
+            self._load_window()
+        self._wake()
+
+    def _load_window(self):
+        start = self.fired_until
+        # Due times are whole seconds, and so is the end of the window, so
+        # that the query and alarm_changed() agree on what's in it.
+        end = int(start) + self.window
+        cols = self._query(start, end)
+        if not cols['id']:
+            # Nothing due in the window. Skip ahead to the next alarm there
+            # is, rather than waking up every window to find nothing.
+            upcoming = list(Alarm.select(due__gt=_stored(start),
+                                         order_by=('due',), limit=1))
+            if not upcoming:
+                self.loaded_until = _NEVER
+                return
+            end = int(epoch(upcoming[0].due)) + self.window
+            cols = self._query(start, end)
+        self.loaded_until = end
+        for alarm_id, due in zip(cols['id'], cols['due']):
+            self._push(alarm_id, due)
+        log.debug('Loaded %d alarms due before %s', len(cols['id']), end)
+
+    def _query(self, start, end):
+        return Alarm.select_columns(('id', 'due'), epoch_columns=('due',),
+                                    due__gt=_stored(start),
+                                    due__lt=_stored(end))
+
+    def _push(self, alarm_id, due):
+        self._due[alarm_id] = due
+        heapq.heappush(self._heap, (due, alarm_id))
+
+    def next_wakeup(self):
+        '''@returns: When the next alarm is due, or the loaded window ends,
+        whichever comes first, in seconds since the epoch. (float)'''
+        with self._lock:
+            self._drop_stale()
+            if self._heap:
+                return min(self._heap[0][0], self.loaded_until)
+            return self.loaded_until
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def run_pending(self, now=None):
+        '''Fire the alarms due by {now}, and load the next window if this one
+        is over.
+
+        @returns: The ids of the alarms fired. (list of int)
+        '''
+        if now is None:
+            now = self.clock()
+        if self.fired_until is None:
+            self.load(now)
+        due = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                when, alarm_id = heapq.heappop(heap)
+                if self._due.get(alarm_id) == when:
+                    del self._due[alarm_id]
+                    due.append(alarm_id)
+            self.fired_until = max(self.fired_until, now)
+            if now >= self.loaded_until:
+                self._load_window()
+        for alarm_id in due:
+            for alarm in Alarm.select(id=alarm_id):
+                try:
+                    self.fire(alarm)
+                except Exception:
+                    log.exception('Firing %s failed', alarm)
+        return due
+
+    def alarm_changed(self, action, alarm):
+        '''Model listener for Alarm.'''
+        with self._lock:
+            if self.fired_until is None:
+                return
+            self._due.pop(alarm.id, None)
+            if action == 'delete':
+                return
+            due = epoch(alarm.due)
+            if not self.fired_until < due < self.loaded_until:
+                return
+            earliest = not self._heap or due < self._heap[0][0]
+            self._push(alarm.id, due)
+        if earliest:
+            self._wake()
+
+    #
+    # Thread
+    #
+
+    def start(self):
+        '''Load the first window, and start firing alarms.'''
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._wake_r, self._wake_w = os.pipe()
+        Alarm._meta.listeners.append(self.alarm_changed)
+        self.load()
+        self._thread = threading.Thread(target=self._run,
+                                        name='AlarmScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake()
+        self._thread.join()
+        self._thread = None
+        Alarm._meta.listeners.remove(self.alarm_changed)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        self._wake_r = self._wake_w = None
+
+    def _wake(self):
+        if self._wake_w is not None:
+            os.write(self._wake_w, 'x')
+
+    def _run(self):
+        while not self._stopping:
+            timeout = self.next_wakeup() - self.clock()
+            if timeout > 0:
+                self._sleep(timeout)
+                if self._stopping:
+                    break
+            try:
+                self.run_pending()
+            except Exception:
+                log.exception('Running alarms failed')
+
+    def _sleep(self, timeout):
+        '''Sleep for {timeout} seconds, or until woken. select() blocks
+        outright, where Python 2's Condition.wait(timeout) polls.'''
+        if timeout == _NEVER:
+            timeout = None
+        try:
+            ready, _, _ = select.select([self._wake_r], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if ready:
+            os.read(self._wake_r, 4096)
@@ -2,13 +2,21 @@
 Basic app data.
 '''
 
-from datetime import datetime, date
-from os.path import expanduser as path_expanduser, join as path_join
-
-from pytz import timezone as pytz_timezone, UnknownTimeZoneError
+from collections import OrderedDict
+from datetime import datetime, date, time
+from threading import Lock
+from os import makedirs
+from os.path import (expanduser as path_expanduser, join as path_join,
+                     isdir as path_isdir)
 
+from . import config
+from .cache import LRUCache
 from .calendar import Calendar, Event
+from .intervaltree import IntervalTree
+from .persistence import db, schema
+from .persistence.model import Change
 from .settings import Settings
+from .tz import epoch, to_utc
 
 
 # Harmony parameters
@@ -27,33 +35,482 @@ ICAL_VERSION_STRING = u'.'.join([str(vnum) for vnum in ICAL_VERSION])
 CONFIG_DIRECTORY = path_join(path_expanduser('~'), '.harmony')
 CONFIG_HARMONY = path_join(CONFIG_DIRECTORY, 'harmony.conf')
 CONFIG_CALENDARS_DB = path_join(CONFIG_DIRECTORY, 'calendars.db')
+CONFIG_SNAPSHOT = path_join(CONFIG_DIRECTORY, 'events.snapshot')
+
+
+class Calendars(object):
+    '''
+    The application's calendars, by id. Nothing is read until the calendars
+    are first looked at, and then only the calendar rows themselves -- never
+    their events.
+    '''
+
+    def __init__(self, app):
+        self._app = app
+        self._calendars = None
+        self._default = None
+        self._lock = Lock()
+
+    def _load(self):
+        if self._calendars is None:
+            with self._lock:
+                if self._calendars is None:
+                    self._app.ensure_store()
+                    calendars = dict((cal.id, cal)
+                                     for cal in Calendar.select())
+                    self._default = next((cal for cal in calendars.values()
+                                          if cal.is_default), None)
+                    self._calendars = calendars
+        return self._calendars
+
+    @property
+    def default(self):
+        '''The default calendar, or None if there isn't one. (Calendar)'''
+        self._load()
+        return self._default
+
+    @default.setter
+    def default(self, calendar):
+        self._load()
+        self._default = calendar
+
+    @property
+    def loaded(self):
+        return self._calendars is not None
+
+    def __getitem__(self, calendar_id):
+        return self._load()[calendar_id]
+
+    def __setitem__(self, calendar_id, calendar):
+        self._load()[calendar_id] = calendar
+
+    def __contains__(self, calendar_id):
+        return calendar_id in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def get(self, calendar_id, default=None):
+        return self._load().get(calendar_id, default)
+
+    def pop(self, calendar_id, default=None):
+        return self._load().pop(calendar_id, default)
+
+    def keys(self):
+        return self._load().keys()
+
+    def values(self):
+        return self._load().values()
+
+    def items(self):
+        return self._load().items()
+
+    def invalidate(self):
+        '''Forget the loaded calendars, so the next access reads them again.'''
+        self._calendars = None
 
 
 class Application(object):
     '''
     The heart of Harmony. The application logic. The (MVC) controller.
+
+    The store is opened the first time something needs it, rather than at
+    startup, and events are read a page at a time as they're asked for. At most
+    {event_cache_size} of them are kept around.
     '''
 
-    def __init__(self):
-        self.calendars = {}
-        self.default_calendar = None
+    # Most changes refresh() will replay from the journal before giving up and
+    # dropping the caches; the journal keeps at least that many.
+    MAX_JOURNAL_REPLAY = Change.RETAIN
+
+    def __init__(self, dbpath=CONFIG_CALENDARS_DB, event_cache_size=2048,
+                 snapshot_path=CONFIG_SNAPSHOT):
+        self.dbpath = dbpath
+        self.snapshot_path = snapshot_path
+        # Created when the snapshot setting is first seen to be on. See
+        # update_snapshot().
+        self._snapshot = None
+        self.calendars = Calendars(self)
+        self.sync = None
+        self.alarms = None
+        self._store_lock = Lock()
+        self._store_open = False
+        self._data_version = None
+        # Number of the last change journal entry seen. See refresh().
+        self._journal_seq = 0
+        self._events = LRUCache(event_cache_size)
+        # Interval trees of event times, by calendar id. See agenda().
+        self._agendas = {}
+        self._agendas_lock = Lock()
+        # What the shell can complete. See completion_index().
+        self._completion = None
+
+    def open_store(self, dbpath=None):
+        '''Connect to the calendar database and bring its schema up to
+        date.'''
+        with self._store_lock:
+            if dbpath is not None:
+                self.dbpath = dbpath
+            if self.dbpath == CONFIG_CALENDARS_DB \
+                    and not path_isdir(CONFIG_DIRECTORY):
+                makedirs(CONFIG_DIRECTORY)
+            db.initialize_sqlite(self.dbpath)
+            # Some model modules listen for changes to others (alarms and blobs
+            # follow events), so they have to be loaded before anything is
+            # saved, whether or not the schema needs migrating.
+            schema.import_models()
+            schema.migrate()
+            self._store_open = True
+            # Listeners are class-wide, so they're only registered while the
+            # store is open, and taken out again by close_store().
+            for model_class, listener in self._listeners():
+                if listener not in model_class._meta.listeners:
+                    model_class._meta.listeners.append(listener)
+            self._data_version = db.db.get_data_version()
+            self._journal_seq = Change.latest()
+        self.calendars.invalidate()
+        self._events.clear()
+        with self._agendas_lock:
+            self._agendas.clear()
+
+    def close_store(self):
+        '''Stop syncing and alarms, stop listening for changes, and close the
+        calendar database.'''
+        if self.sync is not None:
+            self.sync.stop()
+            self.sync.unwatch()
+            self.sync = None
+        if self.alarms is not None:
+            self.alarms.stop()
+            self.alarms = None
+        for model_class, listener in self._listeners():
+            if listener in model_class._meta.listeners:
+                model_class._meta.listeners.remove(listener)
+        with self._store_lock:
+            if self._store_open:
+                db.db.close()
+                self._store_open = False
+        self._drop_caches()
+
+    def _listeners(self):
+        return ((Calendar, self._calendar_changed),
+                (Event, self._event_changed))
+
+    def refresh(self):
+        '''Catch up with changes other processes have made to the store since
+        the last refresh. Long-lived frontends, like the server, should call
+        this before handling each request.
+
+        Changed events are found in the change journal and reloaded one by one.
+        If there are too many of them, or the journal has been pruned past
+        where this process last read it, every cache is dropped instead.
+
+        @returns: True if anything changed. (bool)
+        '''
+        if not self._store_open:
+            return False
+        version = db.db.get_data_version()
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        seq = self._journal_seq
+        changes = list(Change.since(seq, limit=self.MAX_JOURNAL_REPLAY + 1))
+        if not changes:
+            return False
+        self._journal_seq = changes[-1].id
+        if (len(changes) > self.MAX_JOURNAL_REPLAY
+                or changes[0].id != seq + 1):
+            self._drop_caches()
+            self._journal_seq = Change.latest()
+            return True
+        # An event may have changed several times; only its last state matters.
+        events = OrderedDict()
+        for change in changes:
+            if change.model == Calendar._meta.table:
+                self.calendars.invalidate()
+                self._completion = None
+            elif change.model == Event._meta.table:
+                events.pop(change.row, None)
+                events[change.row] = change.action
+        if events and self.alarms is not None:
+            # Alarms aren't journaled; they change with their events.
+            self.alarms.load()
+        for event_id, action in events.items():
+            event = None
+            if action != 'delete':
+                self._events.discard(event_id)
+                event = self.get_event(event_id)
+            if event is None:
+                self._event_changed('delete', Event(id=event_id))
+            else:
+                self._event_changed('save', event)
+        return True
+
+    def _drop_caches(self):
+        self.calendars.invalidate()
+        self._completion = None
+        if self.alarms is not None:
+            self.alarms.load()
+        self._events.clear()
+        with self._agendas_lock:
+            self._agendas.clear()
+        if self._snapshot is not None:
+            self._snapshot.invalidate()
+
+    def _snapshot_writer(self):
+        if self._snapshot is None and settings.snapshot:
+            from .snapshot import SnapshotWriter
+            self._snapshot = SnapshotWriter(self.snapshot_path)
+        return self._snapshot
+
+    def update_snapshot(self, rebuild=False):
+        '''Bring the snapshot of upcoming events up to date, if the snapshot
+        setting is on. Frontends should call this once they're done making
+        changes, rather than after every one.
+
+        @param rebuild: Read everything from the store again, rather than
+        updating the existing snapshot. (bool)
+        @returns: True if the snapshot was written. (bool)
+        '''
+        writer = self._snapshot_writer()
+        if writer is None:
+            return False
+        self.ensure_store()
+        if rebuild:
+            writer.invalidate()
+        return writer.update()
+
+    def ensure_store(self):
+        '''Open the store, if that hasn't happened yet.'''
+        if not self._store_open:
+            self.open_store()
+
+    def start_sync(self, sources, interval=300):
+        '''Start syncing {sources} in the background, every {interval}
+        seconds.'''
+        if self.sync is not None:
+            self.sync.stop()
+            self.sync.unwatch()
+        from .sync import SyncService
+        self.sync = SyncService(sources, interval=interval)
+        self.sync.watch(Event)
+        self.sync.start()
+        return self.sync
+
+    def start_alarms(self, fire, window=None):
+        '''Start calling {fire} with each alarm as it comes due, in the
+        background. See harmony.alarms.AlarmScheduler.
+
+        @param window: How far ahead to look for alarms, in seconds, or None
+        for alarms.DEFAULT_WINDOW. (int)
+        '''
+        from .alarms import DEFAULT_WINDOW, AlarmScheduler
+        self.ensure_store()
+        if self.alarms is not None:
+            self.alarms.stop()
+        if window is None:
+            window = DEFAULT_WINDOW
+        self.alarms = AlarmScheduler(fire, window=window)
+        self.alarms.start()
+        return self.alarms
+
+    @property
+    def default_calendar(self):
+        '''The calendar events go in when none is given; the one marked as the
+        default in the store. Looked up with the calendars. (Calendar)'''
+        return self.calendars.default
+
+    @default_calendar.setter
+    def default_calendar(self, calendar):
+        self.calendars.default = calendar
 
     def create_calendar(self, name, timezone=None, default=False):
+        self.ensure_store()
         if timezone == None:
             # TODO: Get it from the configuration or the system.
             pass
         cal = Calendar.create(name=str(name), timezone=timezone,
-                              default=default)
+                              is_default=default)
         self.calendars[cal.pk] = cal
         if default:
             self.default_calendar = cal
 
+    def find_calendar(self, name):
+        for cal in self.calendars.values():
+            if cal.name == name:
+                return cal
+        return None
+
+    def get_calendar(self, calendar_id):
+        return self.calendars.get(calendar_id)
+
+    def get_event(self, event_id):
+        '''Look up an event by id, from the cache if it's there.'''
+        event = self._events.get(event_id)
+        if event is None:
+            self.ensure_store()
+            for event in Event.select(id=event_id):
+                self._events.put(event_id, event)
+                break
+        return event
+
+    def events(self, calendar_id, after=None, limit=100):
+        '''Page through a calendar's events in order of start time.
+
+        @param after: Only return events that start at or after this.
+        (datetime)
+        @param limit: Page size. (int)
+        @returns: Up to {limit} events. (list of Event)
+        '''
+        self.ensure_store()
+        criteria = {'calendar': calendar_id}
+        if after is not None:
+            criteria['start__ge'] = Event._meta.fields['start'].db_value(after)
+        page = []
+        for event in Event.select(order_by=('start', 'id'), limit=limit,
+                                  **criteria):
+            self._events.put(event.id, event)
+            page.append(event)
+        return page
+
+    def event_chunks(self, calendar_id=None, chunk_size=1000):
+        '''Stream events in order of start time, across all calendars or in
+        one, a chunk at a time. Unlike events(), nothing is cached, so this can
+        go through every event in the store in bounded memory.
+
+        @returns: Lists of up to {chunk_size} events. (generator)
+        '''
+        self.ensure_store()
+        criteria = None
+        if calendar_id is not None:
+            criteria = {'calendar': calendar_id}
+        for columns, rows in db.db.select_chunks(Event._meta.table, criteria,
+                                                 chunk_size=chunk_size,
+                                                 order_by=('start', 'id')):
+            yield Event.from_rows(columns, rows)
+
     def create_event(self, summary, calendar, start, end):
-        cal = self.calendars.get(calendar_id)
+        '''Create an event in the calendar with id {calendar}.
+
+        @returns: The new event, and the events in the same calendar that it
+        overlaps. (tuple of Event and list of Event)
+        '''
+        cal = self.get_calendar(calendar)
         if cal is None:
-            raise ValueError('Invalid calendar id: {0}'.format(calendar_id))
-        ev = Event(summary=str(summary), calendar=cal, start=start, end=end)
-        cal.add_event(ev)
+            raise ValueError('Invalid calendar id: {0}'.format(calendar))
+        conflicts = self.agenda(cal.id).overlapping(epoch(start), epoch(end))
+        ev = Event.create(summary=str(summary), calendar=cal, start=start,
+                          end=end)
+        return ev, self._load_events(conflicts)
+
+    def delete_event(self, event):
+        event.delete()
+
+    def events_between(self, calendar_id, start, end):
+        '''Events in a calendar that overlap the range from {start} to {end},
+        ordered by start.'''
+        tree = self.agenda(calendar_id)
+        return self._load_events(tree.overlapping(epoch(start), epoch(end)))
+
+    def agenda(self, calendar_id):
+        '''The interval tree of a calendar's event times, keyed by event id.
+        It's built from the store the first time it's asked for, and kept up to
+        date as events are saved and deleted after that.'''
+        self.ensure_store()
+        with self._agendas_lock:
+            tree = self._agendas.get(calendar_id)
+            if tree is None:
+                cols = Event.select_columns(('id', 'start', 'end'),
+                                            epoch_columns=('start', 'end'),
+                                            calendar=calendar_id)
+                tree = IntervalTree(zip(cols['id'], cols['start'], cols['end']))
+                self._agendas[calendar_id] = tree
+            return tree
+
+    def completion_index(self):
+        '''The index of what the shell can complete. It's built from the store
+        the first time it's asked for, and kept up to date as calendars and
+        events are saved and deleted after that.'''
+        if self._completion is None:
+            from .completion import CompletionIndex
+            self.ensure_store()
+            self._completion = CompletionIndex.load()
+        return self._completion
+
+    def _calendar_changed(self, action, calendar):
+        index = self._completion
+        if index is not None:
+            index.calendar_changed(action, calendar)
+
+    def _event_changed(self, action, event):
+        writer = self._snapshot_writer()
+        if writer is not None:
+            writer.event_changed(action, event)
+        index = self._completion
+        if index is not None:
+            index.event_changed(action, event)
+        calendar_id = getattr(event.calendar, 'id', event.calendar)
+        if action == 'delete':
+            self._events.discard(event.id)
+        else:
+            self._events.put(event.id, event)
+        with self._agendas_lock:
+            # The event may have moved from another calendar.
+            for cal_id, tree in self._agendas.items():
+                if cal_id != calendar_id:
+                    tree.discard(event.id)
+            tree = self._agendas.get(calendar_id)
+            if tree is None:
+                return
+            if action == 'delete':
+                tree.discard(event.id)
+            else:
+                tree.add(event.id, epoch(event.start), epoch(event.end))
+
+    def _load_events(self, intervals):
+        events = []
+        for key, _, _ in intervals:
+            event = self.get_event(key)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def freebusy(self, calendar_names, start, end):
+        '''Work out free/busy time across the named calendars, or all of them
+        if {calendar_names} is empty.
+
+        @param start: Start of the range. Dates mean midnight; naive values
+        are in the user's timezone. (date, time or datetime)
+        @param end: End of the range. (date, time or datetime)
+        @returns: Availability. (freebusy.FreeBusy)
+        '''
+        from .freebusy import freebusy
+        if calendar_names:
+            calendars = []
+            for name in calendar_names:
+                cal = self.find_calendar(name)
+                if cal is None:
+                    raise ValueError('Invalid calendar: {0}'.format(name))
+                calendars.append(cal)
+        else:
+            calendars = self.calendars.values()
+        return freebusy(calendars, self.user_time_to_utc(start),
+                        self.user_time_to_utc(end))
+
+    def user_time_to_utc(self, value):
+        '''Convert a date, time or datetime the user gave into an aware UTC
+        datetime. Dates mean midnight, times mean today, and naive values are in
+        the user's timezone.'''
+        if isinstance(value, time):
+            value = datetime.combine(date.today(), value)
+        elif not isinstance(value, datetime):
+            value = datetime.combine(value, time())
+        if value.tzinfo is None:
+            return to_utc([value], settings.timezone)[0]
+        return value
 
 
 # The application singleton instance. Any of the frontends should be pushing and
@@ -61,3 +518,12 @@ class Application(object):
 app = Application()
 # The settings singleton instance.
 settings = Settings()
+
+
+def load_config(path=CONFIG_HARMONY):
+    '''Load the config file into the settings singleton. Cheap to call again;
+    the file is only read if it has changed.
+
+    @raises config.ConfigError: If the file has errors.
+    '''
+    return config.load(settings, path)
@@ -0,0 +1,279 @@
+'''
+The original iCalendar data of events, kept so that they can be written back
+out faithfully, with every property Harmony doesn't model intact.
+
+That data is mostly boilerplate (property names, parameters, attendee lists,
+timezone definitions) and compresses well, but each event on its own is too
+short for zlib to find much to work with. So blobs are compressed against a
+shared dictionary of that boilerplate: deflate can point back into the
+dictionary from the first byte. The built-in dictionary is a reasonable start;
+train() builds one from the events in the store, and the sync service has a
+new one trained every RETRAIN_EVERY blobs, so it keeps up with the data.
+
+Blobs live in their own table, so loading events never reads them. They're
+only decompressed when something asks for one, like a CalDAV push.
+'''
+
+import threading
+import zlib
+from collections import defaultdict
+
+from .calendar import Event
+from .persistence import db
+from .persistence.model import (BlobField, ForeignKeyField, IntegerField,
+                                Model)
+
+
+# Deflate can only look back this far, so there's no use in a longer
+# dictionary.
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Blobs compressed with the newest dictionary before the next is trained.
+RETRAIN_EVERY = 1000
+
+# How many blobs had been compressed with a dictionary when training on them
+# last came to nothing, by dictionary id. See retrain_if_due().
+_untrained = {}
+
+# Dictionary 0. Blobs in existing stores depend on it, so it must never
+# change. The most common strings are last, closest to the data.
+DEFAULT_DICTIONARY = '\r\n'.join([
+    'BEGIN:VTIMEZONE', 'TZID:America/Los_Angeles', 'TZID:America/New_York',
+    'TZID:Europe/London', 'TZID:Europe/Berlin', 'BEGIN:DAYLIGHT',
+    'TZOFFSETFROM:-0800', 'TZOFFSETTO:-0700', 'TZNAME:PDT',
+    'DTSTART:19700308T020000', 'RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU',
+    'END:DAYLIGHT', 'BEGIN:STANDARD', 'TZOFFSETFROM:-0700',
+    'TZOFFSETTO:-0800', 'TZNAME:PST', 'DTSTART:19701101T020000',
+    'RRULE:FREQ=YEARLY;BYMONTH=11;BYDAY=1SU', 'END:STANDARD', 'END:VTIMEZONE',
+    'BEGIN:VALARM', 'ACTION:DISPLAY', 'DESCRIPTION:Reminder',
+    'TRIGGER:-PT15M', 'TRIGGER;RELATED=START:-PT10M', 'END:VALARM',
+    'RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR', 'RRULE:FREQ=WEEKLY;INTERVAL=1',
+    'X-MICROSOFT-CDO-BUSYSTATUS:BUSY', 'X-MICROSOFT-CDO-IMPORTANCE:1',
+    'X-MICROSOFT-DISALLOW-COUNTER:FALSE', 'X-APPLE-TRAVEL-ADVISORY-BEHAVIOR:AUTOMATIC',
+    'CLASS:PUBLIC', 'PRIORITY:5', 'TRANSP:OPAQUE', 'STATUS:CONFIRMED',
+    'LOCATION:', 'DESCRIPTION:', 'CREATED:', 'LAST-MODIFIED:', 'SEQUENCE:0',
+    'ORGANIZER;CN=', 'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;'
+    'PARTSTAT=ACCEPTED;CN=',
+    'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT=TENTATIVE;CN=',
+    'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=OPT-PARTICIPANT;PARTSTAT=NEEDS-ACTION;'
+    'RSVP=TRUE;CN=',
+    'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT=NEEDS-ACTION;'
+    'RSVP=TRUE;CN=', ';X-NUM-GUESTS=0:mailto:',
+    'BEGIN:VCALENDAR', 'PRODID:-//Google Inc//Google Calendar 70.9054//EN',
+    'VERSION:2.0', 'CALSCALE:GREGORIAN', 'METHOD:REQUEST', 'BEGIN:VEVENT',
+    'DTSTART;TZID=', 'DTEND;TZID=', 'DTSTART;VALUE=DATE:', 'DTEND;VALUE=DATE:',
+    'DTSTAMP:', 'UID:', 'SUMMARY:', 'END:VEVENT', 'END:VCALENDAR', ''])
+
+
+class Dictionary(Model):
+    '''A trained compression dictionary. The newest one is used for new
+    blobs; older ones stay around for the blobs compressed with them.'''
+
+    data = BlobField()
+
+    class Meta:
+        journal = False
+
+    @classmethod
+    def latest(cls):
+        '''@returns: The newest dictionary's id; 0 for the built-in one.
+        (int)'''
+        for dictionary in cls.select(order_by=('-id',), limit=1):
+            return dictionary.id
+        return 0
+
+    def __unicode__(self):
+        return u'Dictionary {}'.format(self.id)
+
+
+class Codec(object):
+    '''
+    Compresses and decompresses blobs against one dictionary. zlib in Python 2
+    can't take a preset dictionary, so instead the compressor and decompressor
+    are primed by running the dictionary through them once, and copied for
+    each blob. The compressor's output for the dictionary ends in a sync
+    flush, so every blob starts on a byte boundary and can be stored without
+    it.
+    '''
+
+    def __init__(self, dictionary, level=9):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        primer = (compressor.compress(dictionary)
+                  + compressor.flush(zlib.Z_SYNC_FLUSH))
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        decompressor.decompress(primer)
+        self._compressor = compressor
+        self._decompressor = decompressor
+
+    def compress(self, data):
+        compressor = self._compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, blob):
+        decompressor = self._decompressor.copy()
+        return decompressor.decompress(blob) + decompressor.flush()
+
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def dictionary_data(dictionary_id):
+    '''@returns: The dictionary with {dictionary_id}. (str)'''
+    if dictionary_id == 0:
+        return DEFAULT_DICTIONARY
+    return next(iter(Dictionary.select(id=dictionary_id))).data
+
+
+def codec(dictionary_id):
+    '''@returns: The codec for the dictionary with {dictionary_id}. (Codec)'''
+    with _codecs_lock:
+        found = _codecs.get(dictionary_id)
+        if found is not None:
+            return found
+    found = Codec(dictionary_data(dictionary_id))
+    with _codecs_lock:
+        return _codecs.setdefault(dictionary_id, found)
+
+
+class EventData(Model):
+    '''The original iCalendar data of an event, compressed.'''
+
+    event = ForeignKeyField(Event, unique=True)
+    # The dictionary the data was compressed with.
+    dictionary = IntegerField(default=0)
+    data = BlobField()
+    # Uncompressed size, in bytes.
+    size = IntegerField(default=0)
+
+    class Meta:
+        journal = False
+        # For counting the blobs compressed with the newest dictionary.
+        indexes = (('dictionary',),)
+
+    @classmethod
+    def load(cls, event):
+        '''@returns: The data stored for {event}, or None. (EventData)'''
+        event_id = getattr(event, 'id', event)
+        if event_id is None:
+            return None
+        for blob in cls.select(event=event_id):
+            return blob
+        return None
+
+    @classmethod
+    def store(cls, event, ical, blob=None):
+        '''Compress {ical} into a blob for {event}. Save the blob after the
+        event, so the event has an id to refer to.
+
+        @param ical: iCalendar data. (str)
+        @param blob: The event's blob, if it's already been loaded.
+        (EventData)
+        @returns: The event's blob, unsaved. (EventData)
+        '''
+        if blob is None:
+            blob = cls.load(event)
+        if blob is None:
+            blob = cls(event=event)
+        dictionary = Dictionary.latest()
+        blob.dictionary = dictionary
+        blob.data = codec(dictionary).compress(ical)
+        blob.size = len(ical)
+        blob.__dict__['_ical'] = ical
+        return blob
+
+    @property
+    def ical(self):
+        '''The iCalendar data, decompressed the first time it's asked for.
+        (str)'''
+        try:
+            return self.__dict__['_ical']
+        except KeyError:
+            pass
+        ical = codec(self.dictionary).decompress(self.data)
+        self.__dict__['_ical'] = ical
+        return ical
+
+    def __unicode__(self):
+        return u'Data for event {}'.format(getattr(self.event, 'id',
+                                                   self.event))
+
+
+def event_ical(event):
+    '''@returns: The iCalendar data stored for {event}, or None. (str)'''
+    blob = EventData.load(event)
+    return blob.ical if blob is not None else None
+
+
+def train(samples, size=MAX_DICTIONARY_SIZE):
+    '''Build a dictionary out of the lines that recur in {samples}. Lines are
+    weighted by how many bytes they'd save, and the best go last, where
+    deflate reaches them most cheaply.
+
+    @param samples: iCalendar data. (iterable of str)
+    @returns: The dictionary. (str)
+    '''
+    counts = defaultdict(int)
+    for sample in samples:
+        for line in set(sample.splitlines(True)):
+            counts[line] += 1
+    lines = [line for line, count in counts.items() if count > 1]
+    lines.sort(key=lambda line: (counts[line] * len(line), line))
+    data = []
+    total = 0
+    for line in reversed(lines):
+        if total + len(line) > size:
+            break
+        data.append(line)
+        total += len(line)
+    return ''.join(reversed(data))
+
+
+def retrain(sample_size=2000):
+    '''Train a dictionary on the newest {sample_size} events in the store,
+    and use it for new blobs from now on. Existing blobs keep the dictionary
+    they were compressed with.
+
+    @returns: The new dictionary, or None if there's too little data to
+    train on, or it comes out the same as the newest one. (Dictionary)
+    '''
+    samples = [blob.ical for blob in EventData.select(order_by=('-id',),
+                                                      limit=sample_size)]
+    data = train(samples)
+    if len(samples) < 2 or not data:
+        return None
+    if data == dictionary_data(Dictionary.latest()):
+        return None
+    return Dictionary.create(data=data)
+
+
+def retrain_if_due(every=RETRAIN_EVERY):
+    '''Train a new dictionary once {every} blobs have been compressed with the
+    newest one.
+
+    @returns: The new dictionary, or None if it isn't time yet, or training
+    came to nothing. (Dictionary)
+    '''
+    latest = Dictionary.latest()
+    # If training came to nothing last time, wait for as many blobs again.
+    due = _untrained.get(latest, 0) + every
+    count = 0
+    for _, rows in db.db.select_chunks(EventData._meta.table,
+                                       {'dictionary': latest},
+                                       columns=('id',), limit=due):
+        count += len(rows)
+    if count < due:
+        return None
+    dictionary = retrain()
+    if dictionary is None:
+        _untrained[latest] = count
+    return dictionary
+
+
+def _event_changed(action, event):
+    # Blobs go with their events.
+    if action == 'delete' and event.id is not None:
+        db.db.delete(EventData._meta.table, {'event': event.id})
+
+
+Event._meta.listeners.append(_event_changed)
@@ -3,9 +3,6 @@ Functions for processing calendars.
 '''
 
 
-from pytz import timezone as pytz_timezone
-from random import randint
-
 from .persistence import model
 
 
@@ -15,6 +12,8 @@ class Calendar(model.Model):
     name = model.TextField(unique=True, default='Untitled Calendar')
     timezone = model.TimezoneField()
     is_default = model.BooleanField(default=False)
+    # Collection URL on the CalDAV server, for calendars that sync.
+    href = model.TextField(null=True)
 
     def __unicode__(self):
         return unicode(self.name)
@@ -28,6 +27,21 @@ class Event(model.Model):
     start = model.DateTimeField()
     end = model.DateTimeField()
     calendar = model.ForeignKeyField(Calendar)
+    # iCalendar UID, and the URL and ETag of the resource on the CalDAV server,
+    # once the event has been there.
+    uid = model.TextField(null=True)
+    href = model.TextField(null=True)
+    etag = model.TextField(null=True)
+    # The iCalendar SEQUENCE of the copy last imported, and a hash of its
+    # content, so that importing the same copy again can be skipped.
+    sequence = model.IntegerField(default=0)
+    content_hash = model.TextField(null=True)
+
+    class Meta:
+        indexes = (('calendar', 'start', 'end'),
+                   ('start', 'end'))
+        # One copy of each iCalendar event per calendar.
+        unique_indexes = (('calendar', 'uid'),)
 
     def __unicode__(self):
         return unicode(self.summary)
@@ -7,25 +7,68 @@ from __future__ import print_function
 
 import cmd
 import shlex
-import datetime
-
-from pytz import timezone as pytz_timezone
+import sys
 
 import app
+import config
 import lang
+import output
+import tz
+
+
+def _store_errors():
+    '''@returns: The errors a statement can fail with from the store or a sync.
+    Only called once one has been raised, so sqlite3 isn't imported at
+    startup. (tuple)'''
+    import sqlite3
+    return (sqlite3.Error, IOError)
 
 
 class HarmonyCmd(cmd.Cmd):
     def __init__(self, *args, **kwargs):
         cmd.Cmd.__init__(self, *args, **kwargs)
         self.prompt = 'harmony> '
+        # Exit status of the last statement: 0 if it succeeded, 1 if not.
+        self.status = 0
+
+    def error(self, message):
+        '''Report that the current statement failed.'''
+        print('Error: {0}'.format(message), file=self.stdout)
+        self.status = 1
+
+    def execute(self, line):
+        '''Run a single statement non-interactively.
+
+        @returns: The exit status. (int)
+        '''
+        self.onecmd(self.precmd(line))
+        return self.status
+
+    def onecmd(self, line):
+        self.status = 0
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except ValueError as e:
+            # Syntax errors, and bad values in otherwise good statements.
+            self.error(e)
+        except _store_errors() as e:
+            # The store refused the change (say, a calendar whose name is
+            # taken), or a sync with the server failed.
+            self.error(e)
+
+    def default(self, line):
+        self.error('Unknown statement: {0}'.format(line))
 
     def precmd(self, line):
         if line == 'EOF':
-            print('')
+            print('', file=self.stdout)
             return 'quit'
         return line
 
+    def postcmd(self, stop, line):
+        app.app.update_snapshot()
+        return stop
+
     def parseline(self, line):
         '''More or less an exact copy of cmd.Cmd's implementation of this
         method, except run the line through Harmony's lang module. The tuple
@@ -45,16 +88,36 @@ class HarmonyCmd(cmd.Cmd):
                 return None, None, line
         i, n = 0, len(line)
         while i < n and line[i] in self.identchars: i+= 1
-        cmd, args = line[:i], lang.process_line(line)
+        # Keywords are case insensitive, but do_* methods are lower case.
+        cmd, args = line[:i].lower(), lang.process_line(line)
         return cmd, args, line
 
     def do_create(self, args):
         '''Create a new calendar or event.'''
         typ = args['type']
         if typ == 'calendar':
-            app.app.create_calendar(args['name'], args['timezone'])
+            app.app.create_calendar(args['name'], args.get('timezone'),
+                                    default=args.get('default', False))
         elif typ == 'event':
-            print(args)
+            if 'calendar' in args:
+                cal = app.app.find_calendar(args['calendar'])
+                if cal is None:
+                    self.error('No such calendar: {0}'.format(args['calendar']))
+                    return
+            else:
+                cal = app.app.default_calendar
+                if cal is None:
+                    self.error('No calendar given, and no default calendar set')
+                    return
+            start = app.app.user_time_to_utc(args['from'])
+            if 'until' in args:
+                end = app.app.user_time_to_utc(args['until'])
+            else:
+                end = start + args['for']
+            event, conflicts = app.app.create_event(args['name'], cal.id,
+                                                    start, end)
+            for other in conflicts:
+                print('Warning: overlaps {0}'.format(other), file=self.stdout)
 
     def do_delete(self, args):
         '''Delete a calendar or event.'''
@@ -64,38 +127,270 @@ class HarmonyCmd(cmd.Cmd):
         '''List calendars or events.'''
         typ = args['type']
         if typ == 'calendar':
-            lens = [0, 0]
-            for cal in app.app.calendars.values():
-                lpk = len(str(cal.pk))
-                ltz = len(str(cal.timezone))
-                if lpk > lens[0]:
-                    lens[0] = lpk
-                if ltz > lens[1]:
-                    lens[1] = ltz
-            for cal in app.app.calendars.values():
-                print('[{0.pk:-{1[0]}}] '
-                      '({0.timezone!s:{1[1]}}) '
-                      '{0.name}'.format(cal, lens))
+            rows = ((unicode(cal.pk), unicode(cal.timezone), cal.name)
+                    for cal in app.app.calendars.values())
+            with output.pager(self.stdout) as out:
+                output.write_table(rows, out, template=u'[{0}] ({1}) {2}',
+                                   align='><')
         elif typ == 'event':
-            pass
+            with output.pager(self.stdout) as out:
+                output.write_table(self._event_rows(), out,
+                                   template=u'[{0}] {1} - {2}  {3}  {4}',
+                                   align='><<<')
         else:
             pass
 
+    def _event_rows(self):
+        '''Rows for LIST EVENTS, straight from the store as they're read.'''
+        zone = app.settings.timezone
+        for events in app.app.event_chunks():
+            starts = tz.to_local([e.start for e in events], zone)
+            ends = tz.to_local([e.end for e in events], zone)
+            for event, start, end in zip(events, starts, ends):
+                cal = app.app.get_calendar(event.calendar)
+                yield (unicode(event.id),
+                       u'{0:%Y-%m-%d %H:%M}'.format(start),
+                       u'{0:%Y-%m-%d %H:%M %Z}'.format(end),
+                       cal.name if cal is not None else u'',
+                       event.summary)
+
+    def do_freebusy(self, args):
+        '''Show busy time across calendars.'''
+        fb = app.app.freebusy(args['calendars'], args['from'], args['until'])
+        if not fb.busy:
+            print('Free the whole time.', file=self.stdout)
+            return
+        starts = tz.to_local([start for start, _ in fb.busy],
+                             app.settings.timezone)
+        ends = tz.to_local([end for _, end in fb.busy], app.settings.timezone)
+        for start, end in zip(starts, ends):
+            print('{0:%Y-%m-%d %H:%M} - {1:%Y-%m-%d %H:%M %Z}'.format(start,
+                                                                     end),
+                  file=self.stdout)
+
     def do_quit(self, arg):
         '''Quit the interpreter.'''
         return True
 
-    # Completion commands
+    # Completion
+
+    def complete(self, text, state):
+        '''readline's completer. Unlike cmd.Cmd's, this doesn't go through
+        parseline, which can't make sense of a half-typed statement.'''
+        if state == 0:
+            import readline
+            origline = readline.get_line_buffer()
+            line = origline.lstrip()
+            stripped = len(origline) - len(line)
+            begidx = readline.get_begidx() - stripped
+            endidx = readline.get_endidx() - stripped
+            self.completion_matches = self.completions(text, line, begidx,
+                                                       endidx)
+        try:
+            return self.completion_matches[state]
+        except IndexError:
+            return None
+
+    def completions(self, text, line, begidx, endidx):
+        '''Complete {text}, the part of the word being typed that readline
+        will replace, at {begidx} in {line}.
+
+        @returns: What {text} could be replaced with. (list of str)
+        '''
+        tokens, partial, quoted = _split_partial(line[:endidx])
+        index = app.app.completion_index()
+        found = []
+        for kind, allowed in _completion_kinds([t.upper() for t in tokens]):
+            words = index.complete(kind, partial)
+            if allowed is not None:
+                words = [w for w in words if w in allowed]
+            if kind in ('statement', 'keyword') and partial.islower():
+                words = [w.lower() for w in words]
+            found.extend(words)
+        # {text} is the end of {partial}; what comes before it stays put.
+        keep = len(partial) - len(text)
+        if keep < 0:
+            return []
+        matches = []
+        for word in found:
+            if not quoted and keep == 0 and any(c.isspace() for c in word):
+                word = u'"{}"'.format(word)
+            else:
+                word = word[keep:]
+            if isinstance(word, unicode):
+                word = word.encode('utf-8')
+            matches.append(word)
+        return matches
+
+
+def _split_partial(line):
+    '''Split {line} into the words before the one being typed, and that one.
+
+    @returns: The words before, the word being typed, and whether it's in
+    open quotes. (tuple of list, str and bool)
+    '''
+    lexer = shlex.shlex(line, posix=True)
+    lexer.whitespace_split = True
+    tokens = []
+    try:
+        for token in lexer:
+            tokens.append(token)
+    except ValueError:
+        # No closing quotation: the word being typed is in quotes.
+        return tokens, lexer.token, True
+    if line and not line[-1].isspace() and tokens:
+        return tokens, tokens.pop(), False
+    return tokens, '', False
+
+
+def _completion_kinds(tokens):
+    '''@returns: The kinds of words that can come after {tokens}, upper
+    case, each with the only words of that kind that fit there, or None if
+    any do. (list of tuples)'''
+    if not tokens:
+        return [('statement', None)]
+    if tokens == ['CREATE']:
+        return [('keyword', ('CALENDAR', 'DEFAULT', 'EVENT'))]
+    if tokens == ['LIST']:
+        return [('keyword', ('CALENDARS', 'EVENTS'))]
+    if tokens == ['SET']:
+        return [('setting', None)]
+    if tokens == ['CREATE', 'EVENT']:
+        return [('summary', None)]
+    if tokens[-2:] == ['IN', 'CALENDAR']:
+        return [('calendar', None)]
+    if tokens[0] == 'FREEBUSY' and 'FROM' not in tokens:
+        if tokens == ['FREEBUSY']:
+            return [('keyword', ('FOR', 'FROM'))]
+        return [('calendar', None), ('keyword', ('FROM',))]
+    return [('keyword', None)]
+
+
+def load_config():
+    '''Load the config file, reporting any errors.
+
+    @returns: True if it loaded. (bool)
+    '''
+    try:
+        app.load_config()
+    except config.ConfigError as e:
+        print(e, file=sys.stderr)
+        return False
+    return True
+
 
-    def complete_create(self, text, line, begidx, endidx):
-        if begidx == 7:
-            return [arg for arg in HarmonyCmd.CREATE_ARGS
-                    if arg.startswith(text.lower())]
+def run_statements(statements, path=None, use_server=True):
+    '''Run {statements}, on the server listening at {path} if there is one, and
+    here otherwise.
+
+    @param path: The server's socket, or None for server.SOCKET_PATH. (str)
+    @returns: The worst exit status of any of the statements. (int)
+    '''
+    import server
+    if path is None:
+        path = server.SOCKET_PATH
+    shell = None
+    status = 0
+    for statement in statements:
+        if use_server:
+            try:
+                result, output = server.send(statement, path)
+            except server.NoServerError:
+                use_server = False
+            else:
+                sys.stdout.write(output)
+                status = max(status, result)
+                continue
+        if shell is None:
+            if not load_config():
+                return 1
+            shell = HarmonyCmd()
+        status = max(status, shell.execute(statement))
+    if shell is not None:
+        app.app.update_snapshot()
+    return status
+
+
+def remind(alarm, out=None):
+    '''Print a reminder for {alarm}, which has come due.'''
+    event = app.app.get_event(alarm.event)
+    if event is None:
+        return
+    start = tz.to_local([event.start], app.settings.timezone)[0]
+    message = alarm.description or event.summary
+    print(u'Reminder: {0} at {1:%Y-%m-%d %H:%M %Z}'.format(message, start),
+          file=out or sys.stderr)
+
+
+def serve(path=None):
+    '''Keep the store open and run statements sent by other harmony processes
+    until interrupted.
+
+    @param path: The socket to listen on, or None for server.SOCKET_PATH.
+    (str)
+    '''
+    import server
+    if path is None:
+        path = server.SOCKET_PATH
+    def execute(statement, out):
+        # Another process may have written to the store, or the config file
+        # may have changed, since the last statement; don't answer from stale
+        # caches.
+        app.load_config()
+        app.app.refresh()
+        try:
+            return HarmonyCmd(stdout=out).execute(statement)
+        finally:
+            app.app.update_snapshot()
+
+    try:
+        srv = server.HarmonyServer(path, execute)
+    except server.ServerRunningError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if not load_config():
+        srv.server_close()
+        return 1
+    app.app.ensure_store()
+    # The store may have changed while there was no server to see it.
+    app.app.update_snapshot(rebuild=True)
+    app.app.start_alarms(remind)
+    print('Listening on {0}'.format(path), file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.app.alarms.stop()
+        srv.server_close()
+    return 0
 
 
-def main():
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='harmony')
+    parser.add_argument('-e', '--exec', dest='statements', action='append',
+                        default=[], metavar='STATEMENT',
+                        help='run STATEMENT and exit; may be given more than '
+                             'once')
+    parser.add_argument('--serve', action='store_true',
+                        help='keep running, and run statements for other '
+                             'harmony processes')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='socket the server listens on (default: '
+                             '~/.harmony/harmony.sock)')
+    parser.add_argument('--no-server', dest='use_server', action='store_false',
+                        help="run statements here, even if there's a server")
+    args = parser.parse_args(argv)
+    if args.serve:
+        return serve(args.socket)
+    if args.statements:
+        return run_statements(args.statements, args.socket, args.use_server)
+    if not load_config():
+        return 1
     HarmonyCmd().cmdloop()
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,104 @@
+'''
+What the shell can complete: keywords, calendar names, setting names, and the
+summaries of recent events, each indexed in a prefix trie.
+
+The index is built from the store once, and kept up to date as calendars and
+events are saved and deleted after that, so completing never goes back to the
+store.
+'''
+
+from collections import OrderedDict
+from threading import Lock
+
+from .calendar import Calendar, Event
+from .lang import KEYWORDS, STATEMENTS
+from .persistence import db
+from .settings import Settings
+from .trie import Trie
+
+
+# How many of the most recently created or changed events' summaries to offer.
+RECENT_EVENTS = 1000
+
+
+class CompletionIndex(object):
+    '''
+    Tries of the words the shell can complete, by kind: 'statement',
+    'keyword', 'calendar', 'setting' and 'summary'.
+    '''
+
+    def __init__(self, recent_events=RECENT_EVENTS):
+        self.recent_events = recent_events
+        self._tries = {'statement': Trie(STATEMENTS),
+                       'keyword': Trie(KEYWORDS),
+                       'setting': Trie(Settings.names()),
+                       'calendar': Trie(),
+                       'summary': Trie()}
+        # Calendar names, by id, so a renamed calendar's old name can be
+        # taken out.
+        self._calendars = {}
+        # Summaries of the recent events, by id, oldest first.
+        self._recent = OrderedDict()
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, recent_events=RECENT_EVENTS):
+        '''@returns: An index of the calendars and recent events in the
+        store. (CompletionIndex)'''
+        index = cls(recent_events)
+        cols = Calendar.select_columns(('id', 'name'))
+        for calendar_id, name in zip(cols['id'], cols['name']):
+            index._calendar(calendar_id, name)
+        newest = []
+        for _, rows in db.db.select_chunks(Event._meta.table,
+                                           columns=('id', 'summary'),
+                                           order_by=('-id',),
+                                           limit=recent_events):
+            newest.extend(rows)
+        for event_id, summary in reversed(newest):
+            index._event(event_id, summary)
+        return index
+
+    def complete(self, kind, prefix, limit=None):
+        '''@returns: Up to {limit} words of {kind} starting with {prefix}.
+        (list of unicode)'''
+        with self._lock:
+            return self._tries[kind].complete(prefix, limit)
+
+    def calendar_changed(self, action, calendar):
+        '''Model listener for Calendar.'''
+        with self._lock:
+            if action == 'delete':
+                self._calendar(calendar.id, None)
+            else:
+                self._calendar(calendar.id, calendar.name)
+
+    def event_changed(self, action, event):
+        '''Model listener for Event.'''
+        with self._lock:
+            if action == 'delete':
+                self._event(event.id, None)
+            else:
+                self._event(event.id, event.summary)
+
+    def _calendar(self, calendar_id, name):
+        tries = self._tries['calendar']
+        old = self._calendars.pop(calendar_id, None)
+        if old is not None:
+            tries.discard(old)
+        if name:
+            self._calendars[calendar_id] = name
+            tries.add(name)
+
+    def _event(self, event_id, summary):
+        tries = self._tries['summary']
+        old = self._recent.pop(event_id, None)
+        if old is not None:
+            tries.discard(old)
+        if not summary:
+            return
+        self._recent[event_id] = summary
+        tries.add(summary)
+        while len(self._recent) > self.recent_events:
+            _, dropped = self._recent.popitem(last=False)
+            tries.discard(dropped)
@@ -0,0 +1,154 @@
+'''
+The config file. It's a list of SET statements, one per line, in the same
+language as the command line:
+
+    # Who and where I am
+    SET realname = "Eryn Wells"
+    SET timezone = America/Los_Angeles
+
+Long lines can be folded: a line that starts with whitespace continues the one
+before it, as in iCalendar. Blank lines, and lines starting with #, are
+ignored.
+
+Parsing and validating the file is slow next to everything else Harmony does at
+startup, and the file hardly ever changes, so the checked values are kept in a
+snapshot file next to it. As long as the config file's modification time and
+size are what they were when the snapshot was made, the snapshot is used
+instead.
+'''
+
+import marshal
+import os
+import shlex
+
+from . import lang
+
+
+# Bump this when the snapshot layout changes.
+SNAPSHOT_VERSION = 1
+
+# The snapshot key each config file was last loaded with, and into what, so
+# that loading an unchanged file again is just a stat().
+_loaded = {}
+
+
+class ConfigError(ValueError):
+    '''Raised for a config file that can't be loaded.'''
+    def __init__(self, path, lineno, message):
+        super(ConfigError, self).__init__('{}:{}: {}'.format(path, lineno,
+                                                             message))
+        self.path = path
+        self.lineno = lineno
+
+
+def unfold(lines):
+    '''Join folded lines, and drop blank lines and comments.
+
+    @param lines: Lines of the config file, in UTF-8. (iterable of str)
+    @returns: (lineno, line) pairs, where lineno is where the logical line
+    starts. (generator)
+    '''
+    start = None
+    parts = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if line[0] in ' \t' and parts:
+            parts.append(stripped)
+            continue
+        if parts:
+            yield start, ' '.join(parts)
+        start = lineno
+        parts = [stripped]
+    if parts:
+        yield start, ' '.join(parts)
+
+
+def parse(lines, settings, path='<config>'):
+    '''Parse and check the lines of a config file.
+
+    @param settings: Settings to check the values against. (Settings)
+    @returns: The values, untransformed, by setting name. (dict)
+    @raises ConfigError: If a line isn't a valid SET statement.
+    '''
+    values = {}
+    for lineno, line in unfold(lines):
+        try:
+            tokens = [t.decode('utf-8') for t in shlex.split(line)]
+            stmt = lang.parse(tokens)
+            if stmt['action'] != 'set':
+                raise ValueError('Only SET statements are allowed')
+            settings.check(stmt['setting'], stmt['value'])
+        except ValueError as e:
+            raise ConfigError(path, lineno, e)
+        values[stmt['setting']] = stmt['value']
+    return values
+
+
+def snapshot_path(path):
+    return path + '.snapshot'
+
+
+def _snapshot_key(path, settings):
+    st = os.stat(path)
+    return (SNAPSHOT_VERSION, os.path.abspath(path), st.st_mtime, st.st_size,
+            tuple(sorted(settings._settings)))
+
+
+def _read_snapshot(path, key):
+    try:
+        with open(path, 'rb') as f:
+            snapshot_key, values = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if snapshot_key != key:
+        return None
+    return values
+
+
+def _write_snapshot(path, key, values):
+    # Write to the side and rename, so a reader never sees half a snapshot.
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            marshal.dump((key, values), f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        # The snapshot is only a shortcut.
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def load(settings, path, use_snapshot=True):
+    '''Load the config file at {path} into {settings}. If there's no file, the
+    settings are left alone.
+
+    @param use_snapshot: Read and write the snapshot of checked values. (bool)
+    @returns: True if the file was unchanged since it was last loaded, or was
+    loaded from the snapshot; False if it had to be parsed, or there isn't
+    one. (bool)
+    @raises ConfigError: If the file has errors. The settings are left alone.
+    '''
+    try:
+        key = _snapshot_key(path, settings)
+    except OSError:
+        return False
+    if _loaded.get(path) == (key, id(settings)):
+        return True
+    if use_snapshot:
+        values = _read_snapshot(snapshot_path(path), key)
+        if values is not None:
+            settings.load_checked(values)
+            _loaded[path] = (key, id(settings))
+            return True
+    with open(path) as f:
+        values = parse(f, settings, path)
+    settings.load_checked(values)
+    _loaded[path] = (key, id(settings))
+    if use_snapshot:
+        _write_snapshot(snapshot_path(path), key, values)
+    return False
@@ -0,0 +1,197 @@
+'''
+Fast date and time parsing. strptime is general, and slow because of it; the
+handful of fixed-width formats Harmony actually reads (its own storage format,
+ISO 8601 dates, iCalendar timestamps) are much faster to take apart by hand.
+'''
+
+from __future__ import absolute_import
+
+from datetime import datetime
+from calendar import timegm
+
+
+# Storage format of DateTimeField.
+STORAGE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# iCalendar DATE-TIME and DATE values (RFC 5545 3.3.4, 3.3.5).
+ICAL_DATETIME_FORMAT = '%Y%m%dT%H%M%S'
+ICAL_DATE_FORMAT = '%Y%m%d'
+
+
+#
+# Fixed-format parsers. Each takes apart a string laid out exactly like its
+# format, zero padding and all. Strings of any other length get None back, so
+# that strptime, which doesn't insist on padding, gets a say. Strings of the
+# right length but with the wrong separators or bad values raise ValueError:
+# strptime would reject those too, so there's no point asking it.
+#
+
+def _check(s, seps):
+    for i, sep in seps:
+        if s[i] != sep:
+            raise ValueError('Invalid datetime string: {}'.format(s))
+
+
+def _parse_ymd(s):
+    if len(s) != 10:
+        return None
+    _check(s, ((4, '-'), (7, '-')))
+    return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
+
+def _parse_dmy(s):
+    if len(s) != 10:
+        return None
+    _check(s, ((2, '/'), (5, '/')))
+    return datetime(int(s[6:10]), int(s[3:5]), int(s[0:2]))
+
+
+def _parse_mdy(s):
+    if len(s) != 10:
+        return None
+    _check(s, ((2, '/'), (5, '/')))
+    return datetime(int(s[6:10]), int(s[0:2]), int(s[3:5]))
+
+
+def _parse_hm(s):
+    if len(s) != 5:
+        return None
+    _check(s, ((2, ':'),))
+    return datetime(1900, 1, 1, int(s[0:2]), int(s[3:5]))
+
+
+def _parse_stored(s):
+    if len(s) != 19:
+        return None
+    _check(s, ((4, '-'), (7, '-'), (10, ' '), (13, ':'), (16, ':')))
+    return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                    int(s[11:13]), int(s[14:16]), int(s[17:19]))
+
+
+def _parse_ical_datetime(s):
+    if len(s) != 15:
+        return None
+    _check(s, ((8, 'T'),))
+    return datetime(int(s[0:4]), int(s[4:6]), int(s[6:8]),
+                    int(s[9:11]), int(s[11:13]), int(s[13:15]))
+
+
+def _parse_ical_date(s):
+    if len(s) != 8:
+        return None
+    return datetime(int(s[0:4]), int(s[4:6]), int(s[6:8]))
+
+
+# strptime formats that have a hand-written parser.
+FAST_PARSERS = {
+    '%Y-%m-%d': _parse_ymd,
+    '%d/%m/%Y': _parse_dmy,
+    '%m/%d/%Y': _parse_mdy,
+    '%H:%M': _parse_hm,
+    STORAGE_FORMAT: _parse_stored,
+    ICAL_DATETIME_FORMAT: _parse_ical_datetime,
+    ICAL_DATE_FORMAT: _parse_ical_date,
+}
+
+
+def parse(s, fmt):
+    '''Parse {s} with {fmt}, like datetime.strptime, using a fixed-format
+    parser when there is one.
+
+    @raises ValueError: If {s} doesn't match {fmt}.
+    '''
+    fast = FAST_PARSERS.get(fmt)
+    if fast is not None:
+        dt = fast(s)
+        if dt is not None:
+            return dt
+    return datetime.strptime(s, fmt)
+
+
+class Parser(object):
+    '''
+    Parses strings that may be in any of several formats.
+
+    Formats are tried in order, and the first that matches wins. With
+    {remember} set, the parser also remembers the last format that matched and
+    tries it first next time: data from a single source (an import file, a
+    server) nearly always uses one format throughout, so most values then match
+    on the first try. Use one Parser per source.
+    '''
+
+    def __init__(self, fmts, remember=True):
+        self.fmts = tuple(fmts)
+        self.remember = remember
+        self.last_fmt = None
+
+    def parse(self, s):
+        '''Parse {s} with the first format that fits.
+
+        @raises ValueError: If none of the formats match.
+        '''
+        last = self.last_fmt
+        if last is not None:
+            try:
+                return parse(s, last)
+            except ValueError:
+                pass
+        for fmt in self.fmts:
+            if fmt == last:
+                continue
+            try:
+                dt = parse(s, fmt)
+            except ValueError:
+                continue
+            if self.remember:
+                self.last_fmt = fmt
+            return dt
+        raise ValueError('Invalid datetime string: {}'.format(s))
+
+    def parse_many(self, strings):
+        '''Parse a batch of strings. The format is detected from the first of
+        them and reused as long as it keeps matching.
+
+        @returns: Parsed datetimes, in order. (list of datetime)
+        '''
+        parse_one = self.parse
+        fmt = None
+        fast = None
+        result = []
+        append = result.append
+        for s in strings:
+            dt = None
+            if fast is not None:
+                try:
+                    dt = fast(s)
+                except ValueError:
+                    dt = None
+            if dt is None:
+                dt = parse_one(s)
+                if self.last_fmt is not fmt:
+                    fmt = self.last_fmt
+                    fast = FAST_PARSERS.get(fmt)
+            append(dt)
+        return result
+
+
+def parse_stored(s):
+    '''Parse a DateTimeField storage string into a naive datetime.'''
+    dt = _parse_stored(s)
+    if dt is None:
+        return datetime.strptime(s, STORAGE_FORMAT)
+    return dt
+
+
+def format_stored(dt):
+    '''Format a naive datetime in DateTimeField's storage format. Unlike
+    strftime, this works for years before 1900.'''
+    return u'{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(
+            dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
+
+def stored_to_epoch(s):
+    '''Convert a DateTimeField storage string straight to seconds since the
+    epoch, without building a datetime.'''
+    if len(s) == 19 and s[4] == '-' and s[10] == ' ' and s[13] == ':':
+        return timegm((int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                       int(s[11:13]), int(s[14:16]), int(s[17:19])))
+    return timegm(datetime.strptime(s, STORAGE_FORMAT).timetuple())
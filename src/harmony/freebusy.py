@@ -0,0 +1,108 @@
+'''
+Free/busy computation. Busy time is gathered from the store with range queries
+on the event time index, one calendar at a time, and the intervals are then
+merged with a single sweep.
+'''
+
+from datetime import datetime, timedelta
+
+from .calendar import Event
+from .tz import EPOCH, epoch as _epoch, get_timezone
+
+
+def merge_intervals(intervals):
+    '''Merge overlapping and adjacent intervals.
+
+    @param intervals: (start, end) pairs of anything comparable, in any order.
+    (iterable)
+    @returns: Disjoint intervals, sorted by start. (list of tuple)
+    '''
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def _datetime(epoch):
+    return (EPOCH + timedelta(seconds=epoch)).replace(
+            tzinfo=get_timezone('UTC'))
+
+
+class FreeBusy(object):
+    '''
+    Availability over a time range. {busy} is a list of disjoint (start, end)
+    pairs of UTC datetimes, in order, clipped to the range.
+    '''
+
+    def __init__(self, start, end, busy):
+        self.start = start
+        self.end = end
+        self.busy = busy
+
+    @property
+    def free(self):
+        '''The gaps between the busy periods, as (start, end) pairs.'''
+        free = []
+        cursor = self.start
+        for start, end in self.busy:
+            if start > cursor:
+                free.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < self.end:
+            free.append((cursor, self.end))
+        return free
+
+    def to_ical(self):
+        '''Render as a VFREEBUSY component.
+
+        @returns: The component. (icalendar.FreeBusy)
+        '''
+        import icalendar
+        component = icalendar.FreeBusy()
+        component.add('dtstamp', datetime.now(get_timezone('UTC')))
+        component.add('dtstart', self.start)
+        component.add('dtend', self.end)
+        if self.busy:
+            component.add('freebusy', self.busy)
+        return component
+
+
+def freebusy(calendars, start, end):
+    '''Work out when the owner of {calendars} is busy between {start} and {end}.
+
+    @param calendars: Calendars, or their ids. (list)
+    @param start: Start of the range. Naive datetimes are taken to be UTC.
+    (datetime)
+    @param end: End of the range. (datetime)
+    @returns: Availability. (FreeBusy)
+    '''
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=get_timezone('UTC'))
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=get_timezone('UTC'))
+    fields = Event._meta.fields
+    lower = fields['end'].db_value(start)
+    upper = fields['start'].db_value(end)
+    start_epoch = _epoch(start)
+    end_epoch = _epoch(end)
+
+    intervals = []
+    for cal in calendars:
+        cal_id = getattr(cal, 'id', cal)
+        # Anything that starts before the range ends and ends after it starts.
+        # With the (calendar, start, end) index, this is a single range scan.
+        cols = Event.select_columns(('start', 'end'),
+                                    epoch_columns=('start', 'end'),
+                                    calendar=cal_id, start__lt=upper,
+                                    end__gt=lower)
+        intervals.extend(zip(cols['start'], cols['end']))
+
+    busy = []
+    for s, e in merge_intervals(intervals):
+        busy.append((_datetime(max(s, start_epoch)),
+                     _datetime(min(e, end_epoch))))
+    return FreeBusy(start, end, busy)
@@ -0,0 +1,205 @@
+'''
+Converting events to and from iCalendar data. icalendar is only imported when
+one of these is first called.
+'''
+
+from datetime import date, datetime, time, timedelta
+
+from .alarms import Alarm
+from .tz import get_timezone
+
+
+# Event fields that map onto VEVENT properties.
+FIELDS = ('summary', 'all_day', 'start', 'end')
+
+
+def _utc(value):
+    '''A DATE or DATE-TIME value as an aware UTC datetime. Floating times and
+    dates are taken to be in UTC.'''
+    utc = get_timezone('UTC')
+    if not isinstance(value, datetime):
+        return datetime.combine(value, time()).replace(tzinfo=utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=utc)
+    return value.astimezone(utc)
+
+
+def _vevent_values(vevent):
+    start = vevent.decoded('dtstart')
+    if 'dtend' in vevent:
+        end = vevent.decoded('dtend')
+    else:
+        end = start
+    return {
+        'uid': unicode(vevent.get('uid')) if 'uid' in vevent else None,
+        'summary': unicode(vevent.get('summary', u'')),
+        'all_day': not isinstance(start, datetime),
+        'start': _utc(start),
+        'end': _utc(end),
+    }
+
+
+def _valarm_values(valarm):
+    '''Values for the Alarm fields from a VALARM, or None if it has no
+    trigger. REPEAT and DURATION aren't supported; an alarm goes off once.'''
+    if 'trigger' not in valarm:
+        return None
+    trigger = valarm.decoded('trigger')
+    values = {
+        'action': unicode(valarm.get('action', u'DISPLAY')).upper(),
+        'description': (unicode(valarm['description'])
+                        if 'description' in valarm else None),
+    }
+    if isinstance(trigger, timedelta):
+        related = valarm['trigger'].params.get('RELATED', 'START')
+        values['related'] = u'end' if related.upper() == 'END' else u'start'
+        values['offset'] = (trigger.days * 86400 + trigger.seconds)
+    else:
+        values['at'] = _utc(trigger)
+    return values
+
+
+def event_values(data):
+    '''Read the first VEVENT out of iCalendar data.
+
+    @param data: An iCalendar object. (str)
+    @returns: Its uid, and values for the Event fields in FIELDS, by name.
+    (dict)
+    @raises ValueError: If there's no VEVENT.
+    '''
+    import icalendar
+    events = icalendar.Calendar.from_ical(data).walk('VEVENT')
+    if not events:
+        raise ValueError('No VEVENT in iCalendar data')
+    return _vevent_values(events[0])
+
+
+def content_hash(vevent):
+    '''A hash of everything in a VEVENT except its DTSTAMP, which changes
+    every time the event is sent, whether anything else has or not.
+
+    @returns: The hash, in hex. (str)
+    '''
+    import hashlib
+    lines = [line for line in vevent.to_ical().splitlines()
+             if not line.upper().startswith('DTSTAMP')]
+    return hashlib.sha1('\n'.join(lines)).hexdigest()
+
+
+def _standalone(cal, vevent):
+    '''iCalendar data for {vevent} on its own, with the calendar properties
+    and timezones from {cal} it may need.'''
+    import icalendar
+    single = icalendar.Calendar()
+    for name, value in cal.items():
+        if name != 'METHOD':
+            single.add(name, value)
+    for timezone in cal.walk('VTIMEZONE'):
+        single.add_component(timezone)
+    single.add_component(vevent)
+    return single.to_ical()
+
+
+def import_events(data, calendar, seen=None):
+    '''Make events out of the VEVENTs in iCalendar data, like an invite. An
+    event that's already in {calendar}, going by its UID, is updated rather
+    than added again, and only if the incoming copy is at least as new, going
+    by its SEQUENCE, and has changed, going by its content hash. So importing
+    the same data again writes nothing. Overrides of single instances of
+    recurring events are skipped.
+
+    Each event is followed by its original iCalendar data, as an EventData
+    blob (see harmony.blobs), and then its alarms, from its VALARMs. Saving a
+    new copy of an event deletes the alarms of the old one, and a copy that
+    comes after another in {seen} drops that one's alarms, saved or not.
+
+    @param data: An iCalendar object. (str)
+    @param calendar: Calendar new events go in. (Calendar)
+    @param seen: Events imported earlier but not saved yet, with their blobs
+    and alarms, by UID. Events imported here are added to it. (dict)
+    @returns: The new or changed events, each followed by its blob and
+    alarms, unsaved, in the order they need to be saved. (list of Model)
+    @raises ValueError: If {data} isn't iCalendar data.
+    '''
+    import icalendar
+    from .blobs import EventData
+    from .calendar import Event
+    if seen is None:
+        seen = {}
+    calendar_id = getattr(calendar, 'id', calendar)
+    instances = []
+    cal = icalendar.Calendar.from_ical(data)
+    for vevent in cal.walk('VEVENT'):
+        if 'recurrence-id' in vevent:
+            continue
+        values = _vevent_values(vevent)
+        uid = values.pop('uid')
+        sequence = int(vevent.get('sequence', 0))
+        digest = content_hash(vevent)
+        event, blob, alarms = seen.get(uid, (None, None, ()))
+        if event is None and uid is not None:
+            event = next(iter(Event.select(calendar=calendar_id, uid=uid)),
+                         None)
+        if event is None:
+            event = Event(calendar=calendar, uid=uid)
+        elif (sequence < event.sequence
+                or (sequence == event.sequence
+                    and digest == event.content_hash)):
+            # An older copy, or the same one again.
+            continue
+        for name, value in values.items():
+            setattr(event, name, value)
+        event.sequence = sequence
+        event.content_hash = digest
+        blob = EventData.store(event, _standalone(cal, vevent), blob)
+        for alarm in alarms:
+            # The earlier copy's. Ones already saved go when the event is
+            # saved again; see harmony.alarms.
+            alarm.drop()
+            if alarm in instances:
+                instances.remove(alarm)
+        alarms = []
+        for valarm in vevent.walk('VALARM'):
+            alarm_values = _valarm_values(valarm)
+            if alarm_values is not None:
+                alarm = Alarm(event=event, **alarm_values)
+                alarm.schedule(event)
+                alarms.append(alarm)
+        if uid is not None:
+            seen[uid] = (event, blob, alarms)
+        instances.extend((event, blob))
+        instances.extend(alarms)
+    return instances
+
+
+def event_to_ical(values, uid, base=None):
+    '''Render an event as an iCalendar object holding one VEVENT.
+
+    @param values: Values of the Event fields in FIELDS, by name. (dict)
+    @param uid: The event's UID. (unicode)
+    @param base: The event's iCalendar data as it is on the server. If given,
+    its VEVENT is updated rather than replaced, so properties Harmony doesn't
+    know about survive. (str)
+    @returns: The iCalendar data. (str)
+    '''
+    import icalendar
+    if base is not None:
+        cal = icalendar.Calendar.from_ical(base)
+        vevent = cal.walk('VEVENT')[0]
+    else:
+        from .app import ICAL_PRODID, ICAL_VERSION_STRING
+        cal = icalendar.Calendar()
+        cal.add('prodid', ICAL_PRODID)
+        cal.add('version', ICAL_VERSION_STRING)
+        vevent = icalendar.Event()
+        cal.add_component(vevent)
+    start, end = _utc(values['start']), _utc(values['end'])
+    if values['all_day']:
+        start, end = start.date(), end.date()
+    for name, value in (('uid', uid), ('summary', values['summary'] or u''),
+                        ('dtstart', start), ('dtend', end),
+                        ('dtstamp', datetime.now(get_timezone('UTC')))):
+        if name in vevent:
+            del vevent[name]
+        vevent.add(name, value)
+    return cal.to_ical()
@@ -0,0 +1,181 @@
+'''
+An interval tree, for answering "what overlaps this time range?" without
+looking at every event.
+
+The tree is a treap ordered by interval start, where every node also tracks the
+largest end point in its subtree. A query can then skip any subtree that ends
+before the range starts, or whose starts all come after it ends, so it runs in
+O(log n + k) expected time for k results. Inserts and removals are O(log n)
+expected, so the tree can be kept up to date as events change.
+
+Intervals are half-open: [start, end).
+'''
+
+from random import random
+
+
+class _Node(object):
+    __slots__ = ('start', 'end', 'key', 'priority', 'max_end', 'left', 'right')
+
+    def __init__(self, start, end, key, priority):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.priority = priority
+        self.max_end = end
+        self.left = None
+        self.right = None
+
+    def update(self):
+        max_end = self.end
+        if self.left is not None and self.left.max_end > max_end:
+            max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > max_end:
+            max_end = self.right.max_end
+        self.max_end = max_end
+
+
+def _split(node, start, key):
+    '''Split a treap into nodes ordered before (start, key) and the rest.'''
+    if node is None:
+        return None, None
+    if (node.start, node.key) < (start, key):
+        node.right, right = _split(node.right, start, key)
+        node.update()
+        return node, right
+    left, node.left = _split(node.left, start, key)
+    node.update()
+    return left, node
+
+
+def _merge(left, right):
+    '''Merge two treaps, where everything in {left} orders before {right}.'''
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+def _build(items):
+    '''Build a treap from (start, end, key) items, sorted by (start, key), in
+    O(n). This is the usual stack-based Cartesian tree construction.'''
+    stack = []
+    for start, end, key in items:
+        node = _Node(start, end, key, random())
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+            last.update()
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    root = None
+    while stack:
+        root = stack.pop()
+        root.update()
+    return root
+
+
+class IntervalTree(object):
+    '''
+    A set of intervals, each identified by a unique key.
+    '''
+
+    def __init__(self, intervals=()):
+        '''
+        @param intervals: Initial (key, start, end) triples. (iterable)
+        '''
+        self._intervals = {}
+        for key, start, end in intervals:
+            self._intervals[key] = (start, end)
+        items = sorted(((start, end, key)
+                        for key, (start, end) in self._intervals.items()),
+                       key=lambda item: (item[0], item[2]))
+        self._root = _build(items)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __contains__(self, key):
+        return key in self._intervals
+
+    def get(self, key):
+        '''@returns: The (start, end) of the interval with {key}, or None.'''
+        return self._intervals.get(key)
+
+    def add(self, key, start, end):
+        '''Add an interval, replacing any existing interval with the same
+        {key}.'''
+        if key in self._intervals:
+            self.discard(key)
+        self._intervals[key] = (start, end)
+        node = _Node(start, end, key, random())
+        left, right = _split(self._root, start, key)
+        self._root = _merge(_merge(left, node), right)
+
+    def discard(self, key):
+        '''Remove the interval with {key}, if there is one.'''
+        interval = self._intervals.pop(key, None)
+        if interval is None:
+            return
+        start = interval[0]
+        left, rest = _split(self._root, start, key)
+        # {rest} starts with the node to remove; split it off the front.
+        node, right = self._pop_first(rest)
+        self._root = _merge(left, right)
+
+    def _pop_first(self, node):
+        if node is None:
+            return None, None
+        if node.left is None:
+            right = node.right
+            node.right = None
+            return node, right
+        first, node.left = self._pop_first(node.left)
+        node.update()
+        return first, node
+
+    def overlapping(self, start, end):
+        '''Find the intervals that overlap [start, end).
+
+        @returns: (key, start, end) triples, ordered by start. (list)
+        '''
+        return self._query(start, end, False)
+
+    def at(self, point):
+        '''Find the intervals that contain {point}.
+
+        @returns: (key, start, end) triples, ordered by start. (list)
+        '''
+        return self._query(point, point, True)
+
+    def _query(self, start, end, closed):
+        found = []
+        stack = []
+        node = self._root
+        # In-order traversal, pruned: a subtree whose max_end is at or before
+        # {start} can't overlap, and once a node starts after the range, nor
+        # can it or anything to its right.
+        while stack or node is not None:
+            if node is not None:
+                if node.max_end <= start:
+                    node = None
+                    continue
+                stack.append(node)
+                node = node.left
+                continue
+            node = stack.pop()
+            if node.start > end or (node.start == end and not closed):
+                break
+            if node.end > start:
+                found.append((node.key, node.start, node.end))
+            node = node.right
+        return found
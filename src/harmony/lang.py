@@ -7,7 +7,8 @@ import datetime
 import re
 import shlex
 
-from pytz import timezone
+from .dateparse import Parser
+from .tz import get_timezone
 
 
 ################################################################################
@@ -25,6 +26,7 @@ EQUAL = _keyword('=')
 EVENT = _keyword('EVENT')
 EVENTS = _keyword('EVENTS')
 FOR = _keyword('FOR')
+FREEBUSY = _keyword('FREEBUSY')
 FROM = _keyword('FROM')
 IN = _keyword('IN')
 LIST = _keyword('LIST')
@@ -40,6 +42,12 @@ MINUTES = _keyword('MINUTES?')
 WEEKS = _keyword('WEEKS?')
 TIME_TOKENS = (DAYS, HOURS, MINUTES, WEEKS)
 
+# Words that start a statement, and every keyword, for completion.
+STATEMENTS = ('CREATE', 'FREEBUSY', 'LIST', 'QUIT', 'SET')
+KEYWORDS = ('AT', 'CALENDAR', 'CALENDARS', 'CREATE', 'DAYS', 'DEFAULT',
+            'EVENT', 'EVENTS', 'FOR', 'FREEBUSY', 'FROM', 'HOURS', 'IN', 'LIST',
+            'MINUTES', 'ON', 'QUIT', 'SET', 'TIMEZONE', 'UNTIL', 'WEEKS')
+
 LITERAL = _keyword('\w+')
 NUMBER = _keyword('\d+(\.\d*)?')
 
@@ -47,6 +55,11 @@ NUMBER = _keyword('\d+(\.\d*)?')
 DATE_FMTS = ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y')
 TIME_FMTS = ('%H:%M',)
 
+# Parsers for the formats above. These don't remember the last format that
+# matched, since that would make an ambiguous date like 01/02/2013 mean
+# different things depending on what was typed before it.
+_parsers = {}
+
 
 ################################################################################
 ## TOP LEVEL
@@ -68,8 +81,12 @@ def parse(tokens):
         stmt = parse_list_stmt(tokens)
     elif accept (SET, tokens):
         stmt = parse_set_stmt(tokens)
+    elif accept(FREEBUSY, tokens):
+        stmt = parse_freebusy_stmt(tokens)
     elif accept(QUIT, tokens):
         stmt = {'action': 'quit'}
+    else:
+        error(tokens, 'a statement')
     expect_eol(tokens)
     return stmt
 
@@ -129,6 +146,18 @@ def parse_set_stmt(tokens):
     return stmt
 
 
+def parse_freebusy_stmt(tokens):
+    stmt = {'action': 'freebusy', 'calendars': []}
+    if accept(FOR, tokens):
+        while expect_peek(LITERAL, tokens) and not peek(FROM, tokens):
+            stmt['calendars'].append(tokens.pop(0))
+    expect(FROM, tokens)
+    stmt['from'] = parse_time_clause(tokens)
+    expect(UNTIL, tokens)
+    stmt['until'] = parse_time_clause(tokens)
+    return stmt
+
+
 def parse_time_clause(tokens):
     stmt = {}
     initial_literal = None
@@ -234,7 +263,7 @@ def error(tokens, expected):
     try:
         raise HarmonySyntaxError(tokens[0], expected)
     except IndexError:
-        raise HarmonyEOLError()
+        raise HarmonyEOLError(expected)
 
 
 ################################################################################
@@ -254,7 +283,7 @@ def analyze(stmt):
 
 def analyze_create_calendar(calendar):
     if 'timezone' in calendar:
-        calendar['timezone'] = timezone(calendar['timezone'])
+        calendar['timezone'] = _timezone(calendar['timezone'])
     return calendar
 
 
@@ -268,18 +297,23 @@ def analyze_create_event(event):
     return event
 
 
+def analyze_freebusy(freebusy):
+    freebusy['from'] = get_datetime_or_date(freebusy['from'])
+    freebusy['until'] = get_datetime_or_date(freebusy['until'])
+    return freebusy
+
+
 #
 # Semantic analyzer helpers
 #
 
 
 def transform_datetime(datetime_string, fmts):
-    for fmt in fmts:
-        try:
-            return datetime.datetime.strptime(datetime_string, fmt)
-        except ValueError:
-            pass
-    raise ValueError('Invalid datetime string: {}'.format(datetime_string))
+    try:
+        parser = _parsers[fmts]
+    except KeyError:
+        parser = _parsers[fmts] = Parser(fmts, remember=False)
+    return parser.parse(datetime_string)
 
 
 def get_datetime(dt_dict):
@@ -297,13 +331,36 @@ def get_datetime(dt_dict):
         return date
 
 
+def get_datetime_or_date(dt_dict):
+    '''Like get_datetime, but a lone literal may also be a date. (The parser
+    can't tell the two apart, so it always calls it a time.)'''
+    if dt_dict.keys() == ['time']:
+        try:
+            return get_date(dt_dict['time'])
+        except ValueError:
+            pass
+    return get_datetime(dt_dict)
+
+
 def get_time(time_string, tz=None):
     dt = transform_datetime(time_string, TIME_FMTS)
     if tz is None:
         return datetime.time(hour=dt.hour, minute=dt.minute)
     else:
         return datetime.time(hour=dt.hour, minute=dt.minute,
-                             tzinfo=timezone(tz))
+                             tzinfo=_timezone(tz))
+
+
+def _timezone(name):
+    '''Look up a timezone named in a statement.
+
+    @raises ValueError: If there's no such timezone.
+    '''
+    try:
+        return get_timezone(name)
+    except KeyError:
+        # pytz's UnknownTimeZoneError
+        raise ValueError('Unknown timezone: {}'.format(name))
 
 
 def get_date(date_string):
@@ -324,12 +381,16 @@ class HarmonySyntaxError(ValueError):
     def __init__(self, found, expected):
         super(HarmonySyntaxError, self).__init__(
                 "Invalid symbol: '{}', expected {}".format(found, expected))
+        self.found = found
+        self.expected = expected
 
 
 class HarmonyEOLError(HarmonySyntaxError):
     '''Raised by the parser when an unexpected EOL is encountered.'''
-    def __init__(self):
-        super(HarmonyEOLError, self).__init__('Unexpected end of line found')
+    def __init__(self, expected=None):
+        ValueError.__init__(self, 'Unexpected end of line found')
+        self.found = None
+        self.expected = expected
 
 
 class HarmonyInitialTokenMissingError(HarmonySyntaxError):
@@ -0,0 +1,254 @@
+'''
+Finding event invites in a Maildir.
+
+A big Maildir holds hundreds of thousands of messages, and only the handful
+delivered since the last look are interesting. Where inotify is available, the
+new/ and cur/ directories are watched, and only the files it reports are looked
+at. Elsewhere, a directory is only listed again when its modification time has
+changed. Either way, every message that's been looked at is remembered in the
+store by its unique name, so no message is read twice, even across runs.
+
+ctypes and email are imported when they're first needed, not when this module
+is.
+'''
+
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from .persistence import db
+from .persistence.model import Model, TextField
+
+
+log = logging.getLogger(__name__)
+
+SUBDIRS = ('new', 'cur')
+
+# From <sys/inotify.h>
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name.
+_EVENT = struct.Struct('iIII')
+
+
+class SeenMessage(Model):
+    '''A message in a Maildir that has been looked at for invites.'''
+
+    # Path of the Maildir.
+    maildir = TextField()
+    # The message's unique name: its file name, without the flags.
+    key = TextField()
+
+    class Meta:
+        journal = False
+        unique_indexes = (('maildir', 'key'),)
+
+    @classmethod
+    def keys(cls, maildir):
+        '''@returns: Keys of the messages seen in {maildir}. (set)'''
+        return set(cls.select_columns(('key',), maildir=maildir)['key'])
+
+    @classmethod
+    def forget(cls, maildir, keys):
+        '''Forget the messages {keys}, which have left {maildir}.'''
+        with db.db.transaction():
+            for key in keys:
+                db.db.delete(cls._meta.table, {'maildir': maildir, 'key': key})
+
+    def __unicode__(self):
+        return u'{0.maildir}: {0.key}'.format(self)
+
+
+def message_key(path):
+    '''The unique name of the message at {path}, which stays the same when it
+    moves from new/ to cur/ and its flags change.'''
+    return os.path.basename(path).split(':', 1)[0]
+
+
+class Inotify(object):
+    '''
+    Just enough of inotify(7), through ctypes, to hear about files arriving in
+    directories.
+    '''
+
+    def __init__(self):
+        '''@raises OSError: If inotify isn't available.'''
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        try:
+            init = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._get_errno = ctypes.get_errno
+        fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self._raise()
+        self.fd = fd
+        self._watches = {}
+
+    def _raise(self):
+        err = self._get_errno()
+        raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=IN_CREATE | IN_MOVED_TO):
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._raise()
+        self._watches[wd] = path
+
+    def read(self):
+        '''Events that have arrived, without waiting for any.
+
+        @returns: (directory, mask, name) tuples. For IN_Q_OVERFLOW,
+        directory and name are None. (list)
+        '''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip('\0') or None
+                offset += length
+                events.append((self._watches.get(wd), mask, name))
+
+    def wait(self, timeout=None):
+        '''@returns: True if events arrived within {timeout} seconds.
+        (bool)'''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(ready)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Maildir(object):
+    '''
+    Tells which message files in a Maildir might be new since it last looked.
+    '''
+
+    def __init__(self, path, use_inotify=True):
+        self.path = path
+        self.use_inotify = use_inotify
+        self._inotify = None
+        # Each subdirectory's modification time, and when it was listed.
+        self._listed = {}
+
+    def subdirs(self):
+        return [os.path.join(self.path, sub) for sub in SUBDIRS]
+
+    def watch(self):
+        '''@returns: A new Inotify watching the subdirectories, or None if
+        inotify isn't available. (Inotify)'''
+        try:
+            inotify = Inotify()
+        except OSError as e:
+            log.debug('Not using inotify for %s: %s', self.path, e)
+            return None
+        try:
+            for subdir in self.subdirs():
+                inotify.add_watch(subdir)
+        except OSError:
+            inotify.close()
+            raise
+        return inotify
+
+    def changes(self):
+        '''Find the message files that might be new.
+
+        @returns: Their paths, and whether that's every message in the
+        Maildir. (tuple of list and bool)
+        '''
+        if self.use_inotify and self._inotify is None and not self._listed:
+            # Start watching before the first listing, so nothing that
+            # arrives in between is missed.
+            self._inotify = self.watch()
+        if self._inotify is not None and self._listed:
+            paths = []
+            overflowed = False
+            for directory, mask, name in self._inotify.read():
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif name is not None and not name.startswith('.'):
+                    paths.append(os.path.join(directory, name))
+            if not overflowed:
+                return paths, False
+            self.reset()
+        return self._list()
+
+    def reset(self):
+        '''Forget what's been listed, so the next changes() lists every
+        message again. For when the last lot of changes wasn't dealt with.'''
+        self._listed.clear()
+
+    def _list(self):
+        paths = []
+        complete = True
+        now = time.time()
+        for subdir in self.subdirs():
+            mtime = os.stat(subdir).st_mtime
+            listed = self._listed.get(subdir)
+            # A file that arrived in the same clock tick as the last listing
+            # leaves the time as it was, so the directory is only skipped once
+            # it's been listed well after its last change.
+            if (self._inotify is None and listed is not None
+                    and listed[0] == mtime and mtime < listed[1] - 1):
+                complete = False
+                continue
+            self._listed[subdir] = (mtime, now)
+            paths.extend(os.path.join(subdir, name)
+                         for name in os.listdir(subdir)
+                         if not name.startswith('.'))
+        return paths, complete
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def calendar_parts(path):
+    '''Read the text/calendar parts of the message at {path}. Messages whose
+    headers say they can't have any aren't read past the headers.
+
+    @returns: The parts' data, decoded. (list of str)
+    @raises IOError: If the message isn't there any more.
+    '''
+    import email
+    with open(path, 'rb') as f:
+        lines = []
+        while True:
+            line = f.readline()
+            lines.append(line)
+            if not line.strip():
+                break
+        head = ''.join(lines)
+        content_type = email.message_from_string(head).get_content_type()
+        if not (content_type.startswith('multipart/')
+                or content_type == 'text/calendar'):
+            return []
+        message = email.message_from_string(head + f.read())
+    return [part.get_payload(decode=True) for part in message.walk()
+            if part.get_content_type() == 'text/calendar']
@@ -0,0 +1,142 @@
+'''
+Writing command output: tables that stream, and a pager to read them in.
+
+A table's column widths are worked out from its first rows only, so it starts
+printing before the rest have been read, and only those rows are ever held in
+memory. A later row with a wider cell widens its column from there on.
+
+subprocess is imported when a pager is first started, not when this module is.
+'''
+
+import errno
+import os
+from itertools import chain, islice
+
+
+# Rows read ahead to size the columns.
+LOOKAHEAD = 100
+
+# Used when $PAGER isn't set. As git does, less is told to quit if the output
+# fits on one screen, pass colors through, and leave the screen as it was.
+DEFAULT_PAGER = 'less'
+DEFAULT_LESS = 'FRX'
+
+
+def write_table(rows, out, template=None, align=None, lookahead=LOOKAHEAD):
+    '''Write {rows} to {out} as they come, padding cells to line up.
+
+    @param rows: Rows of cells. (iterable of sequences of unicode)
+    @param template: How to lay out a row, with a {n} for the nth column;
+    columns separated by two spaces if omitted. (unicode)
+    @param align: '<' or '>' for each column; left-aligned if omitted.
+    (sequence of str)
+    @param lookahead: Rows to read before the first is written. (int)
+    @returns: Number of rows written. (int)
+    '''
+    rows = iter(rows)
+    window = list(islice(rows, lookahead))
+    if not window:
+        return 0
+    ncols = len(window[0])
+    if template is None:
+        template = u'  '.join(u'{{{:d}}}'.format(i) for i in range(ncols))
+    if align is None:
+        align = '<' * ncols
+    widths = [0] * ncols
+    for row in window:
+        for i, cell in enumerate(row):
+            widths[i] = max(widths[i], len(cell))
+    count = 0
+    for row in chain(window, rows):
+        cells = list(row)
+        # The last column isn't padded, so lines don't end in spaces.
+        for i in range(ncols - 1):
+            width = widths[i] = max(widths[i], len(cells[i]))
+            if align[i] == '>':
+                cells[i] = cells[i].rjust(width)
+            else:
+                cells[i] = cells[i].ljust(width)
+        out.write(template.format(*cells) + u'\n')
+        count += 1
+    return count
+
+
+class _Encoder(object):
+    '''Encodes what's written to it as UTF-8, for a pipe.'''
+
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+
+class pager(object):
+    '''
+    A context manager that pipes what's written to it through $PAGER, when
+    {out} is a terminal, and otherwise hands back {out} itself. If the reader
+    quits the pager before everything has been written, the write that finds
+    it gone, or ^C, ends the block quietly.
+
+        with pager(sys.stdout) as out:
+            write_table(rows, out)
+    '''
+
+    def __init__(self, out, command=None):
+        self.out = out
+        if command is None:
+            command = os.environ.get('PAGER', DEFAULT_PAGER)
+        self.command = command
+        self._process = None
+
+    def _wanted(self):
+        if not self.command or self.command == 'cat':
+            return False
+        try:
+            return self.out.isatty()
+        except AttributeError:
+            return False
+
+    def __enter__(self):
+        if not self._wanted():
+            return self.out
+        import subprocess
+        env = dict(os.environ)
+        env.setdefault('LESS', DEFAULT_LESS)
+        self.out.flush()
+        try:
+            self._process = subprocess.Popen(self.command, shell=True,
+                                             stdin=subprocess.PIPE, env=env)
+        except OSError:
+            return self.out
+        return _Encoder(self._process.stdin)
+
+    def __exit__(self, exc_type, exc, tb):
+        process = self._process
+        if process is None:
+            return False
+        self._process = None
+        try:
+            process.stdin.close()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+        # Let the reader finish reading before the prompt comes back.
+        while True:
+            try:
+                process.wait()
+                break
+            except KeyboardInterrupt:
+                pass
+        if exc_type is None:
+            return False
+        # ^C reaches us as well as the pager; either way, stop writing.
+        if issubclass(exc_type, KeyboardInterrupt):
+            return True
+        return (issubclass(exc_type, IOError)
+                and getattr(exc, 'errno', None) == errno.EPIPE)
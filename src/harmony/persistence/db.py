@@ -3,6 +3,10 @@ Harmony stores all its calendar and event data in a SQLite database. This module
 handles that stuff.
 '''
 
+import threading
+import Queue
+from contextlib import contextmanager
+
 
 # Database singleton instance
 db = None
@@ -12,14 +16,116 @@ db = None
 ## LOW LEVEL PERSISTENCE
 
 
-def initialize_sqlite(dbpath):
+def initialize_sqlite(dbpath, readers=4):
     '''Create a database instance and connect to the specified file.
 
     @param dbpath: Path to a SQLite database file. (str)
+    @param readers: Maximum number of read-only connections. (int)
     '''
     global db
     db = SQLiteDatabase()
-    db.connect(dbpath)
+    db.connect(dbpath, readers=readers)
+
+
+class ConnectionManager(object):
+    '''Hands out connections to a SQLite database: a single writer connection,
+    and a pool of read-only connections.
+
+    The database is put in WAL mode, so readers don't block the writer and the
+    writer doesn't block readers. Only one connection may write at a time, which
+    is why there's just the one.
+    '''
+
+    # Tuning applied to every connection. In WAL mode synchronous=NORMAL is
+    # still safe against corruption; only the last transactions before a power
+    # loss may be rolled back. cache_size is negative, so it's in KiB.
+    PRAGMAS = (
+        ('synchronous', 'NORMAL'),
+        ('cache_size', -16384),
+        ('mmap_size', 256 * 1024 * 1024),
+        ('temp_store', 'MEMORY'),
+    )
+
+    def __init__(self, dbpath, readers=4, pragmas=None):
+        '''
+        @param dbpath: Path to a SQLite file. (str)
+        @param readers: Maximum number of read-only connections. (int)
+        @param pragmas: Overrides for PRAGMAS. (sequence of (name, value))
+        '''
+        self.dbpath = dbpath
+        self.max_readers = readers
+        self.pragmas = self.PRAGMAS if pragmas is None else pragmas
+        self.writer = self._open()
+        if self.shared:
+            # Each connection to an in-memory database gets a database of its
+            # own, so readers have to go through the writer.
+            self.max_readers = 0
+        else:
+            self.writer.execute('PRAGMA journal_mode = WAL')
+        self._readers = Queue.LifoQueue()
+        self._reader_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return self.dbpath == ':memory:' or self.dbpath == ''
+
+    def _open(self, read_only=False):
+        import sqlite3
+        # The writer runs in autocommit mode and SQLiteDatabase issues BEGIN
+        # itself, so transactions can span DDL statements too. (sqlite3 would
+        # otherwise commit implicitly before each one.)
+        isolation_level = '' if read_only else None
+        conn = sqlite3.connect(self.dbpath, check_same_thread=False,
+                               isolation_level=isolation_level)
+        for name, value in self.pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        if read_only:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    @contextmanager
+    def reader(self):
+        '''Borrow a read-only connection for the duration of the with-block.
+        Blocks if all of the readers are busy.'''
+        if self.max_readers == 0:
+            yield self.writer
+            return
+        try:
+            conn = self._readers.get_nowait()
+        except Queue.Empty:
+            conn = None
+            with self._lock:
+                if self._reader_count < self.max_readers:
+                    self._reader_count += 1
+                    new = True
+                else:
+                    new = False
+            if new:
+                try:
+                    conn = self._open(read_only=True)
+                except:
+                    with self._lock:
+                        self._reader_count -= 1
+                    raise
+            else:
+                conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            # Don't hold a read transaction open while the connection sits in
+            # the pool; it would keep the WAL from being checkpointed.
+            conn.rollback()
+            self._readers.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except Queue.Empty:
+                break
+        self._reader_count = 0
+        self.writer.close()
 
 
 class SQLiteDatabase(object):
@@ -37,14 +143,52 @@ class SQLiteDatabase(object):
 
     def __init__(self):
         self.db = None
-
-    def connect(self, dbpath):
+        self.connections = None
+        # Writes from the CLI and from background workers share the writer
+        # connection, so they take turns.
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._transaction_owner = None
+
+    def connect(self, dbpath, readers=4):
         '''Connect to a SQLite database.
 
         @param dbpath: Path to a SQLite file. (str)
+        @param readers: Maximum number of read-only connections. (int)
         '''
-        import sqlite3
-        self.db = sqlite3.connect(dbpath)
+        self.connections = ConnectionManager(dbpath, readers=readers)
+        self.db = self.connections.writer
+
+    def close(self):
+        if self.connections is not None:
+            self.connections.close()
+        self.connections = None
+        self.db = None
+
+    @contextmanager
+    def transaction(self):
+        '''Group every write issued inside the with-block into one transaction.
+        The transaction is committed when the outermost block exits, or rolled
+        back if it exits with an exception. Transactions nest; inner blocks
+        simply join the outer one.'''
+        with self._lock:
+            if self._transaction_depth == 0:
+                self.db.execute('BEGIN IMMEDIATE')
+            self._transaction_depth += 1
+            self._transaction_owner = threading.current_thread()
+            try:
+                yield self
+            except:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._transaction_owner = None
+                    self.db.rollback()
+                raise
+            else:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._transaction_owner = None
+                    self.db.commit()
 
 
     def _execute(self, sql, values=None):
@@ -63,6 +207,37 @@ class SQLiteDatabase(object):
             args.append(values)
         return self.db.execute(*args)
 
+    @contextmanager
+    def _read(self, sql, values=None):
+        '''Execute a query that only reads from the database, on one of the
+        read-only connections. Inside a transaction, the query goes to the
+        writer instead, so it sees the transaction's own changes.
+
+        @returns: Database cursor, valid for the duration of the with-block.
+        (db.Cursor)
+        '''
+        if self.db is None:
+            raise ValueError('Connect to database before issuing a query')
+        args = [sql]
+        if values is not None:
+            args.append(values)
+        if (self.connections.max_readers == 0
+                or self._transaction_owner is threading.current_thread()):
+            with self._lock:
+                yield self.db.execute(*args)
+        else:
+            with self.connections.reader() as conn:
+                yield conn.execute(*args)
+
+    def _write(self, sql, values=None):
+        '''Execute a statement that modifies the database. Outside of a
+        transaction() block the change is committed right away.
+
+        @returns: Database cursor. (db.Cursor)
+        '''
+        with self._lock:
+            return self._execute(sql, values)
+
 
     def _build_binary_expn(self, field_and_operator):
         '''Build a qmark'd binary expression.
@@ -80,7 +255,7 @@ class SQLiteDatabase(object):
         except ValueError:
             field = field_and_operator
             operator = None
-        return '"{}" {} ?'.format(field, OPERATORS[operator])
+        return '"{}" {} ?'.format(field, self.OPERATORS[operator])
 
 
     def _build_where_clause(self, criteria_keys):
@@ -94,7 +269,7 @@ class SQLiteDatabase(object):
         build a WHERE clause. (list)
         @returns: The WHERE clause. (str)
         '''
-        criteria_expns = [_build_binary_expn(fo) for fo in criteria_keys]
+        criteria_expns = [self._build_binary_expn(fo) for fo in criteria_keys]
         return 'WHERE {}'.format(' AND '.join(criteria_expns))
 
 
@@ -114,10 +289,57 @@ class SQLiteDatabase(object):
 
         column_specs = []
         for col, spec in columns.items():
-            column_specs.append('"{name}" {spec}'.format(col, spec))
-        sql += '({})'.format(', '.join(column_specs))
+            column_specs.append('"{}" {}'.format(col, spec))
+        sql += ' ({})'.format(', '.join(column_specs))
+
+        self._write(sql)
+
+
+    def create_index(self, table, columns, unique=False, name=None):
+        '''Build and execute a CREATE INDEX IF NOT EXISTS query.
+
+        @param table: Table name. (str)
+        @param columns: Column names to index, in order. (list of str)
+        @param unique: If True, create a UNIQUE index. (bool)
+        @param name: Index name. Defaults to one derived from the table and
+        columns. (str)
+        '''
+        if name is None:
+            name = 'ix_{}_{}'.format(table, '_'.join(columns))
+        sql = 'CREATE {unique}INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})'.format(
+                unique='UNIQUE ' if unique else '',
+                name=name,
+                table=table,
+                columns=', '.join(['"{}"'.format(c) for c in columns]))
+        self._write(sql)
+
+
+    def add_column(self, table, column, spec):
+        '''Build and execute an ALTER TABLE ... ADD COLUMN query.
+
+        @param table: Table name. (str)
+        @param column: Column name. (str)
+        @param spec: SQLite column type definition. (str)
+        '''
+        self._write('ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(table, column,
+                                                                spec))
+
 
-        _execute(sql)
+    def get_user_version(self):
+        '''@returns: The database's user_version pragma. (int)'''
+        with self._lock:
+            return self._execute('PRAGMA user_version').fetchone()[0]
+
+
+    def set_user_version(self, version):
+        self._write('PRAGMA user_version = {:d}'.format(version))
+
+
+    def get_data_version(self):
+        '''@returns: The database's data_version pragma, which changes whenever
+        another connection, in this process or another, commits. (int)'''
+        with self._lock:
+            return self._execute('PRAGMA data_version').fetchone()[0]
 
 
     def insert(self, table, values):
@@ -125,15 +347,14 @@ class SQLiteDatabase(object):
 
         @param table: Table name. (str)
         @param values: Mapping of columns to values to insert. (dict)
-        @returns: True if row count >= 0. (I think this counts as a rough
-        indication of whether the query succeeded or not.) (bool)
+        @returns: The rowid of the inserted row. (int)
         '''
         sql = 'INSERT INTO "{table}" ({columns}) VALUES ({values})'.format(
             table=table,
             columns=', '.join(['"{}"'.format(c) for c in values.keys()]),
             values=', '.join('?' * len(values))
         )
-        return _execute(sql, values.values()).rowcount > 0
+        return self._write(sql, values.values()).lastrowid
 
 
     def select(self, table, criteria=None):
@@ -150,11 +371,57 @@ class SQLiteDatabase(object):
 
         if criteria is not None:
             fields, values = zip(*criteria.items())
-            sql += ' {}'.format(_build_where_clause(criteria))
+            sql += ' {}'.format(self._build_where_clause(fields))
+
+        with self._read(sql, values) as cur:
+            cols = [c[0] for c in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+
+    def select_chunks(self, table, criteria=None, columns=None,
+                      chunk_size=1000, order_by=None, limit=None):
+        '''Build and execute a SELECT query, and return its results in chunks
+        of raw rows, for callers that convert rows in bulk.
 
-        cur = _execute(sql, values)
-        cols = [c[0] for c in cur.description]
-        return [dict(zip(cols, row)) for row in cur.fetchall()]
+        @param table: Table name. (str)
+        @param criteria: Argument to pass to _build_where_clause. (dict)
+        @param columns: Column names to select; all columns if omitted. (list)
+        @param chunk_size: Number of rows per chunk. (int)
+        @param order_by: Column names to sort by. Prefix a name with '-' to
+        sort descending. (list of str)
+        @param limit: Maximum number of rows to return. (int)
+        @returns: A generator of (column names, list of row tuples) pairs.
+        '''
+        if columns is None:
+            column_list = '*'
+        else:
+            column_list = ', '.join(['"{}"'.format(c) for c in columns])
+        sql = 'SELECT {columns} FROM "{table}"'.format(columns=column_list,
+                                                     table=table)
+        values = None
+
+        if criteria is not None:
+            fields, values = zip(*criteria.items())
+            sql += ' {}'.format(self._build_where_clause(fields))
+
+        if order_by:
+            terms = []
+            for col in order_by:
+                if col.startswith('-'):
+                    terms.append('"{}" DESC'.format(col[1:]))
+                else:
+                    terms.append('"{}"'.format(col))
+            sql += ' ORDER BY {}'.format(', '.join(terms))
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+
+        with self._read(sql, values) as cur:
+            cols = tuple(c[0] for c in cur.description)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield cols, rows
 
 
     def update(self, table, values, criteria=None):
@@ -169,15 +436,15 @@ class SQLiteDatabase(object):
         sql = 'UPDATE "{table}"'.format(table=table)
         fields, qmark_values = zip(*values.items())
 
-        set_expns = [_build_binary_expn(f) for f in fields]
+        set_expns = [self._build_binary_expn(f) for f in fields]
         sql += ' SET {}'.format(', '.join(set_expns))
 
         if criteria is not None:
             fields, cvalues = zip(*criteria.items())
-            sql += ' {}'.format(_build_where_clause(fields))
+            sql += ' {}'.format(self._build_where_clause(fields))
             qmark_values = qmark_values + cvalues
 
-        return _execute(sql, qmark_values).rowcount
+        return self._write(sql, qmark_values).rowcount
 
 
     def delete(self, table, criteria=None):
@@ -196,6 +463,6 @@ class SQLiteDatabase(object):
 
         if criteria is not None:
             fields, values = zip(*criteria.items())
-            sql += ' {}'.format(_build_where_clause(fields))
+            sql += ' {}'.format(self._build_where_clause(fields))
 
-        return _execute(sql, values).rowcount
+        return self._write(sql, values).rowcount
@@ -3,12 +3,16 @@ Model layer. Provides the infrastructure for defining models and fields and
 converting Python data to SQLite data.
 '''
 
+from array import array
+from collections import OrderedDict
+from itertools import izip
 from types import FunctionType
 
 from datetime import datetime
-from pytz import timezone as pytz_timezone
 
 from . import db
+from .. import dateparse
+from ..tz import get_timezone
 
 
 class Field(object):
@@ -32,6 +36,17 @@ class Field(object):
             return u'null'
         return self.adapt(value)
 
+    def db_value(self, value):
+        '''Convert {value} into a value that can be bound to a qmark
+        placeholder in a query.
+
+        @param value: Value to transform (object)
+        @returns: The adapted value, or None for NULL (object)
+        '''
+        if value is None:
+            return None
+        return self.adapt(value)
+
     def adapt(self, value):
         '''A SQLite adapter function to convert {value} to a SQLite type. This
         method should not be overridden by subclasses; instead, write an _adapt
@@ -53,26 +68,39 @@ class Field(object):
         @param value: Value to convert (str)
         @returns: A Python object (object)
         '''
-        if value is 'null':
+        if value is None:
             return None
-        if hasattr(self, value):
+        if hasattr(self, '_convert'):
             return self._convert(value)
         return unicode(value)
 
+    @property
+    def converter(self):
+        '''The function that convert() boils down to for this field, looked up
+        once so batch conversion doesn't repeat the lookup for every value. None
+        means values can be used just as sqlite3 returns them.
+
+        @returns: A function of one value, or None (function)
+        '''
+        conv = getattr(self, '_convert', None)
+        if conv is None or not self.null:
+            return conv
+        return lambda value: None if value is None else conv(value)
+
     @property
     def column_spec(self):
         constraints = []
 
         if self.primary_key:
             # Setting primary_key trumps all
-            return 'PRIMARY KEY AUTOINCREMENT'
+            return '{} PRIMARY KEY AUTOINCREMENT'.format(self.column_type)
 
         if self.unique:
             constraints.append('UNIQUE')
         if not self.null:
             constraints.append('NOT NULL')
         if self.default is not None:
-            constraints.append('DEFAULT {}'.format(self.transform(self.default)))
+            constraints.append('DEFAULT {}'.format(self.to_sql(self.default)))
         return '{} {}'.format(self.column_type, ' '.join(constraints))
 
 
@@ -87,6 +115,11 @@ class IntegerField(Field):
     def _convert(self, value):
         return int(value)
 
+    @property
+    def converter(self):
+        # sqlite3 already hands back INTEGER columns as ints.
+        return None
+
 
 class BooleanField(IntegerField):
     '''A boolean field. Stored as an INTEGER in SQLite.'''
@@ -114,12 +147,16 @@ class BooleanField(IntegerField):
 
     def _convert(self, value):
         if isinstance(value, basestring):
-            if value in YES_STR_VALUES:
+            if value in BooleanField.YES_STR_VALUES:
                 return True
-            elif value in NO_STR_VALUES:
+            elif value in BooleanField.NO_STR_VALUES:
                 return False
         return bool(value)
 
+    @property
+    def converter(self):
+        return Field.converter.fget(self)
+
 
 class TextField(Field):
     '''A string field.'''
@@ -140,6 +177,23 @@ class TextField(Field):
     def _convert(self, value):
         return unicode(value)
 
+    @property
+    def converter(self):
+        # sqlite3 already hands back TEXT columns as unicode.
+        return None
+
+
+class BlobField(Field):
+    '''Raw bytes. Stored as a BLOB in SQLite.'''
+
+    column_type = 'BLOB'
+
+    def _adapt(self, value):
+        return buffer(value)
+
+    def _convert(self, value):
+        return str(value)
+
 
 class TimezoneField(TextField):
     '''Stores a timezone.'''
@@ -149,8 +203,14 @@ class TimezoneField(TextField):
     # TODO: Create mapping of system timezone values ('PDT', 'PST', etc) to
     # tzinfo.
 
-    def convert(self, value):
-        return pytz_timezone(value)
+    def _convert(self, value):
+        if not value:
+            return None
+        return get_timezone(value)
+
+    @property
+    def converter(self):
+        return Field.converter.fget(self)
 
 
 class DateTimeField(Field):
@@ -158,15 +218,25 @@ class DateTimeField(Field):
 
     column_type = 'TEXT'
 
-    STORAGE_FORMAT = '%Y-%m-%d %H:%M:%s%z'
+    # Datetimes are stored in UTC, so that stored values sort in time order and
+    # range queries can use an index.
+    STORAGE_FORMAT = dateparse.STORAGE_FORMAT
 
     def _adapt(self, value):
-        # The isoformat conversion is equivalent to str(value), but I wanted to
-        # be explicit.
-        return unicode(value.strptime(DateTimeField.STORAGE_FORMAT))
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        return dateparse.format_stored(value)
 
     def _convert(self, value):
-        return datetime.strftime(value, DateTimeField.STORAGE_FORMAT)
+        return dateparse.parse_stored(value).replace(
+                tzinfo=get_timezone('UTC'))
+
+    def to_epoch(self, value):
+        '''Convert a stored value straight to seconds since the epoch, without
+        building an aware datetime. NULLs become NaN.'''
+        if value is None:
+            return float('nan')
+        return dateparse.stored_to_epoch(value)
 
 
 class ForeignKeyField(IntegerField):
@@ -185,10 +255,54 @@ class ForeignKeyField(IntegerField):
         return '{} REFERENCES "{}"'.format(spec, self.reference._meta.table)
 
 
+# Every model class, in the order they were defined. Since a model has to be
+# defined before another can reference it, this is also an order in which their
+# tables can be created.
+registry = []
+
+
 class ModelOptions(object):
     def __init__(self):
         self.table = ''
         self.fields = {}
+        # Tuples of column names to index. Declared on the model in an inner
+        # Meta class.
+        self.indexes = ()
+        self.unique_indexes = ()
+        # Functions called as listener(action, instance) after an instance is
+        # saved ('save') or deleted ('delete').
+        self.listeners = []
+        # Record changes to instances in the change journal? See Change.
+        self.journal = True
+        self._converters = {}
+
+    def converters(self, columns):
+        '''Converter functions for a result set with the given {columns}, in
+        the same order. Computed once per distinct set of columns.
+
+        @param columns: Column names, as in cursor.description. (tuple of str)
+        @returns: Field converters; None where no conversion is needed. (tuple)
+        '''
+        try:
+            return self._converters[columns]
+        except KeyError:
+            pass
+        converters = []
+        for col in columns:
+            field = self.fields.get(col)
+            converters.append(field.converter if field is not None else None)
+        converters = self._converters[columns] = tuple(converters)
+        return converters
+
+    @property
+    def columns(self):
+        '''Mapping of column names to column specs, primary key first.'''
+        columns = OrderedDict()
+        columns['id'] = self.fields['id'].column_spec
+        for name in sorted(self.fields):
+            if name != 'id':
+                columns[name] = self.fields[name].column_spec
+        return columns
 
 
 class ModelMeta(type):
@@ -205,12 +319,19 @@ class ModelMeta(type):
         attrs['id'] = IntegerField(primary_key=True)
         opts = ModelOptions()
         opts.table = name.lower()
+        meta = attrs.pop('Meta', None)
+        if meta is not None:
+            opts.indexes = tuple(getattr(meta, 'indexes', ()))
+            opts.unique_indexes = tuple(getattr(meta, 'unique_indexes', ()))
+            opts.journal = getattr(meta, 'journal', True)
         for name, value in attrs.items():
             if not isinstance(value, Field):
                 continue
             new_class.process_field(name, value, attrs, opts)
         attrs['_meta'] = opts
-        return type.__new__(cls, name, bases, attrs)
+        model_class = type.__new__(cls, new_class.__name__, bases, attrs)
+        registry.append(model_class)
+        return model_class
 
     def process_field(cls, name, field, attrs, opts):
         opts.fields[name] = field
@@ -219,34 +340,272 @@ class ModelMeta(type):
 
 class Model(object):
     '''Generic model. This is the thing (and its subclasses) that will be
-    committed to a backing store of some kind.'''
+    committed to a backing store of some kind.
+
+    Instances keep track of which fields have been assigned new values since
+    they were loaded or last saved, so that saving only writes those. Every
+    write is also recorded in the change journal (see Change).'''
 
     __metaclass__ = ModelMeta
 
+    def __setattr__(self, name, value):
+        if name in self._meta.fields:
+            d = self.__dict__
+            try:
+                changed = name not in d or d[name] != value
+            except TypeError:
+                # e.g. naive and aware datetimes, which don't compare.
+                changed = True
+            if changed:
+                dirty = d.get('_dirty')
+                if dirty is None:
+                    dirty = d['_dirty'] = set()
+                dirty.add(name)
+        object.__setattr__(self, name, value)
+
+    def __init__(self, **kwargs):
+        for name in self._meta.fields:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unknown fields for {}: {}'.format(
+                    self.__class__.__name__, ', '.join(kwargs)))
+
+    @classmethod
+    def create(cls, **kwargs):
+        '''Create a new instance and save it right away.'''
+        instance = cls(**kwargs)
+        instance.save()
+        return instance
+
+    @classmethod
+    def from_row(cls, row):
+        '''Build an instance from a row dict as returned by
+        SQLiteDatabase.select.'''
+        instance = cls.__new__(cls)
+        # Straight into __dict__, so the fields don't count as changed.
+        for name, field in cls._meta.fields.items():
+            instance.__dict__[name] = field.convert(row.get(name))
+        return instance
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        '''Build instances from a chunk of raw result rows. Values are converted
+        a column at a time using the model's precomputed converters, which is
+        much faster than going through from_row for big result sets.
+
+        @param columns: Column names of the rows. (tuple of str)
+        @param rows: Row tuples, as from cursor.fetchmany(). (list of tuple)
+        @returns: Model instances. (list)
+        '''
+        if not rows:
+            return []
+        columns = tuple(columns)
+        converted = []
+        for conv, values in izip(cls._meta.converters(columns), izip(*rows)):
+            converted.append(values if conv is None else map(conv, values))
+        new = cls.__new__
+        instances = []
+        for values in izip(*converted):
+            instance = new(cls)
+            instance.__dict__ = dict(izip(columns, values))
+            instances.append(instance)
+        return instances
+
+    @classmethod
+    def select(cls, chunk_size=1000, order_by=None, limit=None, **criteria):
+        '''Query the store for instances matching {criteria}, which are given as
+        for SQLiteDatabase.select. Rows are fetched and converted
+        {chunk_size} at a time, and instances yielded as they're ready.'''
+        for columns, rows in db.db.select_chunks(cls._meta.table, criteria or None,
+                                                 chunk_size=chunk_size,
+                                                 order_by=order_by,
+                                                 limit=limit):
+            for instance in cls.from_rows(columns, rows):
+                yield instance
+
+    @classmethod
+    def select_columns(cls, columns, epoch_columns=(), chunk_size=1000,
+                       **criteria):
+        '''Query the store and return the results column-wise, without making
+        model instances at all.
+
+        Columns of DateTimeFields named in {epoch_columns} come back as
+        array('d') of seconds since the epoch rather than lists of datetimes.
+        They're contiguous buffers, so numpy.frombuffer() can wrap them
+        without copying if numpy is around.
+
+        @param columns: Column names to fetch. (list of str)
+        @param epoch_columns: Datetime columns to return as epoch arrays. (list
+        of str)
+        @returns: Mapping of column names to lists or arrays. (dict)
+        '''
+        columns = tuple(columns)
+        fields = cls._meta.fields
+        converters = []
+        result = {}
+        for col in columns:
+            if col in epoch_columns:
+                converters.append(fields[col].to_epoch)
+                result[col] = array('d')
+            else:
+                converters.append(fields[col].converter)
+                result[col] = []
+        targets = [result[col] for col in columns]
+        for _, rows in db.db.select_chunks(cls._meta.table, criteria or None,
+                                           columns=columns,
+                                           chunk_size=chunk_size):
+            for conv, target, values in izip(converters, targets, izip(*rows)):
+                target.extend(values if conv is None else map(conv, values))
+        return result
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def dirty_fields(self):
+        '''Names of the fields changed since the instance was loaded or last
+        saved. (frozenset)'''
+        return frozenset(self.__dict__.get('_dirty', ()))
+
     def __repr__(self):
         return "<{0.__class__.__name__} '{0!s}'>".format(self)
 
     def __str__(self):
         return str(unicode(self))
 
-    def save(self):
-        table = self._meta.table
-        fields = {}
-        for name, field in self._meta.fields.items():
+    def _db_values(self, names):
+        values = {}
+        fields = self._meta.fields
+        for name in names:
+            field = fields[name]
             field_value = getattr(self, name)
             if field_value is None:
                 field_value = field.default
             if isinstance(field, ForeignKeyField) and field_value is not None:
-                field_value = field_value.id
-            fields[name] = field.to_sql(field_value)
+                field_value = getattr(field_value, 'id', field_value)
+            values[name] = field.db_value(field_value)
+        return values
+
+    def save(self):
+        '''Write the instance to the store. New instances are inserted whole;
+        existing ones only have their changed fields updated, and aren't written
+        at all if nothing changed.'''
+        table = self._meta.table
+        dirty = self.__dict__.get('_dirty')
 
         # INSERT or UPDATE; algorithm copied from Django
         # If id is not None, do a SELECT to see if the record exists. If so, do
         # an UPDATE. Otherwise, do an INSERT.
         if self.id is not None:
-            id_sql = fields['id']
-            rows = db.db.select(table, {'id': id_sql})
+            rows = db.db.select(table, {'id': self.id})
             if len(rows) > 0:
-                db.db.update(table, fields, {'id': id_sql})
+                if not dirty:
+                    return
+                fields = self._db_values(n for n in dirty if n != 'id')
+                with db.db.transaction():
+                    db.db.update(table, fields, {'id': self.id})
+                    self._journal('update', fields)
+                self._notify('save')
+                dirty.clear()
                 return
-        db.db.insert(table, fields)
+        names = [n for n in self._meta.fields if n != 'id']
+        fields = self._db_values(names)
+        if self.id is not None:
+            fields['id'] = self.id
+        with db.db.transaction():
+            object.__setattr__(self, 'id', db.db.insert(table, fields))
+            self._journal('insert', fields)
+        self._notify('save')
+        if dirty:
+            dirty.clear()
+
+    def delete(self):
+        if self.id is None:
+            return
+        with db.db.transaction():
+            db.db.delete(self._meta.table, {'id': self.id})
+            self._journal('delete', ())
+        self._notify('delete')
+        self.id = None
+
+    def _journal(self, action, columns):
+        if self._meta.journal:
+            Change.record(self._meta.table, self.id, action, columns)
+
+    def _notify(self, action):
+        # Listeners are called before dirty_fields is reset, so they can see
+        # what was just written.
+        for listener in list(self._meta.listeners):
+            listener(action, self)
+
+
+class Change(Model):
+    '''
+    An entry in the change journal: a row of some model's table was inserted,
+    updated or deleted. The journal is append-only, and entries are numbered
+    in the order they were made, so anything that needs to follow changes to
+    the store (sync, caches in other processes) can remember the last entry it
+    saw and ask for the ones after it, instead of rescanning.
+    '''
+
+    # Table the changed row is in.
+    model = TextField()
+    # id of the changed row.
+    row = IntegerField()
+    # 'insert', 'update' or 'delete'.
+    action = TextField()
+    # Changed columns, space separated. Empty for deletes.
+    columns = TextField(default=u'')
+    # When the change was made, in UTC.
+    time = DateTimeField()
+
+    class Meta:
+        journal = False
+
+    # Entries kept when the journal is pruned, which happens every time that
+    # many more have been made. A reader further behind than this starts over
+    # instead of replaying (see Application.refresh()), so older ones are of
+    # no use to anyone.
+    RETAIN = 1000
+
+    @classmethod
+    def record(cls, model, row, action, columns):
+        seq = db.db.insert(cls._meta.table, {
+            'model': model,
+            'row': row,
+            'action': action,
+            'columns': u' '.join(sorted(c for c in columns if c != 'id')),
+            'time': cls._meta.fields['time'].db_value(datetime.utcnow()),
+        })
+        if seq % cls.RETAIN == 0:
+            cls.prune(seq - cls.RETAIN)
+
+    @classmethod
+    def since(cls, seq, model=None, limit=None):
+        '''Journal entries after the one numbered {seq}, oldest first.
+
+        @param seq: Entry number (id) to start after; 0 for all. (int)
+        @param model: Only entries for this model. (type)
+        @returns: (generator of Change)
+        '''
+        criteria = {'id__gt': seq}
+        if model is not None:
+            criteria['model'] = model._meta.table
+        return cls.select(order_by=('id',), limit=limit, **criteria)
+
+    @classmethod
+    def latest(cls):
+        '''@returns: The number of the newest journal entry, or 0. (int)'''
+        for change in cls.select(order_by=('-id',), limit=1):
+            return change.id
+        return 0
+
+    @classmethod
+    def prune(cls, seq):
+        '''Drop the journal entries up to and including {seq}, once everything
+        that follows the journal has seen them.'''
+        db.db.delete(cls._meta.table, {'id__le': seq})
+
+    def __unicode__(self):
+        return u'{0.action} {0.model} {0.row}'.format(self)
@@ -0,0 +1,175 @@
+'''
+Schema management. Tables and indexes are created from the model definitions,
+and changes to the models over time are applied to existing databases by
+versioned migrations.
+
+The schema version lives in the database's user_version pragma, which SQLite
+keeps in the file header. Reading it is all it takes to find out a database is
+up to date, so a normal startup never has to introspect the schema.
+'''
+
+from . import db, model
+
+
+# Registered migrations, as (version, function) pairs.
+migrations = []
+
+
+def migration(version):
+    '''Decorator to register a migration function. The function is called with
+    the SQLiteDatabase to migrate, inside the migration transaction, when an
+    existing database is older than {version}.
+
+        @migration(2)
+        def add_event_location(database):
+            database.add_column('event', 'location', "TEXT NOT NULL DEFAULT ''")
+
+    Every change should also be reflected in the models, since fresh databases
+    are created straight from them.
+    '''
+    def register(func):
+        if any(v == version for v, _ in migrations):
+            raise ValueError('Duplicate migration version: {}'.format(version))
+        migrations.append((version, func))
+        migrations.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def latest_version():
+    '''The version a database is at once every migration has been applied.
+    Version 1 is the initial schema.'''
+    if migrations:
+        return max(1, migrations[-1][0])
+    return 1
+
+
+def import_models():
+    '''Import every module that defines models, so that the registry has all
+    of them and not just the ones this process happened to need so far.'''
+    from .. import alarms, blobs, calendar, maildir
+    from ..remote import discovery, imap
+
+
+def create_tables(database, models=None):
+    '''Create tables and indexes for {models} (all models by default) if they
+    don't already exist.'''
+    if models is None:
+        import_models()
+        models = model.registry
+    for model_class in models:
+        opts = model_class._meta
+        database.create_table(opts.table, opts.columns)
+        for columns in opts.indexes:
+            database.create_index(opts.table, columns)
+        for columns in opts.unique_indexes:
+            database.create_index(opts.table, columns, unique=True)
+
+
+def migrate(database=None):
+    '''Bring the database schema up to date. Everything happens in a single
+    transaction, so a failed migration leaves the database untouched.
+
+    @param database: Database to migrate. Defaults to the db singleton.
+    (SQLiteDatabase)
+    @returns: True if anything was done. (bool)
+    '''
+    if database is None:
+        database = db.db
+    target = latest_version()
+    current = database.get_user_version()
+    if current == target:
+        return False
+    if current > target:
+        raise ValueError('Database schema version {} is newer than this version '
+                         'of Harmony supports ({})'.format(current, target))
+    with database.transaction():
+        if current > 0:
+            for version, func in migrations:
+                if version > current:
+                    func(database)
+        # New databases get everything from here. Migrations create the tables
+        # they add; for existing databases, this picks up new indexes.
+        create_tables(database)
+        database.set_user_version(target)
+    return True
+
+
+#
+# Migrations
+#
+
+@migration(2)
+def add_change_journal(database):
+    create_tables(database, [model.Change])
+
+
+@migration(3)
+def add_caldav_columns(database):
+    from ..calendar import Calendar, Event
+    for model_class, columns in ((Calendar, ('href',)),
+                                 (Event, ('uid', 'href', 'etag'))):
+        opts = model_class._meta
+        for column in columns:
+            database.add_column(opts.table, column,
+                                opts.fields[column].column_spec)
+
+
+@migration(4)
+def add_caldav_service_cache(database):
+    from ..remote.discovery import CalDAVService
+    create_tables(database, [CalDAVService])
+
+
+@migration(5)
+def add_mailbox_state(database):
+    from ..remote.imap import MailboxState
+    create_tables(database, [MailboxState])
+
+
+@migration(6)
+def add_seen_messages(database):
+    from ..maildir import SeenMessage
+    create_tables(database, [SeenMessage])
+
+
+@migration(7)
+def add_event_dedupe_columns(database):
+    from ..calendar import Event
+    opts = Event._meta
+    for column in ('sequence', 'content_hash'):
+        database.add_column(opts.table, column, opts.fields[column].column_spec)
+    # Make way for the unique index on (calendar, uid) by dropping all but the
+    # newest copy of each event.
+    newest = {}
+    duplicates = []
+    for _, rows in database.select_chunks(opts.table,
+                                          columns=('id', 'calendar', 'uid'),
+                                          order_by=('id',)):
+        for event_id, calendar_id, uid in rows:
+            if uid is None:
+                continue
+            older = newest.get((calendar_id, uid))
+            if older is not None:
+                duplicates.append(older)
+            newest[(calendar_id, uid)] = event_id
+    for event_id in duplicates:
+        database.delete(opts.table, {'id': event_id})
+
+
+@migration(8)
+def add_event_data(database):
+    from ..blobs import Dictionary, EventData
+    create_tables(database, [Dictionary, EventData])
+
+
+@migration(9)
+def add_alarms(database):
+    from ..alarms import Alarm
+    create_tables(database, [Alarm])
+
+
+@migration(10)
+def add_event_data_dictionary_index(database):
+    from ..blobs import EventData
+    database.create_index(EventData._meta.table, ('dictionary',))
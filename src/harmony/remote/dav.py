@@ -1,21 +1,53 @@
 '''
 CalDAV client implementation.
+
+requests, urlobject and expat are imported when a client or parser is first
+made, not when this module is, so that importing it costs next to nothing.
 '''
 
-import datetime
-import requests
-import urlobject
-import xml.parsers.expat
+from .pool import WorkerPool
+from .scheduler import shared_scheduler
+
+
+# Redirects to follow in propfind(), and how many before giving up.
+REDIRECT_STATUSES = (301, 302, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class DAVError(Exception):
+    '''Raised for a request the server turned down in a way the caller may
+    want to handle.'''
+    def __init__(self, href, status):
+        super(DAVError, self).__init__('{} {}'.format(status, href))
+        self.href = href
+        self.status = status
+
+
+class PreconditionFailed(DAVError):
+    '''The resource's ETag didn't match the If-Match or If-None-Match
+    precondition: someone else changed it first.'''
+    pass
+
+
+class NotFound(DAVError):
+    '''There's no resource at the href.'''
+    pass
 
 
 class CalDAVClient(object):
     '''
-    CalDAV Client.
+    CalDAV Client. Requests go through {scheduler}, which paces them to what
+    the server will take and retries the ones it throttles; by default, one
+    shared by every client.
     '''
 
-    def __init__(self, url=None, auth=None):
+    def __init__(self, url=None, auth=None, scheduler=None):
+        import urlobject
         self.url = urlobject.URLObject(url)
         self.auth = auth
+        if scheduler is None:
+            scheduler = shared_scheduler()
+        self.scheduler = scheduler
 
     def _requests_kwargs(self):
         kwargs = {}
@@ -23,30 +55,203 @@ class CalDAVClient(object):
             kwargs['auth'] = self.auth
         return kwargs
 
-    def fetch_options(self):
-        kwargs = {}
-        if self.auth is not None:
-            kwargs['auth'] = self.auth
-        r = requests.options(str(self.url), **kwargs)
+    def _resolve(self, href=None):
+        '''Resolve {href} against the client's base URL. Hrefs handed back by
+        the server are usually absolute paths, so this is mostly a matter of
+        adding the scheme and host back on.'''
+        if href is None:
+            return str(self.url)
+        return str(self.url.relative(href))
+
+    def _send(self, method, url, **kwargs):
+        import requests
+        return requests.request(method, url, **kwargs)
+
+    def _request(self, method, href=None, headers=None, data=None,
+                 follow_redirects=True):
+        kwargs = self._requests_kwargs()
+        if headers is not None:
+            kwargs['headers'] = headers
+        if data is not None:
+            kwargs['data'] = data
+        if not follow_redirects:
+            kwargs['allow_redirects'] = False
+        url = self._resolve(href)
+        r = self.scheduler.send(url, lambda: self._send(method, url, **kwargs))
+        if r.status_code == 412:
+            raise PreconditionFailed(href, r.status_code)
+        if r.status_code == 404:
+            raise NotFound(href, r.status_code)
         r.raise_for_status()
+        return r
 
+    def options(self, href=None):
+        '''
+        Ask the server what it supports at {href}. Returns a dict of the
+        response headers, with 'allow' and 'dav' split into lists.
+        '''
+        r = self._request('OPTIONS', href)
         options = dict(r.headers)
-        options['allow'] = [field.strip().upper() for field in r.headers['allow'].split(',')]
-        options['dav'] = [field.strip().lower() for field in r.headers['dav'].split(',')]
+        options['allow'] = [field.strip().upper()
+                            for field in r.headers.get('allow', '').split(',')
+                            if field.strip()]
+        options['dav'] = [field.strip().lower()
+                          for field in r.headers.get('dav', '').split(',')
+                          if field.strip()]
+        return options
+
+    def fetch_options(self, href=None):
+        # Called unbound, so that it blocks on AsyncCalDAVClient too.
+        options = CalDAVClient.options(self, href)
         if 'PROPFIND' not in options['allow']:
             return None
         if 'calendar-access' not in options['dav']:
             return None
         return options
 
-    def fetch_calendar_descriptors(self):
+    def propfind(self, href=None, body=None, depth='0'):
         '''
-        Fetch and return a list of CalendarDescriptor objects from the CalDAV server.
+        Issue a PROPFIND against {href} and return the raw multistatus
+        response body. Redirects are followed here rather than by requests,
+        which would turn the PROPFIND into a GET.
         '''
-        r = requests.request('PROPFIND', str(self.url), **self._requests_kwargs())
-        r.raise_for_status()
-        return RootParser.parse(r.content)
+        headers = {'Depth': depth}
+        if body is not None:
+            headers['Content-Type'] = 'application/xml; charset=utf-8'
+        for _ in range(MAX_REDIRECTS + 1):
+            r = self._request('PROPFIND', href, headers=headers, data=body,
+                              follow_redirects=False)
+            if r.status_code not in REDIRECT_STATUSES:
+                return r.content
+            href = r.headers['location']
+        raise DAVError(href, r.status_code)
+
+    def fetch_calendar_descriptors(self, href=None):
+        '''
+        Fetch and return a list of CalendarDescriptor objects for the calendar
+        collections in {href}, by default the client's URL, from the CalDAV
+        server.
+        '''
+        return RootParser.parse(CalDAVClient.propfind(self, href, depth='1'))
+
+    def report(self, href, body, depth='1'):
+        '''
+        Issue a REPORT (calendar-query, calendar-multiget, ...) against {href}
+        and return the raw multistatus response body.
+        '''
+        headers = {'Depth': depth,
+                   'Content-Type': 'application/xml; charset=utf-8'}
+        return self._request('REPORT', href, headers=headers, data=body).content
+
+    def get(self, href):
+        '''
+        Fetch a single calendar object resource. Returns a tuple of the
+        iCalendar data and the resource's ETag.
+        '''
+        r = self._request('GET', href)
+        return r.content, r.headers.get('etag')
+
+    def put(self, href, data, etag=None, create=False):
+        '''
+        Store a calendar object resource at {href}. If {etag} is given, the
+        PUT only succeeds if the resource on the server still has that ETag.
+        With {create}, it only succeeds if there's no resource there yet.
+        Returns the new ETag, if the server sent one back.
+
+        @raises PreconditionFailed: If the precondition doesn't hold.
+        '''
+        headers = {'Content-Type': 'text/calendar; charset=utf-8'}
+        if etag is not None:
+            headers['If-Match'] = etag
+        elif create:
+            headers['If-None-Match'] = '*'
+        r = self._request('PUT', href, headers=headers, data=data)
+        return r.headers.get('etag')
+
+    def delete(self, href, etag=None):
+        '''
+        Delete the resource at {href}. If {etag} is given, the DELETE only
+        succeeds if the resource on the server still has that ETag.
+
+        @raises PreconditionFailed: If the ETag doesn't match.
+        @raises NotFound: If there's nothing at {href}.
+        '''
+        headers = {}
+        if etag is not None:
+            headers['If-Match'] = etag
+        self._request('DELETE', href, headers=headers)
+
+
+class AsyncCalDAVClient(CalDAVClient):
+    '''
+    CalDAV client that issues requests concurrently. It has the same methods as
+    CalDAVClient, but each one returns a Future immediately instead of
+    blocking. At most {max_concurrency} requests are in flight at once, and
+    they share a pool of keep-alive connections, so many clients pointed at the
+    same server can share one instance's pool by passing it in.
+    '''
+
+    def __init__(self, url=None, auth=None, max_concurrency=8, pool=None,
+                 session=None, scheduler=None):
+        super(AsyncCalDAVClient, self).__init__(url, auth, scheduler)
+        # close() only shuts down what this client made; a pool or session
+        # passed in may be shared with other clients.
+        self._owns_pool = pool is None
+        self._owns_session = session is None
+        if pool is None:
+            pool = WorkerPool(max_concurrency)
+        self.pool = pool
+        if session is None:
+            import requests
+            import requests.adapters
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=max_concurrency,
+                    pool_maxsize=max_concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def _send(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def _submit(self, method, *args, **kwargs):
+        return self.pool.submit(method, self, *args, **kwargs)
+
+    def options(self, href=None):
+        return self._submit(CalDAVClient.options, href)
+
+    def fetch_options(self, href=None):
+        return self._submit(CalDAVClient.fetch_options, href)
+
+    def propfind(self, href=None, body=None, depth='0'):
+        return self._submit(CalDAVClient.propfind, href, body, depth)
+
+    def fetch_calendar_descriptors(self, href=None):
+        return self._submit(CalDAVClient.fetch_calendar_descriptors, href)
+
+    def report(self, href, body, depth='1'):
+        return self._submit(CalDAVClient.report, href, body, depth)
+
+    def get(self, href):
+        return self._submit(CalDAVClient.get, href)
+
+    def get_many(self, hrefs):
+        '''Fetch all of {hrefs} concurrently. Returns a list of futures in the
+        same order as {hrefs}.'''
+        return [self.get(href) for href in hrefs]
+
+    def put(self, href, data, etag=None, create=False):
+        return self._submit(CalDAVClient.put, href, data, etag, create)
+
+    def delete(self, href, etag=None):
+        return self._submit(CalDAVClient.delete, href, etag)
 
+    def close(self):
+        if self._owns_pool:
+            self.pool.shutdown(wait=True)
+        if self._owns_session:
+            self.session.close()
 
 
 class CalendarDescriptor(object):
@@ -71,6 +276,7 @@ class RootParser(object):
     '''
 
     def __init__(self):
+        import xml.parsers.expat
         self._calendars = None
         self._parser = xml.parsers.expat.ParserCreate()
         self._tags = None
@@ -0,0 +1,201 @@
+'''
+CalDAV service discovery (RFC 6764), cached in the store.
+
+Finding an account's calendars takes several round trips: /.well-known/caldav
+redirects to the server's CalDAV root, which names the current user's
+principal, whose calendar-home-set is the collection the calendars live in; and
+an OPTIONS request there says what the server supports. None of that changes
+from one sync to the next, so what discovery finds is saved in the store and
+reused for {ttl} seconds. After that, it's revalidated with a single OPTIONS
+request against the home set, and discovery only starts over if that fails.
+'''
+
+import time
+
+from .dav import CalDAVClient, DAVError
+from ..persistence.model import IntegerField, Model, TextField
+
+
+WELL_KNOWN = '/.well-known/caldav'
+
+# How long discovery results are trusted before they're revalidated, in seconds.
+DEFAULT_TTL = 24 * 3600
+
+PRINCIPAL_QUERY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<d:propfind xmlns:d="DAV:">'
+    '<d:prop><d:current-user-principal/></d:prop>'
+    '</d:propfind>')
+
+HOME_SET_QUERY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<d:propfind xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+    '<d:prop><c:calendar-home-set/></d:prop>'
+    '</d:propfind>')
+
+
+class CalDAVService(Model):
+    '''What discovery found out about a CalDAV account.'''
+
+    # The URL the client was set up with.
+    url = TextField(unique=True)
+    # The current user's principal, if the server has one.
+    principal = TextField(null=True)
+    # The collection the calendars are in.
+    home = TextField()
+    # The Allow and DAV headers from OPTIONS on the home set, comma separated.
+    allow = TextField(default=u'')
+    dav = TextField(default=u'')
+    # When it was discovered or last revalidated, in epoch seconds.
+    checked = IntegerField()
+
+    class Meta:
+        journal = False
+
+    @property
+    def options(self):
+        '''What the server supports, in the same form as
+        CalDAVClient.options(). (dict)'''
+        return {'allow': [f for f in self.allow.split(',') if f],
+                'dav': [f for f in self.dav.split(',') if f]}
+
+    def supports(self, feature):
+        '''Does the server claim DAV compliance class {feature}, e.g.
+        'calendar-access'?'''
+        return feature.lower() in self.options['dav']
+
+    def expired(self, ttl, now=None):
+        if now is None:
+            now = time.time()
+        return now - self.checked >= ttl
+
+    def set_options(self, options):
+        self.allow = u','.join(options['allow'])
+        self.dav = u','.join(options['dav'])
+
+    def __unicode__(self):
+        return unicode(self.url)
+
+
+class HrefParser(object):
+    '''
+    Parser for a PROPFIND response that pulls out the href in one property,
+    like current-user-principal or calendar-home-set.
+    '''
+
+    def __init__(self, prop):
+        import xml.parsers.expat
+        self._prop = prop
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._tags = []
+        self._text = None
+        self._href = None
+
+    @classmethod
+    def parse(cls, data, prop):
+        '''@returns: The first href in {prop}, or None. (unicode)'''
+        parser = cls(prop)
+        parser._parser.StartElementHandler = parser._start_element
+        parser._parser.EndElementHandler = parser._end_element
+        parser._parser.CharacterDataHandler = parser._character_data
+        parser._parser.Parse(data, True)
+        return parser._href
+
+    def _local_name(self, name):
+        return name.rsplit(':', 1)[-1]
+
+    def _start_element(self, name, attribs):
+        tag = self._local_name(name)
+        if (tag == 'href' and self._href is None
+                and self._prop in self._tags):
+            self._text = []
+        self._tags.append(tag)
+
+    def _end_element(self, name):
+        tag = self._tags.pop()
+        if tag == 'href' and self._text is not None:
+            self._href = u''.join(self._text).strip() or None
+            self._text = None
+
+    def _character_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def _find_href(client, href, query, prop):
+    '''PROPFIND {href} for {prop}. Returns None if the server has nothing to
+    say about it.'''
+    try:
+        data = CalDAVClient.propfind(client, href, query)
+    except (DAVError, IOError):
+        # Not found, forbidden, not a DAV resource at all...
+        return None
+    return HrefParser.parse(data, prop)
+
+
+def _discover(client):
+    '''Walk from the well-known URI to the calendar home set.
+
+    @returns: The principal, or None, and the home set. (tuple)
+    '''
+    principal = (_find_href(client, WELL_KNOWN, PRINCIPAL_QUERY,
+                            'current-user-principal')
+                 or _find_href(client, None, PRINCIPAL_QUERY,
+                               'current-user-principal'))
+    home = None
+    if principal is not None:
+        home = _find_href(client, principal, HOME_SET_QUERY,
+                          'calendar-home-set')
+    if home is None:
+        # Servers that don't do discovery are pointed straight at the
+        # collection that holds the calendars.
+        home = unicode(client.url)
+    return principal, home
+
+
+def cached(client):
+    '''@returns: What's stored for {client}'s account, or None.
+    (CalDAVService)'''
+    for service in CalDAVService.select(url=unicode(client.url)):
+        return service
+    return None
+
+
+def discover(client, ttl=DEFAULT_TTL, now=None):
+    '''Find out where {client}'s calendars are and what the server supports,
+    from the store if it's been checked within {ttl} seconds.
+
+    @param client: (CalDAVClient)
+    @param now: The current time, epoch seconds. (float)
+    @returns: (CalDAVService)
+    @raises DAVError, IOError: If the home set turns out not to be there.
+    '''
+    if now is None:
+        now = time.time()
+    service = cached(client)
+    if service is not None and not service.expired(ttl, now):
+        return service
+    if service is not None:
+        try:
+            service.set_options(CalDAVClient.options(client, service.home))
+        except (DAVError, IOError):
+            service.delete()
+            service = None
+        else:
+            service.checked = int(now)
+            service.save()
+            return service
+    principal, home = _discover(client)
+    service = CalDAVService(url=unicode(client.url), principal=principal,
+                            home=home, checked=int(now))
+    service.set_options(CalDAVClient.options(client, home))
+    service.save()
+    return service
+
+
+def invalidate(client):
+    '''Forget what discovery found for {client}'s account, so the next
+    discover() starts over.'''
+    service = cached(client)
+    if service is not None:
+        service.delete()
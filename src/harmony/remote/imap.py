@@ -0,0 +1,302 @@
+'''
+Finding event invites in an IMAP mailbox.
+
+Only what's needed is sent over the wire. Messages are found by UID, starting
+after the highest one already looked at, and their structure is fetched in
+batches to find text/calendar parts without downloading the rest. Then the
+calendar parts, and only those, are fetched, again in batches: one FETCH per
+batch of messages that have a calendar part at the same section.
+
+imaplib is imported when a connection is first made, not when this module is.
+'''
+
+import base64
+import quopri
+import re
+import socket
+
+from ..persistence.model import IntegerField, Model, TextField
+
+
+# UIDs per FETCH command.
+BATCH_SIZE = 100
+
+# RFC 2177: servers may drop a client that's been idle for 30 minutes, so IDLE
+# is restarted more often than that.
+IDLE_TIMEOUT = 29 * 60
+
+
+class IMAPError(Exception):
+    '''Raised when the server answers a command with NO or BAD, or says
+    something we didn't expect.'''
+    pass
+
+
+class MailboxState(Model):
+    '''How far the messages in a mailbox have been looked at.'''
+
+    # user@host:port/mailbox
+    mailbox = TextField(unique=True)
+    # UIDs are only comparable while the mailbox's UIDVALIDITY stays the same.
+    uidvalidity = IntegerField(default=0)
+    # The highest UID looked at.
+    last_uid = IntegerField(default=0)
+
+    class Meta:
+        journal = False
+
+    @classmethod
+    def load(cls, mailbox):
+        '''@returns: The state of {mailbox}, a new one if there's none stored.
+        (MailboxState)'''
+        for state in cls.select(mailbox=mailbox):
+            return state
+        return cls(mailbox=mailbox)
+
+    def __unicode__(self):
+        return unicode(self.mailbox)
+
+
+def connect(host, user, password, port=None, ssl=True):
+    '''Connect and log in to an IMAP server.
+
+    @returns: The connection. (imaplib.IMAP4)
+    '''
+    import imaplib
+    if ssl:
+        conn = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT)
+    else:
+        conn = imaplib.IMAP4(host, port or imaplib.IMAP4_PORT)
+    try:
+        conn.login(user, password)
+    except:
+        conn.shutdown()
+        raise
+    return conn
+
+
+#
+# Parsing responses
+#
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_LITERAL = re.compile(r'\{(\d+)\}$')
+
+
+def _tokens(data):
+    '''Tokens of a response, as imaplib hands it back: a list of strings and,
+    for each literal, a (text before it, literal) tuple.'''
+    for item in data:
+        if isinstance(item, tuple):
+            text, literal = item
+            text = _LITERAL.sub('', text)
+        else:
+            text, literal = item, None
+        if text is None:
+            continue
+        pos = 0
+        while True:
+            m = _TOKEN.match(text, pos)
+            if m is None:
+                break
+            pos = m.end()
+            paren_open, paren_close, quoted, atom = m.groups()
+            if paren_open:
+                yield '('
+            elif paren_close:
+                yield ')'
+            elif quoted is not None:
+                yield _Quoted(re.sub(r'\\(.)', r'\1', quoted))
+            else:
+                yield atom
+        if literal is not None:
+            yield _Quoted(literal)
+
+
+class _Quoted(str):
+    '''A quoted string or literal, which is never NIL.'''
+    pass
+
+
+def parse(data):
+    '''Parse a response into nested lists. NIL is None; numbers are left as
+    strings.
+
+    @param data: What imaplib returned for a command. (list)
+    @returns: The top-level values. (list)
+    '''
+    stack = [[]]
+    for token in _tokens(data):
+        if token == '(' and not isinstance(token, _Quoted):
+            stack.append([])
+        elif token == ')' and not isinstance(token, _Quoted):
+            if len(stack) == 1:
+                raise IMAPError('Unbalanced parentheses in response')
+            done = stack.pop()
+            stack[-1].append(done)
+        elif token.upper() == 'NIL' and not isinstance(token, _Quoted):
+            stack[-1].append(None)
+        else:
+            stack[-1].append(str(token))
+    if len(stack) != 1:
+        raise IMAPError('Unbalanced parentheses in response')
+    return stack[0]
+
+
+def parse_fetch(data):
+    '''Parse the response to a UID FETCH.
+
+    @returns: The items fetched for each message, by UID. (dict of dict)
+    '''
+    values = parse(data)
+    messages = {}
+    # Responses come as: sequence number, (item value item value ...)
+    for seq, items in zip(values[::2], values[1::2]):
+        fields = dict((str(name).upper(), value)
+                      for name, value in zip(items[::2], items[1::2]))
+        if 'UID' in fields:
+            messages[int(fields['UID'])] = fields
+    return messages
+
+
+def calendar_parts(structure, section=''):
+    '''Find the text/calendar parts in a BODYSTRUCTURE.
+
+    @returns: (section, encoding) pairs. (generator)
+    '''
+    if structure and isinstance(structure[0], list):
+        # Multipart: the parts, then the subtype and extensions.
+        for i, part in enumerate(p for p in structure if isinstance(p, list)):
+            sub = '{}.{:d}'.format(section, i + 1) if section else str(i + 1)
+            for found in calendar_parts(part, sub):
+                yield found
+        return
+    if len(structure) < 6 or not structure[0] or not structure[1]:
+        return
+    if (structure[0].lower(), structure[1].lower()) == ('text', 'calendar'):
+        yield section or '1', (structure[5] or '7bit').lower()
+
+
+def decode(data, encoding):
+    '''Undo a Content-Transfer-Encoding.'''
+    if encoding == 'base64':
+        return base64.b64decode(data)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+
+def _check(response):
+    typ, data = response
+    if typ != 'OK':
+        raise IMAPError(' '.join(str(d) for d in data if d))
+    return data
+
+
+def _batches(uids):
+    for i in range(0, len(uids), BATCH_SIZE):
+        yield uids[i:i + BATCH_SIZE]
+
+
+class Mailbox(object):
+    '''
+    A mailbox on an IMAP server, seen through a logged-in imaplib connection.
+    '''
+
+    def __init__(self, conn, name='INBOX'):
+        self.conn = conn
+        self.name = name
+        self.uidvalidity = None
+
+    def select(self):
+        '''Open the mailbox, read-only.
+
+        @returns: Its UIDVALIDITY. (int)
+        '''
+        _check(self.conn.select(self.name, readonly=True))
+        _, data = self.conn.response('UIDVALIDITY')
+        self.uidvalidity = int(data[0]) if data and data[0] else 0
+        return self.uidvalidity
+
+    def new_uids(self, last_uid):
+        '''@returns: UIDs of the messages after {last_uid}, in order.
+        (list of int)'''
+        data = _check(self.conn.uid('SEARCH', 'UID',
+                                    '{:d}:*'.format(last_uid + 1)))
+        # n:* always matches the last message, even when its UID is below n.
+        return sorted(uid for uid in (int(u) for u in ' '.join(
+                          d for d in data if d).split())
+                      if uid > last_uid)
+
+    def calendar_parts(self, uids):
+        '''Fetch the text/calendar parts of the messages {uids}.
+
+        @returns: (uid, data) pairs, in UID order. A message can have more
+        than one. (list)
+        '''
+        # Which messages have calendar parts, and where.
+        sections = {}
+        for batch in _batches(uids):
+            data = _check(self.conn.uid('FETCH', ','.join(str(u) for u in batch),
+                                        '(BODYSTRUCTURE)'))
+            for uid, fields in parse_fetch(data).items():
+                for section, encoding in calendar_parts(
+                        fields.get('BODYSTRUCTURE') or []):
+                    sections.setdefault(section, []).append((uid, encoding))
+        found = []
+        for section, wanted in sorted(sections.items()):
+            encodings = dict(wanted)
+            item = 'BODY[{}]'.format(section)
+            for batch in _batches(sorted(encodings)):
+                data = _check(self.conn.uid(
+                        'FETCH', ','.join(str(u) for u in batch),
+                        '(BODY.PEEK[{}])'.format(section)))
+                for uid, fields in parse_fetch(data).items():
+                    if fields.get(item) is not None and uid in encodings:
+                        found.append((uid, decode(fields[item],
+                                                  encodings[uid])))
+        found.sort(key=lambda f: f[0])
+        return found
+
+    def idle(self, timeout=IDLE_TIMEOUT):
+        '''Wait for the server to say new messages have arrived, for up to
+        {timeout} seconds, with IDLE (RFC 2177). imaplib doesn't do IDLE, so
+        this talks to the connection directly.
+
+        @returns: True if messages arrived, False if it timed out. (bool)
+        @raises IMAPError: If the server refuses, or the connection drops.
+        '''
+        conn = self.conn
+        tag = conn._new_tag()
+        conn.send('{} IDLE\r\n'.format(tag))
+        line = conn.readline()
+        if not line.startswith('+'):
+            raise IMAPError('IDLE refused: {}'.format(line.strip()))
+        arrived = False
+        sock = conn.socket()
+        sock.settimeout(timeout)
+        try:
+            while not arrived:
+                line = conn.readline()
+                if not line:
+                    raise IMAPError('Connection closed during IDLE')
+                arrived = _is_exists(line)
+        except socket.timeout:
+            pass
+        finally:
+            sock.settimeout(None)
+        conn.send('DONE\r\n')
+        while True:
+            line = conn.readline()
+            if not line:
+                raise IMAPError('Connection closed during IDLE')
+            if line.startswith(tag + ' '):
+                if line.split(None, 2)[1].upper() != 'OK':
+                    raise IMAPError('IDLE failed: {}'.format(line.strip()))
+                return arrived
+            arrived = arrived or _is_exists(line)
+
+
+def _is_exists(line):
+    parts = line.split()
+    return len(parts) >= 3 and parts[0] == '*' and parts[2].upper() == 'EXISTS'
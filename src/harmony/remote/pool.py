@@ -0,0 +1,137 @@
+'''
+A small bounded worker pool for overlapping blocking network calls.
+'''
+
+import sys
+import threading
+import Queue
+
+
+class Future(object):
+    '''
+    The pending result of a call submitted to a WorkerPool.
+    '''
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        '''Block until the call finishes and return its result. If the call
+        raised, re-raise its exception here.
+
+        @param timeout: Seconds to wait before giving up. (float)
+        @returns: The return value of the call. (object)
+        '''
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for result')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for result')
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        '''Call {fn} with this future once it is done. If it is already done,
+        call {fn} right away.'''
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class WorkerPool(object):
+    '''
+    Run callables on at most {max_workers} threads. Threads are started lazily,
+    as work is submitted, and are daemons so they never hold up exit.
+    '''
+
+    def __init__(self, max_workers=8):
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        '''Schedule {fn}(*args, **kwargs) to run on a worker thread.
+
+        @returns: A Future for the result of the call. (Future)
+        '''
+        if self._shutdown:
+            raise RuntimeError('Cannot submit to a pool that has been shut down')
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        self._adjust_thread_count()
+        return future
+
+    def map(self, fn, iterable):
+        '''Call {fn} on each item of {iterable} concurrently, and return the
+        results in order. The first exception raised is re-raised here.'''
+        futures = [self.submit(fn, item) for item in iterable]
+        return [f.result() for f in futures]
+
+    def shutdown(self, wait=True):
+        self._shutdown = True
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _adjust_thread_count(self):
+        with self._lock:
+            if len(self._threads) >= self.max_workers:
+                return
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+def gather(futures):
+    '''Wait on all of {futures} and return their results, in order.'''
+    return [f.result() for f in futures]
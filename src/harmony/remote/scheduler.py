@@ -0,0 +1,184 @@
+'''
+Pacing requests to CalDAV servers so that we slow down when they push back.
+
+Each host gets a limit on how many requests may be in flight to it at once. The
+limit grows by about one for every limit's worth of requests that succeed, and
+halves when the server throttles us with a 429 or 503: additive increase,
+multiplicative decrease, as TCP does with its congestion window. Throughput then
+settles just under what the server will take, instead of swinging between a
+burst of errors and sitting idle.
+
+Throttled requests are retried. If the server said when to come back, with
+Retry-After, every request to that host waits until then. Otherwise the request
+waits a random time of up to base_delay * 2**attempt seconds, so that the
+requests throttled together don't all come back together.
+'''
+
+import random
+import threading
+import time
+import urlparse
+
+
+# Statuses servers use to tell us to slow down.
+THROTTLE_STATUSES = (429, 503)
+
+
+def retry_after(value, now=None):
+    '''Parse a Retry-After header.
+
+    @param value: The header: a number of seconds, or an HTTP date. (str)
+    @param now: The current time, epoch seconds. (float)
+    @returns: Seconds to wait, or None if {value} can't be parsed. (float)
+    '''
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import mktime_tz, parsedate_tz
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, mktime_tz(parsed) - now)
+
+
+class HostLimit(object):
+    '''
+    The concurrency limit for requests to one host.
+    '''
+
+    def __init__(self, initial=4, maximum=16, minimum=1, clock=time.time,
+                 sleep=time.sleep):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        # No new requests start before this time; see pause().
+        self.resume_at = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        # Bumped each time the limit is cut. Requests remember the epoch they
+        # started in, so a burst of throttled requests that were all in flight
+        # together only cuts the limit once.
+        self._epoch = 0
+
+    def acquire(self):
+        '''Wait for a free slot and take it.
+
+        @returns: The epoch to hand back to release(). (int)
+        '''
+        while True:
+            with self._cond:
+                wait = self.resume_at - self._clock()
+                if wait <= 0:
+                    if self.in_flight < int(self.limit):
+                        self.in_flight += 1
+                        return self._epoch
+                    self._cond.wait()
+                    continue
+            self._sleep(wait)
+
+    def release(self, epoch, status=None):
+        '''Give back a slot, adjusting the limit for how the request went.
+
+        @param epoch: What acquire() returned. (int)
+        @param status: The response's status code, or None if there wasn't a
+        response. (int)
+        '''
+        with self._cond:
+            self.in_flight -= 1
+            if status in THROTTLE_STATUSES:
+                if epoch == self._epoch:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._epoch += 1
+            elif status is not None and status < 500:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        '''Hold off starting requests for {seconds}.'''
+        with self._cond:
+            self.resume_at = max(self.resume_at, self._clock() + seconds)
+
+
+class RequestScheduler(object):
+    '''
+    Sends requests through per-host limits, and retries the ones that are
+    throttled. Share one between every client that might talk to the same
+    server; the limits only work if they see all of the traffic.
+    '''
+
+    def __init__(self, initial=4, maximum=16, max_retries=5, base_delay=0.5,
+                 max_delay=60.0, clock=time.time, sleep=time.sleep,
+                 random=random.random):
+        self.initial = initial
+        self.maximum = maximum
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host_limit(self, host):
+        '''@returns: The limit for {host}, making it if need be. (HostLimit)'''
+        with self._lock:
+            limit = self._hosts.get(host)
+            if limit is None:
+                limit = HostLimit(self.initial, self.maximum,
+                                  clock=self._clock, sleep=self._sleep)
+                self._hosts[host] = limit
+            return limit
+
+    def backoff(self, attempt):
+        '''Seconds to wait before retry number {attempt}, counting from 0.'''
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return self._random() * ceiling
+
+    def send(self, url, fn):
+        '''Make a request to {url} by calling {fn}, retrying it while the
+        server throttles it.
+
+        @param url: The URL the request is for. Only the host matters. (str)
+        @param fn: Makes the request and returns the response. (callable)
+        @returns: The response. If the server is still throttling after
+        max_retries retries, the last, throttled, response.
+        '''
+        limit = self.host_limit(urlparse.urlsplit(url).netloc)
+        attempt = 0
+        while True:
+            epoch = limit.acquire()
+            status = None
+            try:
+                r = fn()
+                status = r.status_code
+            finally:
+                limit.release(epoch, status)
+            if status not in THROTTLE_STATUSES or attempt >= self.max_retries:
+                return r
+            delay = retry_after(r.headers.get('retry-after'), self._clock())
+            if delay is not None:
+                limit.pause(min(delay, self.max_delay))
+            else:
+                self._sleep(self.backoff(attempt))
+            attempt += 1
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler():
+    '''@returns: The scheduler clients use unless they're given another.
+    (RequestScheduler)'''
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RequestScheduler()
+        return _shared
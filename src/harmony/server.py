@@ -0,0 +1,155 @@
+'''
+A long-running Harmony process that keeps the store open and its caches warm,
+and runs statements sent to it over a Unix socket. Scripts and status bars that
+run `harmony --exec` many times a second then pay for a socket round trip
+instead of starting an interpreter and opening the database each time.
+
+The protocol is one statement per connection. The client sends the statement as
+a line of UTF-8 text; the server replies with a status line (0 for success, 1
+for failure) followed by the statement's output, and closes the connection.
+'''
+
+import errno
+import os
+import socket
+import SocketServer
+from StringIO import StringIO
+
+from .app import CONFIG_DIRECTORY
+
+
+SOCKET_PATH = os.path.join(CONFIG_DIRECTORY, 'harmony.sock')
+
+# Statements are short; anything longer than this is a misbehaving client.
+MAX_STATEMENT_LENGTH = 64 * 1024
+
+
+class ServerRunningError(Exception):
+    '''Raised when starting a server on a socket another server is already
+    listening on.'''
+    pass
+
+
+class NoServerError(Exception):
+    '''Raised when there's no server listening on a socket.'''
+    pass
+
+
+class StatementHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline(MAX_STATEMENT_LENGTH)
+        statement = line.decode('utf-8').strip()
+        out = StringIO()
+        status = 0
+        try:
+            if statement:
+                status = self.server.execute(statement, out)
+        except Exception as e:
+            # One bad statement mustn't take the server down with it.
+            out.write(u'Error: {}\n'.format(e))
+            status = 1
+        output = out.getvalue()
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        self.wfile.write('{:d}\n'.format(status))
+        self.wfile.write(output)
+
+
+class HarmonyServer(SocketServer.UnixStreamServer):
+    '''
+    Serves statements over a Unix socket. Statements are run one at a time, in
+    the order they arrive, so frontends don't have to be thread safe.
+    '''
+
+    def __init__(self, path, execute):
+        '''
+        @param path: Path of the socket to listen on. (str)
+        @param execute: Called as execute(statement, out) to run a statement,
+        writing its output to the file-like {out}. Returns the exit status.
+        (callable)
+        @raises ServerRunningError: If a server is already listening at
+        {path}.
+        '''
+        self.path = path
+        self.execute = execute
+        _remove_stale_socket(path)
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # The socket runs statements as this user; nobody else gets to.
+        umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, StatementHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(path):
+    '''Remove the socket at {path} if whatever created it has gone away.'''
+    if not os.path.exists(path):
+        return
+    try:
+        sock = _connect(path)
+    except socket.error as e:
+        if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.unlink(path)
+    else:
+        sock.close()
+        raise ServerRunningError('A server is already listening on '
+                                 '{}'.format(path))
+
+
+def _connect(path, timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+def send(statement, path=SOCKET_PATH, timeout=None):
+    '''Run a statement on the server listening at {path}.
+
+    @param statement: The statement to run. (unicode)
+    @param timeout: Seconds to wait on the server, or None to wait forever.
+    (float)
+    @returns: The exit status and output. (tuple of int and str)
+    @raises NoServerError: If there's no server listening at {path}.
+    @raises socket.error: If the server goes away before replying. The
+    statement may or may not have run.
+    '''
+    try:
+        sock = _connect(path, timeout)
+    except socket.error as e:
+        if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        raise NoServerError('No server listening on {}'.format(path))
+    try:
+        if isinstance(statement, unicode):
+            statement = statement.encode('utf-8')
+        sock.sendall(statement.replace('\n', ' ') + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    status, _, output = ''.join(chunks).partition('\n')
+    if not status:
+        raise socket.error(errno.ECONNRESET, 'Server closed the connection')
+    return int(status), output
+
@@ -1,6 +1,6 @@
 from datetime import tzinfo
 
-from pytz import timezone as pytz_timezone
+from .tz import get_timezone
 
 
 class Setting(object):
@@ -9,6 +9,14 @@ class Setting(object):
     def __init__(self, default=None):
         self.default = default
 
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # Only reached when {instance} doesn't have a value yet; values that
+        # have been set take precedence. Raising here hands the lookup over to
+        # Settings.__getattr__, which fills the value in.
+        raise AttributeError
+
     def validate(self, new_value):
         return True
 
@@ -36,7 +44,11 @@ class TimezoneSetting(StringSetting):
         if isinstance(new_value, tzinfo):
             return new_value
         new_value = super(TimezoneSetting, self).transform(new_value)
-        return pytz_timezone(new_value)
+        try:
+            return get_timezone(new_value)
+        except KeyError:
+            # pytz's UnknownTimeZoneError
+            raise ValueError('Unknown timezone: {}'.format(new_value))
 
 
 class BooleanSetting(Setting):
@@ -77,17 +89,42 @@ class Settings(object):
     timezone = TimezoneSetting(default='UTC')
     # Use colors in the UI?
     color = BooleanSetting(default=True)
+    # Keep a snapshot of upcoming events for read-only views? See
+    # harmony.snapshot.
+    snapshot = BooleanSetting(default=False)
 
     def __new__(cls, *args, **kwargs):
         new_settings = super(Settings, cls).__new__(cls, *args, **kwargs)
         super(Settings, new_settings).__setattr__('_settings', {})
+        # Values that have already been checked, but not yet transformed. See
+        # load_checked().
+        super(Settings, new_settings).__setattr__('_pending', {})
         for stg, desc in vars(cls).iteritems():
             if not isinstance(desc, Setting):
                 continue
             new_settings._settings[stg] = desc
-            setattr(new_settings, stg, desc.default)
         return new_settings
 
+    @classmethod
+    def names(cls):
+        '''@returns: The names of all the settings. (list of str)'''
+        return sorted(name for name, desc in vars(cls).iteritems()
+                      if isinstance(desc, Setting))
+
+    def __getattr__(self, name):
+        # Only called for settings that haven't been set yet. Defaults and
+        # loaded values are transformed the first time they're read, so that,
+        # for instance, the timezone database isn't loaded until something asks
+        # for the timezone.
+        if name in ('_settings', '_pending') or name not in self._settings:
+            raise AttributeError(name)
+        if name in self._pending:
+            value = self._settings[name].transform(self._pending.pop(name))
+            super(Settings, self).__setattr__(name, value)
+        else:
+            setattr(self, name, None)
+        return super(Settings, self).__getattribute__(name)
+
     def __setattr__(self, name, value):
         desc = self._settings[name]
         if value is None:
@@ -97,4 +134,29 @@ class Settings(object):
                                                                          value))
         super(Settings, self).__setattr__(name, desc.transform(value))
 
+    def check(self, name, value):
+        '''Check that {value} is valid for the setting {name}, without changing
+        anything.
 
+        @returns: The value, transformed.
+        @raises ValueError: If there's no such setting, or {value} is invalid.
+        '''
+        desc = self._settings.get(name)
+        if desc is None:
+            raise ValueError("Unknown setting: '{}'".format(name))
+        if not desc.validate(value):
+            raise ValueError("Invalid value for setting '{}': {}".format(name,
+                                                                         value))
+        return desc.transform(value)
+
+    def load_checked(self, values):
+        '''Replace all of the settings with {values}, which must already have
+        been through check(). Settings missing from {values} go back to their
+        defaults.
+
+        @param values: Untransformed values, by setting name. (dict)
+        '''
+        for name in self._settings:
+            self.__dict__.pop(name, None)
+        self._pending.clear()
+        self._pending.update(values)
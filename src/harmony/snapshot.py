@@ -0,0 +1,338 @@
+'''
+A compact, read-only snapshot of the events in a rolling window of time, for
+views that only read and ask often: agendas, status bars, the next-event line in
+a prompt.
+
+The snapshot is a flat file of fixed-width columns, sorted by start time:
+
+    header
+    start   int64 x count    seconds since the epoch, UTC
+    end     int64 x count
+    id      int64 x count
+    calendar int64 x count
+    offset  uint32 x (count + 1)    into the summary text
+    summary text, UTF-8, end to end
+
+Readers map it into memory and binary search the start column in place, so a
+query touches only the records it returns and never goes near SQLite. Writers
+replace the file atomically, and readers pick up the new one the next time they
+look.
+
+The writer keeps the snapshot current as events change. Changes made through
+the models in this process are applied to the records already in the snapshot;
+only the part of the window that's new since the last write is read from the
+store.
+'''
+
+import mmap
+import os
+import struct
+import time
+from datetime import timedelta
+
+from .calendar import Event
+from .dateparse import format_stored
+from .tz import EPOCH, epoch
+
+
+MAGIC = 'HSNP'
+VERSION = 1
+
+# magic, version, count, window start, window end, longest event, summary bytes
+_HEADER = struct.Struct('<4sHxxIqqqI')
+_INT64 = struct.Struct('<q')
+
+# Window boundaries are rounded to this many seconds, so that the window only
+# moves, and the snapshot only has to be rewritten for it, every so often.
+WINDOW_GRANULARITY = 3600
+
+
+class SnapshotError(Exception):
+    '''Raised for a snapshot file that can't be read.'''
+    pass
+
+
+def write(path, window, records):
+    '''Write a snapshot file, replacing any that's there.
+
+    @param window: The (start, end) epoch range the snapshot covers. (tuple)
+    @param records: (start, end, id, calendar, summary) tuples, sorted by start
+    and then id. Times are epoch seconds. (list)
+    '''
+    count = len(records)
+    columns = [[], [], [], []]
+    offsets = [0]
+    summaries = []
+    total = 0
+    longest = 0
+    for start, end, event_id, calendar_id, summary in records:
+        for column, value in zip(columns, (start, end, event_id, calendar_id)):
+            column.append(int(value))
+        if end - start > longest:
+            longest = int(end - start)
+        text = summary.encode('utf-8') if summary else ''
+        summaries.append(text)
+        total += len(text)
+        offsets.append(total)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, count, int(window[0]),
+                             int(window[1]), longest, total))
+        int64s = struct.Struct('<{:d}q'.format(count))
+        for column in columns:
+            f.write(int64s.pack(*column))
+        f.write(struct.pack('<{:d}I'.format(count + 1), *offsets))
+        f.write(''.join(summaries))
+    os.rename(tmp, path)
+
+
+class SnapshotReader(object):
+    '''
+    Queries a snapshot file in place.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+        self._inode = None
+        self.count = 0
+        self.window = (0, 0)
+        self.refresh()
+
+    def refresh(self):
+        '''Switch to a newer snapshot, if the file has been replaced since it
+        was opened.
+
+        @returns: True if it was. (bool)
+        @raises SnapshotError: If there's no snapshot, or it's unreadable.
+        '''
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            raise SnapshotError('No snapshot at {}: {}'.format(self.path, e))
+        inode = (st.st_dev, st.st_ino, st.st_mtime)
+        if inode == self._inode:
+            return False
+        self.close()
+        f = open(self.path, 'rb')
+        try:
+            if st.st_size < _HEADER.size:
+                raise SnapshotError('Truncated snapshot: {}'.format(self.path))
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            f.close()
+            raise
+        magic, version, count, lo, hi, longest, text = \
+                _HEADER.unpack_from(m, 0)
+        if magic != MAGIC or version != VERSION:
+            m.close()
+            f.close()
+            raise SnapshotError('Not a snapshot: {}'.format(self.path))
+        self._file = f
+        self._map = m
+        self._inode = inode
+        self.count = count
+        self.window = (lo, hi)
+        self.longest = longest
+        column = 8 * count
+        self._starts = _HEADER.size
+        self._ends = self._starts + column
+        self._ids = self._ends + column
+        self._calendars = self._ids + column
+        self._offsets = self._calendars + column
+        self._text = self._offsets + 4 * (count + 1)
+        return True
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = None
+        self._file = None
+        self._inode = None
+
+    def __len__(self):
+        return self.count
+
+    def covers(self, start, end):
+        '''@returns: True if the snapshot has every event between {start} and
+        {end}, epoch seconds. (bool)'''
+        return self.window[0] <= start and end <= self.window[1]
+
+    def _start(self, i):
+        return _INT64.unpack_from(self._map, self._starts + 8 * i)[0]
+
+    def _bisect(self, value):
+        '''Index of the first record that starts at or after {value}.'''
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._start(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def record(self, i):
+        '''The {i}th record, in start order.
+
+        @returns: (start, end, id, calendar, summary) (tuple)
+        '''
+        m = self._map
+        unpack = _INT64.unpack_from
+        offset, next_offset = struct.unpack_from('<II', m,
+                                                 self._offsets + 4 * i)
+        return (unpack(m, self._starts + 8 * i)[0],
+                unpack(m, self._ends + 8 * i)[0],
+                unpack(m, self._ids + 8 * i)[0],
+                unpack(m, self._calendars + 8 * i)[0],
+                m[self._text + offset:self._text + next_offset].decode('utf-8'))
+
+    def between(self, start, end, calendars=None):
+        '''Find the events that overlap the range from {start} to {end}.
+
+        @param start: Range start, epoch seconds. (int)
+        @param end: Range end, epoch seconds. (int)
+        @param calendars: Only include events in these calendars, by id.
+        (set)
+        @returns: (start, end, id, calendar, summary) tuples, in start order.
+        (list)
+        '''
+        m = self._map
+        unpack = _INT64.unpack_from
+        # Nothing can overlap the range that starts more than the longest event
+        # before it.
+        i = self._bisect(start - self.longest)
+        found = []
+        while i < self.count:
+            event_start = unpack(m, self._starts + 8 * i)[0]
+            if event_start >= end:
+                break
+            if unpack(m, self._ends + 8 * i)[0] > start:
+                if calendars is None or \
+                        unpack(m, self._calendars + 8 * i)[0] in calendars:
+                    found.append(self.record(i))
+            i += 1
+        return found
+
+    def records(self):
+        '''Every record, in start order. (generator)'''
+        for i in xrange(self.count):
+            yield self.record(i)
+
+
+class SnapshotWriter(object):
+    '''
+    Keeps a snapshot of the events from {past} seconds ago until {future}
+    seconds from now up to date.
+
+    Connect event_changed() to the Event model's listeners, and call update()
+    whenever the snapshot should be brought up to date, e.g. after each
+    statement the server runs. Call invalidate() when the store may have
+    changed in ways the listener didn't see, like writes from another process.
+    An existing snapshot file is assumed to be current until then.
+    '''
+
+    def __init__(self, path, past=86400, future=30 * 86400):
+        self.path = path
+        self.past = past
+        self.future = future
+        # Changed events, by id: the new record, or None if it's gone.
+        self._changes = {}
+        self._stale = False
+
+    def window(self, now=None):
+        '''The window the snapshot should cover at {now}, epoch seconds.'''
+        if now is None:
+            now = time.time()
+        g = WINDOW_GRANULARITY
+        return (int(now - self.past) // g * g,
+                -(-int(now + self.future) // g) * g)
+
+    def event_changed(self, action, event):
+        '''Model listener for Event.'''
+        if action == 'delete':
+            self._changes[event.id] = None
+            return
+        self._changes[event.id] = (
+                epoch(event.start), epoch(event.end), event.id,
+                getattr(event.calendar, 'id', event.calendar), event.summary)
+
+    def invalidate(self):
+        '''Rebuild the snapshot from the store on the next update().'''
+        self._stale = True
+
+    def update(self, now=None):
+        '''Bring the snapshot up to date, if it isn't already.
+
+        @returns: True if the snapshot was written. (bool)
+        '''
+        window = self.window(now)
+        current = None
+        if not self._stale:
+            try:
+                current = SnapshotReader(self.path)
+            except SnapshotError:
+                pass
+        if current is None:
+            records = self._select(window)
+        else:
+            try:
+                old = current.window
+                if old == window and not self._changes:
+                    return False
+                if window[0] < old[0] or window[0] >= old[1]:
+                    records = self._select(window)
+                else:
+                    records = self._merge(current, window)
+            finally:
+                current.close()
+        write(self.path, window, records)
+        self._changes.clear()
+        self._stale = False
+        return True
+
+    def _select(self, window, start_from=None):
+        '''Read the events overlapping {window} from the store. With
+        {start_from}, only read the ones that start at or after it.'''
+        lo, hi = window
+        criteria = {'start__lt': _stored(hi), 'end__gt': _stored(lo)}
+        if start_from is not None:
+            criteria['start__ge'] = _stored(start_from)
+        cols = Event.select_columns(('start', 'end', 'id', 'calendar',
+                                     'summary'),
+                                    epoch_columns=('start', 'end'),
+                                    **criteria)
+        records = [(int(s), int(e), i, c, summary)
+                   for s, e, i, c, summary in zip(cols['start'], cols['end'],
+                                                  cols['id'], cols['calendar'],
+                                                  cols['summary'])]
+        records.sort(key=_sort_key)
+        return records
+
+    def _merge(self, current, window):
+        '''Carry the records in {current} over to {window}, applying changes
+        and reading only the events that start in the part of the window
+        {current} didn't cover.'''
+        lo, hi = window
+        changes = self._changes
+        records = [r for r in current.records()
+                   if r[2] not in changes and r[1] > lo and r[0] < hi]
+        if hi > current.window[1]:
+            records.extend(r for r in self._select(window,
+                                                   start_from=current.window[1])
+                           if r[2] not in changes)
+        records.extend(r for r in changes.values()
+                       if r is not None and r[1] > lo and r[0] < hi)
+        records.sort(key=_sort_key)
+        return records
+
+
+def _sort_key(record):
+    return (record[0], record[2])
+
+
+def _stored(seconds):
+    '''Epoch seconds in DateTimeField's storage format.'''
+    return format_stored(EPOCH + timedelta(seconds=seconds))
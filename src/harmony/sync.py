@@ -0,0 +1,703 @@
+'''
+Background synchronization. The sync service runs on its own thread so the
+frontends never wait on the network: it periodically pulls changes from every
+calendar source and commits them to the store in large batches, and it pushes
+local changes back to their sources from a write-behind queue.
+
+What each kind of source needs (HTTP, IMAP, Maildir, iCalendar parsing) is
+imported when it's first used, not when this module is, so that starting a
+frontend doesn't pay for sources it isn't configured with.
+'''
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from .calendar import Calendar, Event
+from .persistence import db
+
+
+log = logging.getLogger(__name__)
+
+
+class SyncSource(object):
+    '''
+    A place calendar data comes from and goes back to. Subclasses override
+    pull() and push().
+    '''
+
+    name = 'source'
+
+    def pull(self):
+        '''Return an iterable of model instances that changed on the remote
+        side since the last pull. They will be saved to the store.'''
+        return []
+
+    def push(self, changes):
+        '''Send local {changes} to the remote side. Changes are whatever was
+        handed to SyncService.queue_change(); for changes the service picked up
+        itself, they're (action, instance, fields, id) tuples, where {action}
+        is 'save' or 'delete', {fields} are the names of the fields that were
+        written and {id} is the instance's id when it changed, which a deleted
+        instance no longer has. Return the list of changes that could not be
+        pushed; these stay queued for the next run.'''
+        return []
+
+    def wants(self, instance):
+        '''Should local changes to {instance} be pushed to this source?'''
+        return False
+
+    def listen(self, notify):
+        '''Start listening for changes on the remote side, and call {notify}
+        when there are some, so they're pulled without waiting for the next
+        scheduled run. Sources that can't tell don't.'''
+        pass
+
+    def stop_listening(self):
+        pass
+
+
+class SyncService(object):
+    '''
+    Runs sync for a set of SyncSources on a background thread.
+
+    Incoming changes are saved to the store {batch_size} at a time, each batch
+    in a single transaction. Local changes handed to queue_change() are pushed
+    on the next run, or sooner if more than {flush_threshold} of them pile up.
+    With watch(), changes to models are queued for the sources that want them
+    as they're saved.
+    '''
+
+    def __init__(self, sources, interval=300, batch_size=500,
+                 flush_threshold=100):
+        self.sources = list(sources)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flush_threshold = flush_threshold
+        self.last_sync = None
+        self.last_error = None
+        self._outgoing = dict((id(src), deque()) for src in self.sources)
+        self._outgoing_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        # Set while the sync thread saves what sources hand back, so that those
+        # saves aren't queued to be pushed again.
+        self._local = threading.local()
+        self._watched = []
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='harmony-sync')
+        self._thread.daemon = True
+        self._thread.start()
+        for source in self.sources:
+            source.listen(self.sync_now)
+
+    def stop(self, timeout=None):
+        '''Ask the worker to exit. It does one last run first, so changes that
+        are still queued get pushed.'''
+        for source in self.sources:
+            source.stop_listening()
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def sync_now(self):
+        '''Wake the worker up for a sync run without waiting for the next
+        scheduled one. Returns immediately.'''
+        self._wakeup.set()
+
+    def queue_change(self, source, change):
+        '''Queue a local change to be pushed to {source}. Returns immediately.
+
+        @param source: One of this service's sources. (SyncSource)
+        @param change: The changed model instance. (Model)
+        '''
+        with self._outgoing_lock:
+            queue = self._outgoing[id(source)]
+            queue.append(change)
+            pending = len(queue)
+        if pending >= self.flush_threshold:
+            self._wakeup.set()
+
+    def watch(self, *models):
+        '''Queue saves and deletes of instances of {models} for every source
+        that wants them.'''
+        for model_class in models:
+            model_class._meta.listeners.append(self._model_changed)
+            self._watched.append(model_class)
+
+    def unwatch(self):
+        '''Stop watching models for changes.'''
+        for model_class in self._watched:
+            model_class._meta.listeners.remove(self._model_changed)
+        self._watched = []
+
+    def _model_changed(self, action, instance):
+        if getattr(self._local, 'applying', False):
+            return
+        for source in self.sources:
+            if source.wants(instance):
+                self.queue_change(source, (action, instance,
+                                           instance.dirty_fields, instance.id))
+
+    @contextmanager
+    def _applying(self):
+        self._local.applying = True
+        try:
+            yield
+        finally:
+            self._local.applying = False
+
+    def pending_changes(self):
+        with self._outgoing_lock:
+            return sum(len(q) for q in self._outgoing.values())
+
+    def run_once(self):
+        '''Do one full sync pass on the calling thread: push what is queued,
+        then pull and store what changed remotely. Then, if enough events'
+        iCalendar data has been stored, train a new dictionary to compress it
+        with; see harmony.blobs.'''
+        for source in self.sources:
+            try:
+                self._push(source)
+                self._pull(source)
+            except Exception as e:
+                # One misbehaving source shouldn't starve the others.
+                self.last_error = e
+                log.exception('Sync failed for %s', source.name)
+        from . import blobs
+        try:
+            blobs.retrain_if_due()
+        except Exception:
+            log.exception('Training a blob dictionary failed')
+        self.last_sync = time.time()
+
+    def _run(self):
+        while True:
+            self.run_once()
+            if self._stopping:
+                return
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _push(self, source):
+        with self._outgoing_lock:
+            queue = self._outgoing[id(source)]
+            changes = list(queue)
+            queue.clear()
+        if not changes:
+            return
+        try:
+            with self._applying():
+                failed = source.push(changes)
+        except Exception:
+            failed = changes
+            raise
+        finally:
+            if failed:
+                with self._outgoing_lock:
+                    self._outgoing[id(source)].extendleft(reversed(failed))
+
+    def _pull(self, source):
+        batch = []
+        for instance in source.pull():
+            batch.append(instance)
+            if len(batch) >= self.batch_size:
+                self._commit(batch)
+                batch = []
+        if batch:
+            self._commit(batch)
+
+    def _commit(self, batch):
+        with self._applying(), db.db.transaction():
+            for instance in batch:
+                instance.save()
+
+
+class CalDAVSource(SyncSource):
+    '''
+    Sync source backed by a CalDAV server. Pulls the server's calendar
+    collections into the store, and writes local changes to events in them
+    back. Where the collections are is found by service discovery, which is
+    cached in the store for {discovery_ttl} seconds.
+
+    Writes are conditional, so they never clobber changes someone else made
+    on the server: new events are PUT with If-None-Match: *, and updates and
+    deletes carry the ETag the event had when it was last seen. Many are in
+    flight at once, on the client's worker pool. When one fails its
+    precondition, the server's current copy is fetched, the fields changed
+    locally are merged into it, and the write is tried again against the new
+    ETag. Deletes win over changes made on the server; changes made locally
+    to an event that was deleted on the server are dropped.
+    '''
+
+    # Times to refetch, merge and retry a write that keeps losing races.
+    MAX_CONFLICT_RETRIES = 3
+
+    def __init__(self, client, pool=None, discovery_ttl=None):
+        '''
+        @param client: Client for the server. (CalDAVClient)
+        @param pool: Pool to push on. Defaults to the client's own, if it's an
+        AsyncCalDAVClient. (WorkerPool)
+        @param discovery_ttl: Seconds to trust cached discovery results before
+        checking them again; discovery.DEFAULT_TTL if omitted. (int)
+        '''
+        from .remote import discovery
+        from .remote.pool import WorkerPool
+        if discovery_ttl is None:
+            discovery_ttl = discovery.DEFAULT_TTL
+        self.client = client
+        self.discovery_ttl = discovery_ttl
+        self.name = str(client.url)
+        if pool is None:
+            pool = getattr(client, 'pool', None)
+        if pool is None:
+            pool = WorkerPool(8)
+        self.pool = pool
+        # Collection hrefs of calendars this source owns, by calendar id; None
+        # for calendars it doesn't.
+        self._collections = {}
+        # Each event's href and ETag as last written here, by id. Writes only
+        # update the store, so an instance loaded before one and deleted after
+        # doesn't know where the event is now.
+        self._written = {}
+
+    def _fetch_calendar_descriptors(self):
+        from .remote import discovery
+        from .remote.dav import CalDAVClient, NotFound
+        service = discovery.discover(self.client, self.discovery_ttl)
+        try:
+            return CalDAVClient.fetch_calendar_descriptors(self.client,
+                                                           service.home)
+        except NotFound:
+            # The home set has moved since it was discovered.
+            discovery.invalidate(self.client)
+            service = discovery.discover(self.client, self.discovery_ttl)
+            return CalDAVClient.fetch_calendar_descriptors(self.client,
+                                                           service.home)
+
+    def pull(self):
+        descriptors = self._fetch_calendar_descriptors() or []
+        for desc in descriptors:
+            name = desc.name or desc.href
+            existing = list(Calendar.select(name=name))
+            if existing:
+                cal = existing[0]
+                if cal.href != desc.href:
+                    cal.href = desc.href
+                    yield cal
+                continue
+            yield Calendar(name=name, href=desc.href)
+        self._collections.clear()
+
+    def wants(self, instance):
+        return (isinstance(instance, Event)
+                and self._collection(instance) is not None)
+
+    def _collection(self, event):
+        calendar_id = getattr(event.calendar, 'id', event.calendar)
+        try:
+            return self._collections[calendar_id]
+        except KeyError:
+            pass
+        href = None
+        for cal in Calendar.select(id=calendar_id):
+            if cal.href is not None and self._owns(cal.href):
+                href = cal.href
+        self._collections[calendar_id] = href
+        return href
+
+    def _owns(self, href):
+        return self.client._resolve(href).startswith(
+                self.client._resolve('/'))
+
+    def push(self, changes):
+        from uuid import uuid4
+        from .blobs import EventData
+        from .ical import FIELDS
+        from .remote import discovery
+        from .remote.dav import NotFound
+        # Several changes to one event only need one write, even when they
+        # came through different instances of it; the last one is current.
+        ops = OrderedDict()
+        for change in changes:
+            action, event, fields, event_id = change
+            earlier = ops.pop(event_id, None)
+            if earlier is not None:
+                fields = frozenset(fields) | earlier[2]
+            ops[event_id] = (action, event, frozenset(fields), event_id)
+
+        pending = []
+        for action, event, fields, event_id in ops.values():
+            if action != 'delete':
+                # The instance that was saved belongs to whoever saved it,
+                # who may be changing it again right now; what's in the store
+                # is what gets pushed.
+                event = _reload(event_id)
+                if event is None:
+                    # Deleted since; the delete is queued behind this.
+                    continue
+            # Workers only see plain values, never the instances.
+            values = dict((name, getattr(event, name)) for name in FIELDS)
+            uid = event.uid
+            href, etag = event.href, event.etag
+            blob = base = None
+            if action == 'delete':
+                href, etag = self._written.get(event_id, (href, etag))
+            else:
+                # Write out what we have of the original, so properties
+                # Harmony doesn't know about survive.
+                blob = EventData.load(event)
+                if blob is not None:
+                    base = blob.ical
+                if href is None:
+                    uid = uid or unicode(uuid4())
+                    href = u'{}/{}.ics'.format(
+                            self._collection(event).rstrip('/'), uid)
+            future = self.pool.submit(self._push_one, action, values, fields,
+                                      uid, href, etag, base)
+            pending.append((ops[event_id], blob, future))
+
+        failed = []
+        stored = []
+        for change, blob, future in pending:
+            try:
+                result = future.result()
+            except Exception as e:
+                log.exception('Pushing %s to %s failed', change[1], self.name)
+                failed.append(change)
+                if isinstance(e, NotFound):
+                    # The collection isn't where it was; look for it again
+                    # before the change is retried.
+                    discovery.invalidate(self.client)
+                    self._collections.clear()
+            else:
+                stored.append((change[3], blob, result))
+        with db.db.transaction():
+            for event_id, blob, result in stored:
+                # A copy of our own, as above; this runs on the sync thread.
+                event = _reload(event_id)
+                if event is None:
+                    self._written.pop(event_id, None)
+                    continue
+                if result is None:
+                    # Deleted on the server.
+                    self._written.pop(event_id, None)
+                    event.delete()
+                    continue
+                ical = result.pop('ical', None)
+                for name, value in result.items():
+                    setattr(event, name, value)
+                event.save()
+                self._written[event_id] = (event.href, event.etag)
+                if ical is not None:
+                    EventData.store(event, ical, blob).save()
+        return failed
+
+    def _push_one(self, action, values, fields, uid, href, etag, base=None):
+        '''Write one change to the server. Runs on a worker thread.
+
+        @param base: The event's original iCalendar data, if it has any.
+        (str)
+        @returns: The event's new field values, and under 'ical' the data
+        that was written, for saves; None if the event turned out to have been
+        deleted on the server. (dict)
+        @raises NotFound: If the PUT found no collection to write into.
+        '''
+        from .ical import FIELDS, event_to_ical, event_values
+        from .remote.dav import CalDAVClient, NotFound, PreconditionFailed
+        client = self.client
+        if action == 'delete':
+            if href is None:
+                # It never made it to the server.
+                return {}
+            for _ in range(self.MAX_CONFLICT_RETRIES + 1):
+                try:
+                    CalDAVClient.delete(client, href, etag)
+                    return {}
+                except NotFound:
+                    return {}
+                except PreconditionFailed:
+                    # Servers answer If-Match on a missing resource with 412,
+                    # so it may be gone rather than changed.
+                    try:
+                        _, etag = CalDAVClient.get(client, href)
+                    except NotFound:
+                        return {}
+            raise PreconditionFailed(href, 412)
+
+        result = {'uid': uid, 'href': href}
+        create = etag is None
+        data = event_to_ical(values, uid, base=base)
+        for _ in range(self.MAX_CONFLICT_RETRIES + 1):
+            try:
+                new_etag = CalDAVClient.put(client, href, data, etag=etag,
+                                            create=create)
+            except PreconditionFailed:
+                try:
+                    base, etag = CalDAVClient.get(client, href)
+                except NotFound:
+                    # The GET confirms it: deleted on the server.
+                    return None
+                create = False
+                server = event_values(base)
+                # Fields changed here win; the server's copy wins for the rest.
+                for name in FIELDS:
+                    if name not in fields:
+                        values[name] = result[name] = server[name]
+                data = event_to_ical(values, uid, base=base)
+                continue
+            if new_etag is None:
+                # Not every server sends the new ETag back.
+                _, new_etag = CalDAVClient.get(client, href)
+            result['etag'] = new_etag
+            result['ical'] = data
+            return result
+        raise PreconditionFailed(href, 412)
+
+
+class IMAPSource(SyncSource):
+    '''
+    Sync source that finds event invites in an IMAP mailbox and imports them
+    into {calendar}, by default the default calendar. Nothing is pushed back.
+
+    Each pull only looks at messages that arrived since the last one, going by
+    a UID high-water mark kept in the store, and only downloads their
+    text/calendar parts; see harmony.remote.imap. While the sync service is
+    running, a second connection IDLEs on the mailbox so new mail is pulled as
+    soon as it arrives.
+    '''
+
+    # Seconds to wait before reconnecting after the IDLE connection fails.
+    RECONNECT_DELAY = 60
+
+    def __init__(self, host, user, password, mailbox='INBOX', calendar=None,
+                 port=None, ssl=True, idle_timeout=None):
+        from .remote import imap
+        if idle_timeout is None:
+            idle_timeout = imap.IDLE_TIMEOUT
+        self.host = host
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.calendar = calendar
+        self.port = port
+        self.ssl = ssl
+        self.idle_timeout = idle_timeout
+        self.name = u'{}@{}:{}/{}'.format(user, host, port or '', mailbox)
+        self._stop_idle = threading.Event()
+        self._idle_thread = None
+        self._idle_conn = None
+
+    def connect(self):
+        from .remote import imap
+        return imap.connect(self.host, self.user, self.password, self.port,
+                            self.ssl)
+
+    def pull(self):
+        from .ical import import_events
+        from .remote import imap
+        calendar = _invite_calendar(self)
+        state = imap.MailboxState.load(self.name)
+        conn = self.connect()
+        try:
+            mailbox = imap.Mailbox(conn, self.mailbox)
+            if mailbox.select() != state.uidvalidity:
+                # The UIDs we knew about mean nothing any more.
+                state.uidvalidity = mailbox.uidvalidity
+                state.last_uid = 0
+            uids = mailbox.new_uids(state.last_uid)
+            if not uids:
+                return
+            seen = {}
+            for uid, data in mailbox.calendar_parts(uids):
+                try:
+                    instances = import_events(data, calendar, seen)
+                except ValueError:
+                    log.warning('Skipping bad calendar data in message %d in '
+                                '%s', uid, self.name)
+                    continue
+                for instance in instances:
+                    yield instance
+            # Last, so the new high-water mark is committed along with the
+            # events from the messages below it.
+            state.last_uid = uids[-1]
+            yield state
+        finally:
+            conn.logout()
+
+    def listen(self, notify):
+        if self._idle_thread is not None:
+            return
+        self._stop_idle.clear()
+        self._idle_thread = threading.Thread(target=self._idle, args=(notify,),
+                                             name='harmony-imap-idle')
+        self._idle_thread.daemon = True
+        self._idle_thread.start()
+
+    def stop_listening(self):
+        self._stop_idle.set()
+        conn = self._idle_conn
+        if conn is not None:
+            # Wakes the IDLE thread up out of its read.
+            try:
+                conn.shutdown()
+            except Exception:
+                pass
+        if self._idle_thread is not None:
+            self._idle_thread.join()
+            self._idle_thread = None
+
+    def _idle(self, notify):
+        from .remote import imap
+        while not self._stop_idle.is_set():
+            try:
+                self._idle_conn = self.connect()
+                mailbox = imap.Mailbox(self._idle_conn, self.mailbox)
+                mailbox.select()
+                while not self._stop_idle.is_set():
+                    if mailbox.idle(self.idle_timeout):
+                        notify()
+            except Exception:
+                if self._stop_idle.is_set():
+                    return
+                log.exception('IDLE on %s failed', self.name)
+                self._stop_idle.wait(self.RECONNECT_DELAY)
+            finally:
+                conn, self._idle_conn = self._idle_conn, None
+                if conn is not None:
+                    try:
+                        conn.shutdown()
+                    except Exception:
+                        pass
+
+
+class MaildirSource(SyncSource):
+    '''
+    Sync source that finds event invites in a Maildir and imports them into
+    {calendar}, by default the default calendar. Nothing is pushed back.
+
+    Only messages that haven't been seen before are read, and only as far as
+    it takes to find their text/calendar parts; see harmony.maildir. While the
+    sync service is running, new/ and cur/ are watched with inotify, if it's
+    available, so new mail is pulled as soon as it arrives.
+    '''
+
+    # Seconds between checks for being told to stop watching.
+    WATCH_POLL = 1
+
+    def __init__(self, path, calendar=None, use_inotify=True):
+        from . import maildir
+        self.path = os.path.abspath(path)
+        self.calendar = calendar
+        self.name = self.path
+        self.maildir = maildir.Maildir(self.path, use_inotify)
+        # Keys of the messages seen so far, once they've been loaded.
+        self._seen = None
+        self._stop_watching = threading.Event()
+        self._watch_thread = None
+
+    def pull(self):
+        from . import maildir
+        from .ical import import_events
+        calendar = _invite_calendar(self)
+        if self._seen is None:
+            self._seen = maildir.SeenMessage.keys(self.path)
+        paths, complete = self.maildir.changes()
+        present = set()
+        finished = False
+        try:
+            seen = {}
+            for path in paths:
+                key = maildir.message_key(path)
+                present.add(key)
+                if key in self._seen:
+                    continue
+                try:
+                    parts = maildir.calendar_parts(path)
+                except IOError:
+                    # Moved from new/ to cur/ since it was listed; it'll turn
+                    # up again under its new name.
+                    continue
+                for data in parts:
+                    try:
+                        instances = import_events(data, calendar, seen)
+                    except ValueError:
+                        log.warning('Skipping bad calendar data in %s', path)
+                        continue
+                    for instance in instances:
+                        yield instance
+                self._seen.add(key)
+                # Saved in the same batch as the events from the message.
+                yield maildir.SeenMessage(maildir=self.path, key=key)
+            finished = True
+        finally:
+            if not finished:
+                # Some of what was yielded may never have been stored, and
+                # the messages it came from won't be reported as changed
+                # again, so start over from a full listing.
+                self._seen = None
+                self.maildir.reset()
+        if complete:
+            gone = self._seen - present
+            if gone:
+                maildir.SeenMessage.forget(self.path, gone)
+                self._seen -= gone
+
+    def listen(self, notify):
+        if self._watch_thread is not None:
+            return
+        inotify = self.maildir.watch()
+        if inotify is None:
+            # Scheduled runs will have to do.
+            return
+        self._stop_watching.clear()
+        self._watch_thread = threading.Thread(target=self._watch,
+                                              args=(inotify, notify),
+                                              name='harmony-maildir-watch')
+        self._watch_thread.daemon = True
+        self._watch_thread.start()
+
+    def stop_listening(self):
+        self._stop_watching.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def _watch(self, inotify, notify):
+        try:
+            while not self._stop_watching.is_set():
+                if inotify.wait(self.WATCH_POLL) and inotify.read():
+                    notify()
+        finally:
+            inotify.close()
+
+
+def _reload(event_id):
+    '''@returns: The event with {event_id}, fresh from the store, or None if
+    it's gone. (Event)'''
+    return next(iter(Event.select(id=event_id)), None)
+
+
+def _invite_calendar(source):
+    '''The calendar an invite source imports into: the one it was given, or
+    the default calendar.'''
+    if source.calendar is not None:
+        return source.calendar
+    for cal in Calendar.select(is_default=True):
+        return cal
+    raise ValueError('No calendar to import invites from {} into'.format(
+            source.name))
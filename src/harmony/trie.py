@@ -0,0 +1,106 @@
+'''
+A prefix trie, for finding every word that starts with what's been typed so
+far without looking at the words that don't.
+
+Words are matched without regard to case, but come back spelled as they were
+added. A word can be added more than once, and stays in the trie until it's
+been discarded as many times.
+'''
+
+
+class _Node(object):
+    __slots__ = ('children', 'words')
+
+    def __init__(self):
+        # Child nodes, by lower-case character.
+        self.children = {}
+        # Words that end here, as they were spelled, and how many times each
+        # was added.
+        self.words = None
+
+
+class Trie(object):
+    '''
+    A set of words, with their counts, indexed by prefix. Adding and
+    discarding a word is O(len(word)); finding the k words with a prefix is
+    O(len(prefix) + k) plus the size of the subtree below it.
+    '''
+
+    def __init__(self, words=()):
+        self._root = _Node()
+        self._len = 0
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        '''Number of distinct words.'''
+        return self._len
+
+    def __contains__(self, word):
+        node = self._find(word.lower())
+        return node is not None and bool(node.words) and word in node.words
+
+    def _find(self, key):
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def add(self, word):
+        node = self._root
+        for char in word.lower():
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+        if node.words is None:
+            node.words = {}
+        count = node.words.get(word, 0)
+        if count == 0:
+            self._len += 1
+        node.words[word] = count + 1
+
+    def discard(self, word):
+        '''Take back one addition of {word}, if it's there.'''
+        path = [self._root]
+        for char in word.lower():
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        node = path[-1]
+        if not node.words or word not in node.words:
+            return
+        node.words[word] -= 1
+        if node.words[word]:
+            return
+        del node.words[word]
+        self._len -= 1
+        if not node.words:
+            node.words = None
+        # Prune the nodes that no longer lead anywhere.
+        for parent, char in zip(reversed(path[:-1]), reversed(word.lower())):
+            child = parent.children[char]
+            if child.words or child.children:
+                break
+            del parent.children[char]
+
+    def complete(self, prefix, limit=None):
+        '''@returns: Up to {limit} words starting with {prefix}, in order of
+        their lower-case spelling. (list of unicode)'''
+        node = self._find(prefix.lower())
+        found = []
+        if node is None:
+            return found
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.words:
+                found.extend(sorted(node.words))
+                if limit is not None and len(found) >= limit:
+                    return found[:limit]
+            stack.extend(node.children[char]
+                         for char in sorted(node.children, reverse=True))
+        return found
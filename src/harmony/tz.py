@@ -0,0 +1,196 @@
+'''
+Timezone registry. Looking up a timezone by name, and localizing datetimes with
+pytz, both cost more than one would hope; done once per event, they add up. This
+module keeps one tzinfo object per zone name, and a flattened table of each
+zone's UTC offset transitions for converting whole batches of datetimes between
+UTC and local time.
+
+pytz takes a while to import, so it isn't, until a timezone is actually needed.
+'''
+
+from bisect import bisect_right
+from datetime import datetime, timedelta, tzinfo
+from threading import Lock
+
+
+EPOCH = datetime(1970, 1, 1)
+
+_zones = {}
+_tables = {}
+_lock = Lock()
+
+
+def get_timezone(zone):
+    '''Look up a timezone by name. Zones are created once and shared. tzinfo
+    objects are passed through untouched.
+
+    @param zone: Timezone name, like 'America/Los_Angeles'. (str or tzinfo)
+    @returns: The timezone. (tzinfo)
+    @raises pytz.UnknownTimeZoneError: If {zone} isn't a known timezone.
+    '''
+    if isinstance(zone, tzinfo):
+        return zone
+    try:
+        return _zones[zone]
+    except KeyError:
+        pass
+    from pytz import timezone as pytz_timezone
+    tz = pytz_timezone(zone)
+    with _lock:
+        return _zones.setdefault(zone, tz)
+
+
+def get_transitions(zone):
+    '''Get the TransitionTable for a timezone, building it the first time it
+    is asked for.
+
+    @param zone: Timezone name or pytz timezone. (str or tzinfo)
+    @returns: The zone's transition table. (TransitionTable)
+    '''
+    tz = get_timezone(zone)
+    key = tz.zone
+    try:
+        return _tables[key]
+    except KeyError:
+        pass
+    table = TransitionTable(tz)
+    with _lock:
+        return _tables.setdefault(key, table)
+
+
+def _to_epoch(dt):
+    delta = dt - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def epoch(dt):
+    '''Seconds since the epoch for {dt}. Naive datetimes are taken to be in
+    UTC.'''
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    return _to_epoch(dt)
+
+
+class TransitionTable(object):
+    '''
+    A timezone's UTC offset history, as parallel lists that can be searched with
+    bisect: the epoch second each period starts at (in UTC), and the offset
+    and tzinfo in effect during it.
+    '''
+
+    def __init__(self, tz):
+        self.zone = tz
+        transition_times = getattr(tz, '_utc_transition_times', None)
+        if transition_times:
+            # A pytz DstTzInfo. It keeps a tzinfo instance per distinct
+            # (utcoffset, dst, tzname) triple; those are what localize() would
+            # hand back, so reuse them.
+            self.starts = [_to_epoch(t) if t.year > 1 else float('-inf')
+                           for t in transition_times]
+            self.offsets = [info[0] for info in tz._transition_info]
+            self.tzinfos = [tz._tzinfos[info] for info in tz._transition_info]
+            self.dst = [bool(info[1]) for info in tz._transition_info]
+        else:
+            # UTC or a StaticTzInfo; one offset, forever.
+            self.starts = [float('-inf')]
+            self.offsets = [tz.utcoffset(datetime(2000, 1, 1)) or timedelta(0)]
+            self.tzinfos = [tz]
+            self.dst = [False]
+        self.offset_seconds = [o.days * 86400 + o.seconds for o in self.offsets]
+
+    def _index(self, epoch):
+        return max(bisect_right(self.starts, epoch) - 1, 0)
+
+    def utcoffset(self, epoch):
+        '''The zone's UTC offset, in seconds, at {epoch} seconds UTC.'''
+        return self.offset_seconds[self._index(epoch)]
+
+    def to_local(self, datetimes):
+        '''Convert a batch of datetimes to local time in this zone. Naive
+        datetimes are taken to be in UTC.
+
+        @param datetimes: Datetimes to convert. (iterable of datetime)
+        @returns: Aware datetimes in this zone, equal to what astimezone()
+        would give. (list of datetime)
+        '''
+        starts = self.starts
+        offsets = self.offsets
+        tzinfos = self.tzinfos
+        local = []
+        append = local.append
+        # Batches tend to be sorted, so remember the current period and only
+        # bisect again when a datetime falls outside of it.
+        lo = hi = None
+        i = 0
+        last = len(starts) - 1
+        for dt in datetimes:
+            if dt.tzinfo is not None:
+                dt = dt.replace(tzinfo=None) - dt.utcoffset()
+            epoch = _to_epoch(dt)
+            if lo is None or not lo <= epoch < hi:
+                i = max(bisect_right(starts, epoch) - 1, 0)
+                lo = starts[i]
+                hi = starts[i + 1] if i < last else float('inf')
+            append((dt + offsets[i]).replace(tzinfo=tzinfos[i]))
+        return local
+
+    def to_utc(self, datetimes, is_dst=False):
+        '''Convert a batch of naive local times in this zone to UTC, with the
+        same results as pytz's localize() followed by normalize().
+
+        Local times that happen twice (when the clocks go back) are resolved
+        with {is_dst}. Local times that never happen (when the clocks go
+        forward) take the offset from after the transition if {is_dst} is set,
+        and from before it if not.
+
+        @param datetimes: Naive local datetimes. (iterable of datetime)
+        @param is_dst: Prefer the DST reading of ambiguous and nonexistent
+        times. (bool)
+        @returns: Aware UTC datetimes. (list of datetime)
+        '''
+        utc = []
+        append = utc.append
+        utc_tz = get_timezone('UTC')
+        is_dst = bool(is_dst)
+        for dt in datetimes:
+            off = self._local_offset(_to_epoch(dt), is_dst)
+            append((dt - timedelta(seconds=off)).replace(tzinfo=utc_tz))
+        return utc
+
+    def _local_offset(self, local_epoch, is_dst):
+        '''The UTC offset, in seconds, of the local time {local_epoch}, chosen
+        the way DstTzInfo.localize() chooses.'''
+        offset_seconds = self.offset_seconds
+        # The right offset is one that maps back to itself. There can be at
+        # most two candidates: the ones in effect a day either side.
+        candidates = {}
+        for probe in (local_epoch - 86400, local_epoch + 86400):
+            off = offset_seconds[self._index(probe)]
+            j = self._index(local_epoch - off)
+            if offset_seconds[j] == off:
+                candidates.setdefault(off, j)
+        if len(candidates) == 1:
+            return next(iter(candidates))
+        if not candidates:
+            # The clocks skipped this time. Take the offset from six hours to
+            # the side {is_dst} asks for, as localize() does.
+            shift = 6 * 3600 if is_dst else -6 * 3600
+            return self._local_offset(local_epoch + shift, is_dst)
+        matching = [off for off, j in candidates.items()
+                    if self.dst[j] == is_dst]
+        if len(matching) == 1:
+            return matching[0]
+        # Neither or both readings match {is_dst}; take the earliest in UTC.
+        return max(matching or candidates)
+
+
+def to_local(datetimes, zone):
+    '''Convert a batch of datetimes to local time in {zone}. See
+    TransitionTable.to_local.'''
+    return get_transitions(zone).to_local(datetimes)
+
+
+def to_utc(datetimes, zone, is_dst=False):
+    '''Convert a batch of naive local datetimes in {zone} to UTC. See
+    TransitionTable.to_utc.'''
+    return get_transitions(zone).to_utc(datetimes, is_dst=is_dst)
@@ -0,0 +1,76 @@
+'''
+Test cases for harmony.persistence.db.
+'''
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import harmony.persistence.db as db
+
+
+class ConnectionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.db')
+        self.manager = db.ConnectionManager(self.path, readers=2)
+        self.manager.writer.execute('CREATE TABLE t (x INTEGER)')
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_wal(self):
+        mode = self.manager.writer.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_reader_is_read_only(self):
+        with self.manager.reader() as conn:
+            self.assertRaises(sqlite3.OperationalError, conn.execute,
+                              'INSERT INTO t VALUES (1)')
+
+    def test_read_during_write(self):
+        '''A reader sees the last committed state while the writer has a
+        transaction open, instead of failing with "database is locked".'''
+        self.manager.writer.execute('INSERT INTO t VALUES (1)')
+        self.manager.writer.execute('BEGIN')
+        self.manager.writer.execute('INSERT INTO t VALUES (2)')
+        with self.manager.reader() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+        self.assertEqual(count, 1)
+        self.manager.writer.commit()
+
+    def test_reader_pool_bounded(self):
+        with self.manager.reader() as a:
+            with self.manager.reader() as b:
+                self.assertFalse(a is b)
+        with self.manager.reader() as c:
+            pass
+        self.assertTrue(c is a or c is b)
+        self.assertEqual(self.manager._reader_count, 2)
+
+
+class SQLiteDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        db.db._write('CREATE TABLE t (x INTEGER)')
+
+    def tearDown(self):
+        db.db.close()
+
+    def test_insert_select(self):
+        db.db.insert('t', {'x': 1})
+        db.db.insert('t', {'x': 5})
+        self.assertEqual(db.db.select('t', {'x__gt': 2}), [{'x': 5}])
+
+    def test_transaction_rollback(self):
+        try:
+            with db.db.transaction():
+                db.db.insert('t', {'x': 1})
+                self.assertEqual(len(db.db.select('t')), 1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(db.db.select('t'), [])
@@ -0,0 +1,117 @@
+'''
+Test cases for harmony.persistence.model.
+'''
+
+import datetime
+import unittest
+
+import pytz
+
+import harmony.persistence.db as db
+import harmony.persistence.schema as schema
+from harmony.calendar import Calendar, Event
+from harmony.persistence.model import Change
+
+
+class ModelTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.cal = Calendar.create(name='Work', timezone=pytz.timezone('UTC'))
+        self.start = datetime.datetime(2013, 3, 1, 9, 0, tzinfo=pytz.utc)
+        for i in range(25):
+            Event.create(summary='Event {}'.format(i), calendar=self.cal,
+                         start=self.start + datetime.timedelta(hours=i),
+                         end=self.start + datetime.timedelta(hours=i, minutes=30))
+
+    def tearDown(self):
+        db.db.close()
+
+    def test_from_rows_matches_from_row(self):
+        rows = db.db.select('event')
+        slow = [Event.from_row(row) for row in rows]
+        columns, chunk = next(db.db.select_chunks('event'))
+        fast = Event.from_rows(columns, chunk)
+        self.assertEqual([vars(e) for e in slow], [vars(e) for e in fast])
+
+    def test_select_chunks(self):
+        events = list(Event.select(chunk_size=7))
+        self.assertEqual(len(events), 25)
+        self.assertEqual(events[0].start, self.start)
+        self.assertEqual(events[0].calendar, self.cal.id)
+        self.assertEqual(events[0].all_day, False)
+
+    def test_select_criteria(self):
+        cals = list(Calendar.select(name='Work'))
+        self.assertEqual(len(cals), 1)
+        self.assertEqual(cals[0].timezone, pytz.timezone('UTC'))
+
+    def test_select_columns(self):
+        cols = Event.select_columns(('summary', 'start'),
+                                    epoch_columns=('start',), chunk_size=10)
+        self.assertEqual(len(cols['summary']), 25)
+        self.assertEqual(cols['start'].typecode, 'd')
+        self.assertEqual(cols['start'][1] - cols['start'][0], 3600)
+
+
+class ChangeTrackingTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.cal = Calendar.create(name='Work', timezone=pytz.timezone('UTC'))
+        start = datetime.datetime(2013, 3, 1, 9, 0, tzinfo=pytz.utc)
+        Event.create(summary='Standup', calendar=self.cal, start=start,
+                     end=start + datetime.timedelta(minutes=30))
+        self.event = next(Event.select())
+
+    def tearDown(self):
+        db.db.close()
+
+    def journal(self):
+        return [(c.model, c.row, c.action, c.columns)
+                for c in Change.since(0)]
+
+    def test_loaded_instances_are_clean(self):
+        self.assertEqual(self.event.dirty_fields, frozenset())
+        self.event.summary = u'Standup'
+        self.assertEqual(self.event.dirty_fields, frozenset())
+        self.event.summary = u'Retro'
+        self.assertEqual(self.event.dirty_fields, frozenset(['summary']))
+
+    def test_update_writes_changed_columns(self):
+        seq = Change.latest()
+        self.event.summary = u'Retro'
+        self.event.save()
+        self.assertEqual(self.event.dirty_fields, frozenset())
+        changes = list(Change.since(seq))
+        self.assertEqual([(c.action, c.columns) for c in changes],
+                         [(u'update', u'summary')])
+        self.assertEqual(next(Event.select()).summary, u'Retro')
+        # Nothing changed, so nothing is written.
+        self.event.save()
+        self.assertEqual(Change.latest(), changes[-1].id)
+
+    def test_journal(self):
+        self.event.delete()
+        self.assertEqual(self.journal(), [
+            (u'calendar', self.cal.id, u'insert',
+             u'href is_default name timezone'),
+            (u'event', 1, u'insert',
+             u'all_day calendar content_hash end etag href sequence start '
+             u'summary uid'),
+            (u'event', 1, u'delete', u''),
+        ])
+        self.assertEqual([c.id for c in Change.since(1, model=Event)], [2, 3])
+        Change.prune(2)
+        self.assertEqual([c.id for c in Change.since(0)], [3])
+
+    def test_journal_pruned(self):
+        retain, Change.RETAIN = Change.RETAIN, 4
+        try:
+            for i in range(10):
+                self.event.summary = u'Event {}'.format(i)
+                self.event.save()
+        finally:
+            Change.RETAIN = retain
+        # 12 entries made, and pruned after the 4th, 8th and 12th.
+        self.assertEqual([c.id for c in Change.since(0)], [9, 10, 11, 12])
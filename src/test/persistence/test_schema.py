@@ -0,0 +1,117 @@
+'''
+Test cases for harmony.persistence.schema.
+'''
+
+import os
+import subprocess
+import sys
+import unittest
+import harmony.persistence.db as db
+import harmony.persistence.schema as schema
+from harmony.calendar import Calendar, Event
+
+
+SRC = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        self.migrations = list(schema.migrations)
+
+    def tearDown(self):
+        schema.migrations[:] = self.migrations
+        db.db.close()
+
+    def names(self, typ):
+        with db.db._read('SELECT name FROM sqlite_master WHERE type = ?',
+                         [typ]) as cur:
+            return set(row[0] for row in cur.fetchall())
+
+    def test_create_from_models(self):
+        self.assertTrue(schema.migrate())
+        self.assertTrue(set(['calendar', 'event']) <= self.names('table'))
+        self.assertTrue('ix_event_calendar_start_end' in self.names('index'))
+        self.assertEqual(db.db.get_user_version(), schema.latest_version())
+        cal = Calendar.create(name='Work')
+        self.assertEqual(db.db.select('calendar')[0]['name'], 'Work')
+
+    def test_creates_models_not_imported_yet(self):
+        # In a process that has only imported some of the models so far, a new
+        # database still gets all of them.
+        out = subprocess.check_output([sys.executable, '-c',
+            'import harmony.persistence.db as db, harmony.persistence.schema '
+            'as schema; db.initialize_sqlite(":memory:"); schema.migrate(); '
+            'print(" ".join(r["name"] for r in db.db.select("sqlite_master")))'],
+            cwd=SRC)
+        tables = set(out.decode('utf-8').split())
+        for table in ('event', 'caldavservice', 'mailboxstate', 'seenmessage',
+                      'dictionary', 'eventdata', 'alarm'):
+            self.assertIn(table, tables)
+
+    def test_up_to_date_is_noop(self):
+        schema.migrate()
+        self.assertFalse(schema.migrate())
+
+    def test_migration(self):
+        schema.migrate()
+        base = schema.latest_version()
+
+        @schema.migration(base + 1)
+        def add_column(database):
+            database.add_column('calendar', 'color', 'TEXT')
+
+        self.assertTrue(schema.migrate())
+        db.db.insert('calendar', {'name': 'x', 'color': 'red'})
+        self.assertEqual(db.db.get_user_version(), base + 1)
+
+    def test_event_dedupe_migration(self):
+        # An event table as it was at version 6, with two copies of an event.
+        columns = Event._meta.columns
+        del columns['sequence'], columns['content_hash']
+        db.db.create_table('event', columns)
+        for event_id in (1, 2, 3):
+            db.db.insert('event', {
+                'id': event_id, 'summary': 'x', 'all_day': 0,
+                'start': '2013-03-01 09:00:00', 'end': '2013-03-01 10:00:00',
+                'calendar': 1, 'uid': None if event_id == 3 else 'a'})
+        db.db.set_user_version(6)
+        schema.migrate()
+        self.assertEqual(sorted(row['id'] for row in db.db.select('event')),
+                         [2, 3])
+        self.assertTrue('ix_event_calendar_uid' in self.names('index'))
+        self.assertEqual(db.db.select('event', {'id': 2})[0]['sequence'], 0)
+
+    def test_migrations_create_their_tables(self):
+        # Calendar and event tables as they were at version 1. The migrations
+        # alone, without the create_tables() that follows them, bring it up to
+        # date.
+        for model_class, dropped in ((Calendar, ('href',)),
+                                     (Event, ('uid', 'href', 'etag', 'sequence',
+                                              'content_hash'))):
+            columns = model_class._meta.columns
+            for column in dropped:
+                del columns[column]
+            db.db.create_table(model_class._meta.table, columns)
+        for version, func in schema.migrations:
+            if version > 1:
+                func(db.db)
+        self.assertTrue(set(['change', 'caldavservice', 'mailboxstate',
+                             'seenmessage', 'dictionary', 'eventdata',
+                             'alarm']) <= self.names('table'))
+        self.assertTrue('ix_eventdata_dictionary' in self.names('index'))
+
+    def test_failed_migration_rolls_back(self):
+        schema.migrate()
+        base = schema.latest_version()
+
+        @schema.migration(base + 1)
+        def broken(database):
+            database.add_column('calendar', 'color', 'TEXT')
+            raise RuntimeError('nope')
+
+        self.assertRaises(RuntimeError, schema.migrate)
+        self.assertEqual(db.db.get_user_version(), base)
+        self.assertRaises(Exception, db.db.insert, 'calendar',
+                          {'name': 'x', 'color': 'red'})
@@ -0,0 +1,175 @@
+'''
+A local IMAP server, just big enough to test harmony.remote.imap against:
+LOGIN, SELECT/EXAMINE, UID SEARCH, UID FETCH of BODYSTRUCTURE and body
+sections, IDLE and LOGOUT. Every command it receives is logged.
+'''
+
+import base64
+import re
+import select
+import SocketServer
+import threading
+
+
+class Part(object):
+    def __init__(self, maintype, subtype, payload, encoding='7bit'):
+        self.maintype = maintype
+        self.subtype = subtype
+        self.encoding = encoding
+        if encoding == 'base64':
+            payload = base64.b64encode(payload)
+        self.payload = payload
+
+    def structure(self):
+        return '("{}" "{}" ("charset" "utf-8") NIL NIL "{}" {:d} {:d})'.format(
+                self.maintype, self.subtype, self.encoding.upper(),
+                len(self.payload), self.payload.count('\n'))
+
+
+def message(*parts):
+    '''A message with {parts}, each a Part.'''
+    return list(parts)
+
+
+def _structure(parts):
+    if len(parts) == 1:
+        return parts[0].structure()
+    return '({} "mixed")'.format(''.join(p.structure() for p in parts))
+
+
+def _uid_set(spec, uids):
+    found = set()
+    top = max(uids) if uids else 0
+    for piece in spec.split(','):
+        if ':' in piece:
+            lo, hi = piece.split(':')
+            lo = int(lo)
+            hi = top if hi == '*' else int(hi)
+            if lo > hi:
+                lo, hi = hi, lo
+            found.update(u for u in uids if lo <= u <= hi)
+        else:
+            found.add(int(piece))
+    return sorted(u for u in found if u in uids)
+
+
+class IMAPHandler(SocketServer.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        self.send('* OK [CAPABILITY IMAP4rev1 IDLE] Fake IMAP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.rstrip('\r\n')
+            server.log.append(line)
+            tag, command, rest = (line.split(' ', 2) + ['', ''])[:3]
+            command = command.upper()
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE')
+            elif command == 'LOGIN':
+                pass
+            elif command in ('SELECT', 'EXAMINE'):
+                self.send('* {:d} EXISTS'.format(len(server.messages)))
+                self.send('* OK [UIDVALIDITY {:d}] UIDs valid'.format(
+                        server.uidvalidity))
+            elif command == 'UID':
+                self.uid(rest)
+            elif command == 'IDLE':
+                self.idle(tag)
+                continue
+            elif command == 'LOGOUT':
+                self.send('* BYE')
+                self.send('{} OK LOGOUT completed'.format(tag))
+                return
+            else:
+                self.send('{} BAD Unknown command'.format(tag))
+                continue
+            self.send('{} OK {} completed'.format(tag, command))
+
+    def uid(self, rest):
+        server = self.server
+        command, args = rest.split(' ', 1)
+        uids = sorted(server.messages)
+        if command.upper() == 'SEARCH':
+            spec = args.split()[-1]
+            found = _uid_set(spec, uids)
+            if not found and spec.endswith(':*') and uids:
+                found = [uids[-1]]
+            self.send('* SEARCH ' + ' '.join(str(u) for u in found))
+            return
+        spec, items = args.split(' ', 1)
+        for uid in _uid_set(spec, uids):
+            seq = uids.index(uid) + 1
+            parts = server.messages[uid]
+            if 'BODYSTRUCTURE' in items:
+                self.send('* {:d} FETCH (UID {:d} BODYSTRUCTURE {})'.format(
+                        seq, uid, _structure(parts)))
+                continue
+            section = re.search(r'BODY\.PEEK\[([\d.]+)\]', items).group(1)
+            index = int(section.split('.')[-1]) - 1
+            payload = parts[index].payload
+            self.wfile.write('* {:d} FETCH (UID {:d} BODY[{}] {{{:d}}}\r\n'
+                             '{})\r\n'.format(seq, uid, section, len(payload),
+                                              payload))
+
+    def idle(self, tag):
+        server = self.server
+        self.send('+ idling')
+        known = len(server.messages)
+        while True:
+            if len(server.messages) > known:
+                known = len(server.messages)
+                self.send('* {:d} EXISTS'.format(known))
+            ready, _, _ = select.select([self.connection], [], [], 0.02)
+            if ready:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                server.log.append(line.rstrip('\r\n'))
+                self.send('{} OK IDLE terminated'.format(tag))
+                return
+
+
+class FakeIMAPServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 IMAPHandler)
+        self.port = self.server_address[1]
+        # Messages, as lists of Parts, by UID.
+        self.messages = {}
+        self.uidvalidity = 1
+        self.log = []
+        self._next_uid = 1
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def add(self, parts):
+        uid = self._next_uid
+        self._next_uid += 1
+        self.messages[uid] = parts
+        return uid
+
+    def commands(self, name):
+        '''Logged commands that start with {name}, without their tags.'''
+        found = []
+        for line in self.log:
+            command = line.split(' ', 1)[-1]
+            if command.upper().startswith(name.upper()):
+                found.append(command)
+        return found
@@ -4,6 +4,7 @@ Test cases for harmony.remote.dav.
 
 import unittest
 import harmony.remote.dav as dav
+import harmony.remote.scheduler as scheduler
 
 
 class TestCalDAVClient(unittest.TestCase):
@@ -32,3 +33,76 @@ class TestRootParser(unittest.TestCase):
         ns, tag = self.parser._split_namespace('foo')
         self.assertTrue(ns == '')
         self.assertTrue(tag == 'foo')
+
+
+class FakeResponse(object):
+    def __init__(self, content='', headers=None, status_code=200):
+        self.content = content
+        self.headers = headers or {}
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return FakeResponse(content=url, headers={'etag': '"1"'})
+
+    def close(self):
+        pass
+
+
+class TestAsyncCalDAVClient(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession()
+        self.client = dav.AsyncCalDAVClient('http://example.com/dav/',
+                                            max_concurrency=4,
+                                            session=self.session)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_get_many(self):
+        futures = self.client.get_many(['a.ics', 'b.ics', '/c.ics'])
+        results = [f.result(5) for f in futures]
+        self.assertEqual(results[0], ('http://example.com/dav/a.ics', '"1"'))
+        self.assertEqual(results[2], ('http://example.com/c.ics', '"1"'))
+        self.assertEqual(len(self.session.requests), 3)
+
+    def test_put_if_match(self):
+        etag = self.client.put('a.ics', 'DATA', etag='"0"').result(5)
+        self.assertEqual(etag, '"1"')
+        method, url, kwargs = self.session.requests[0]
+        self.assertEqual(method, 'PUT')
+        self.assertEqual(kwargs['headers']['If-Match'], '"0"')
+
+    def test_throttled_request_retried(self):
+        self.session.request = self._throttle_once(self.session.request)
+        self.client.scheduler = scheduler.RequestScheduler(
+                sleep=lambda seconds: None)
+        etag = self.client.put('a.ics', 'DATA').result(5)
+        self.assertEqual(etag, '"1"')
+        self.assertEqual([r[0] for r in self.session.requests], ['PUT'])
+
+    def test_shared_pool_outlives_client(self):
+        other = dav.AsyncCalDAVClient('http://example.com/dav/',
+                                      pool=self.client.pool,
+                                      session=self.session)
+        other.close()
+        self.assertEqual(self.client.get('a.ics').result(5),
+                         ('http://example.com/dav/a.ics', '"1"'))
+
+    def _throttle_once(self, request):
+        throttled = []
+
+        def throttle(method, url, **kwargs):
+            if not throttled:
+                throttled.append(url)
+                return FakeResponse(status_code=429)
+            return request(method, url, **kwargs)
+        return throttle
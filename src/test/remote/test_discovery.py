@@ -0,0 +1,116 @@
+'''
+Test cases for harmony.remote.discovery.
+'''
+
+import unittest
+
+from harmony.persistence import db, schema
+from harmony.remote import discovery
+from harmony.remote.dav import CalDAVClient
+
+
+def multistatus(href, prop, value):
+    return ('<d:multistatus xmlns:d="DAV:" '
+            'xmlns:c="urn:ietf:params:xml:ns:caldav">'
+            '<d:response><d:href>{}</d:href><d:propstat><d:prop>'
+            '<{}><d:href>{}</d:href></{}>'
+            '</d:prop></d:propstat></d:response>'
+            '</d:multistatus>').format(href, prop, value, prop)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content='', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+
+class FakeServer(CalDAVClient):
+    '''A client for a server that supports discovery, and counts
+    requests.'''
+
+    def __init__(self):
+        CalDAVClient.__init__(self, 'https://dav.example.com/')
+        self.home = '/calendars/eryn/'
+        self.requests = []
+
+    def _send(self, method, url, headers=None, data=None, **kwargs):
+        path = url[len('https://dav.example.com'):]
+        self.requests.append((method, path))
+        if method == 'PROPFIND' and path == '/.well-known/caldav':
+            return FakeResponse(301, headers={'location': '/dav/'})
+        if method == 'PROPFIND' and path == '/dav/':
+            return FakeResponse(207, multistatus(
+                    '/dav/', 'd:current-user-principal', '/principals/eryn/'))
+        if method == 'PROPFIND' and path == '/principals/eryn/':
+            return FakeResponse(207, multistatus(
+                    path, 'c:calendar-home-set', self.home))
+        if method == 'OPTIONS' and path == self.home:
+            return FakeResponse(200, headers={
+                    'allow': 'OPTIONS, GET, PROPFIND, REPORT',
+                    'dav': '1, 2, calendar-access'})
+        return FakeResponse(404)
+
+
+class DiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.client = FakeServer()
+
+    def tearDown(self):
+        db.db.close()
+
+    def test_href_parser(self):
+        data = multistatus('/p/', 'C:calendar-home-set', '/home/')
+        self.assertEqual(discovery.HrefParser.parse(data, 'calendar-home-set'),
+                         u'/home/')
+        self.assertIsNone(discovery.HrefParser.parse(data, 'displayname'))
+
+    def test_discover(self):
+        service = discovery.discover(self.client, now=1000)
+        self.assertEqual(service.principal, u'/principals/eryn/')
+        self.assertEqual(service.home, u'/calendars/eryn/')
+        self.assertTrue(service.supports('calendar-access'))
+        self.assertIn('REPORT', service.options['allow'])
+        self.assertEqual([r[0] for r in self.client.requests],
+                         ['PROPFIND', 'PROPFIND', 'PROPFIND', 'OPTIONS'])
+
+    def test_cached(self):
+        discovery.discover(self.client, now=1000)
+        del self.client.requests[:]
+        service = discovery.discover(self.client, ttl=60, now=1059)
+        self.assertEqual(service.home, u'/calendars/eryn/')
+        self.assertEqual(self.client.requests, [])
+
+    def test_revalidate(self):
+        discovery.discover(self.client, now=1000)
+        del self.client.requests[:]
+        service = discovery.discover(self.client, ttl=60, now=1060)
+        self.assertEqual(self.client.requests,
+                         [('OPTIONS', '/calendars/eryn/')])
+        self.assertEqual(discovery.cached(self.client).checked, 1060)
+
+        # The home set moves: revalidation fails, and discovery starts over.
+        self.client.home = '/calendars/eryn-2/'
+        del self.client.requests[:]
+        service = discovery.discover(self.client, ttl=60, now=1200)
+        self.assertEqual(service.home, u'/calendars/eryn-2/')
+        self.assertEqual(len(self.client.requests), 5)
+        self.assertEqual(len(list(discovery.CalDAVService.select())), 1)
+
+    def test_no_discovery(self):
+        client = CalDAVClient('https://plain.example.com/cal/')
+        client._send = lambda method, url, **kwargs: FakeResponse(
+                404 if method == 'PROPFIND' else 200)
+        service = discovery.discover(client)
+        self.assertIsNone(service.principal)
+        self.assertEqual(service.home, u'https://plain.example.com/cal/')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+'''
+Test cases for harmony.remote.imap.
+'''
+
+import threading
+import unittest
+
+from harmony.remote import imap
+from test.remote.imapserver import FakeIMAPServer, Part, message
+
+
+INVITE = '''BEGIN:VCALENDAR
+VERSION:2.0
+METHOD:REQUEST
+BEGIN:VEVENT
+UID:standup@example.com
+SUMMARY:Standup
+DTSTART:20130301T090000Z
+DTEND:20130301T091500Z
+END:VEVENT
+END:VCALENDAR
+'''
+
+
+class ParseTest(unittest.TestCase):
+    def test_nested(self):
+        values = imap.parse(['1 (UID 5 FLAGS (\\Seen) X NIL Y "a \\"b\\"")'])
+        self.assertEqual(values, ['1', ['UID', '5', 'FLAGS', ['\\Seen'],
+                                        'X', None, 'Y', 'a "b"']])
+
+    def test_literals(self):
+        data = [('1 (UID 5 BODY[2] {5}', 'NIL()'), ')',
+                ('2 (UID 7 BODY[2] {3}', 'abc'), ')']
+        messages = imap.parse_fetch(data)
+        self.assertEqual(messages[5]['BODY[2]'], 'NIL()')
+        self.assertEqual(messages[7]['BODY[2]'], 'abc')
+
+    def test_calendar_parts(self):
+        structure = imap.parse(['(("TEXT" "PLAIN" NIL NIL NIL "7BIT" 1 1)'
+                                '(("TEXT" "HTML" NIL NIL NIL "7BIT" 1 1)'
+                                '("TEXT" "CALENDAR" ("METHOD" "REQUEST") NIL'
+                                ' NIL "BASE64" 1 1) "ALTERNATIVE") "MIXED")'])[0]
+        self.assertEqual(list(imap.calendar_parts(structure)),
+                         [('2.2', 'base64')])
+        single = imap.parse(['("text" "calendar" NIL NIL NIL "8bit" 1 1)'])[0]
+        self.assertEqual(list(imap.calendar_parts(single)), [('1', '8bit')])
+
+
+class MailboxTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeIMAPServer().start()
+        self.conn = imap.connect('127.0.0.1', 'eryn', 'secret',
+                                 port=self.server.port, ssl=False)
+        self.mailbox = imap.Mailbox(self.conn)
+
+    def tearDown(self):
+        self.conn.shutdown()
+        self.server.stop()
+
+    def test_new_uids(self):
+        for _ in range(3):
+            self.server.add(message(Part('text', 'plain', 'hi')))
+        self.assertEqual(self.mailbox.select(), 1)
+        self.assertEqual(self.mailbox.new_uids(0), [1, 2, 3])
+        self.assertEqual(self.mailbox.new_uids(2), [3])
+        self.assertEqual(self.mailbox.new_uids(3), [])
+
+    def test_calendar_parts_batched(self):
+        for i in range(5):
+            self.server.add(message(Part('text', 'plain', 'Meet?'),
+                                    Part('text', 'calendar', INVITE,
+                                         encoding='base64')))
+        self.server.add(message(Part('text', 'plain', 'No invite here')))
+        self.server.add(message(Part('text', 'calendar', INVITE)))
+        self.mailbox.select()
+        old_batch_size = imap.BATCH_SIZE
+        imap.BATCH_SIZE = 4
+        try:
+            parts = self.mailbox.calendar_parts(range(1, 8))
+        finally:
+            imap.BATCH_SIZE = old_batch_size
+        self.assertEqual([uid for uid, _ in parts], [1, 2, 3, 4, 5, 7])
+        self.assertTrue(all(data == INVITE for _, data in parts))
+        fetches = self.server.commands('UID FETCH')
+        self.assertEqual(fetches, ['UID FETCH 1,2,3,4 (BODYSTRUCTURE)',
+                                   'UID FETCH 5,6,7 (BODYSTRUCTURE)',
+                                   'UID FETCH 7 (BODY.PEEK[1])',
+                                   'UID FETCH 1,2,3,4 (BODY.PEEK[2])',
+                                   'UID FETCH 5 (BODY.PEEK[2])'])
+
+    def test_idle(self):
+        self.mailbox.select()
+        self.assertFalse(self.mailbox.idle(timeout=0.1))
+        arrival = threading.Timer(0.1, self.server.add,
+                                  [message(Part('text', 'plain', 'hi'))])
+        arrival.start()
+        self.assertTrue(self.mailbox.idle(timeout=5))
+        arrival.join()
+        self.assertEqual(self.server.commands('DONE'), ['DONE', 'DONE'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+'''
+Test cases for harmony.remote.pool.
+'''
+
+import threading
+import unittest
+import harmony.remote.pool as pool
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = pool.WorkerPool(max_workers=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_map(self):
+        self.assertEqual(self.pool.map(lambda x: x * 2, range(10)),
+                         [x * 2 for x in range(10)])
+
+    def test_exception(self):
+        def boom():
+            raise KeyError('boom')
+        future = self.pool.submit(boom)
+        self.assertRaises(KeyError, future.result, 5)
+        self.assertTrue(isinstance(future.exception(), KeyError))
+
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        state = {'active': 0, 'peak': 0}
+        gate = threading.Event()
+
+        def work():
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            gate.wait(1)
+            with lock:
+                state['active'] -= 1
+
+        futures = [self.pool.submit(work) for _ in range(6)]
+        gate.set()
+        pool.gather(futures)
+        self.assertTrue(state['peak'] <= 2)
+
+    def test_done_callback(self):
+        seen = []
+        future = self.pool.submit(lambda: 42)
+        future.result(5)
+        future.add_done_callback(lambda f: seen.append(f.result()))
+        self.assertEqual(seen, [42])
@@ -0,0 +1,154 @@
+'''
+Test cases for harmony.remote.scheduler.
+'''
+
+import threading
+import unittest
+
+from harmony.remote import scheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(scheduler.retry_after('120'), 120)
+
+    def test_date(self):
+        # Sun, 06 Nov 1994 08:49:37 GMT
+        self.assertEqual(scheduler.retry_after('Sun, 06 Nov 1994 08:49:37 GMT',
+                                               now=784111717),
+                         60)
+        self.assertEqual(scheduler.retry_after('Sun, 06 Nov 1994 08:49:37 GMT',
+                                               now=784111787),
+                         0)
+
+    def test_garbage(self):
+        self.assertIsNone(scheduler.retry_after('soon'))
+        self.assertIsNone(scheduler.retry_after(None))
+
+
+class HostLimitTest(unittest.TestCase):
+    def test_additive_increase(self):
+        limit = scheduler.HostLimit(initial=2, maximum=4)
+        for _ in range(2):
+            limit.release(limit.acquire(), 200)
+        # Two successes at a limit of two: about one more slot.
+        self.assertAlmostEqual(limit.limit, 2 + 1 / 2.0 + 1 / 2.5)
+        for _ in range(50):
+            limit.release(limit.acquire(), 200)
+        self.assertEqual(limit.limit, 4)
+
+    def test_one_decrease_per_window(self):
+        limit = scheduler.HostLimit(initial=8)
+        epochs = [limit.acquire() for _ in range(8)]
+        for epoch in epochs:
+            limit.release(epoch, 429)
+        self.assertEqual(limit.limit, 4)
+        limit.release(limit.acquire(), 503)
+        self.assertEqual(limit.limit, 2)
+        for _ in range(5):
+            limit.release(limit.acquire(), 503)
+        self.assertEqual(limit.limit, 1)
+
+    def test_errors_leave_limit_alone(self):
+        limit = scheduler.HostLimit(initial=3)
+        limit.release(limit.acquire(), 500)
+        limit.release(limit.acquire(), None)
+        self.assertEqual(limit.limit, 3)
+
+    def test_blocks_at_limit(self):
+        limit = scheduler.HostLimit(initial=1)
+        epoch = limit.acquire()
+        acquired = threading.Event()
+
+        def second():
+            limit.release(limit.acquire(), 200)
+            acquired.set()
+        thread = threading.Thread(target=second)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limit.release(epoch, 200)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_pause(self):
+        clock = FakeClock()
+        limit = scheduler.HostLimit(clock=clock, sleep=clock.sleep)
+        limit.pause(30)
+        limit.acquire()
+        self.assertEqual(clock.sleeps, [30])
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = scheduler.RequestScheduler(
+                max_retries=3, clock=self.clock, sleep=self.clock.sleep,
+                random=lambda: 0.5)
+
+    def respond(self, *responses):
+        responses = list(responses)
+        calls = []
+
+        def fn():
+            calls.append(self.clock.now)
+            return responses.pop(0)
+        return fn, calls
+
+    def test_success(self):
+        fn, calls = self.respond(FakeResponse(200))
+        r = self.scheduler.send('https://dav.example.com/cal/', fn)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(calls), 1)
+
+    def test_jittered_backoff(self):
+        fn, calls = self.respond(FakeResponse(503), FakeResponse(429),
+                                 FakeResponse(204))
+        r = self.scheduler.send('https://dav.example.com/cal/', fn)
+        self.assertEqual(r.status_code, 204)
+        # Half of 0.5 * 2**0, then half of 0.5 * 2**1
+        self.assertEqual(self.clock.sleeps, [0.25, 0.5])
+        self.assertEqual(len(calls), 3)
+
+    def test_retry_after_pauses_host(self):
+        fn, calls = self.respond(
+                FakeResponse(429, {'retry-after': '7'}), FakeResponse(200))
+        self.scheduler.send('https://dav.example.com/cal/', fn)
+        self.assertEqual(calls[1] - calls[0], 7)
+        # Other hosts don't wait.
+        fn, calls = self.respond(FakeResponse(200))
+        self.scheduler.send('https://other.example.com/', fn)
+        self.assertEqual(self.clock.sleeps, [7])
+
+    def test_gives_up(self):
+        fn, calls = self.respond(*[FakeResponse(503) for _ in range(4)])
+        r = self.scheduler.send('https://dav.example.com/cal/', fn)
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(len(calls), 4)
+
+    def test_limits_per_host(self):
+        a = self.scheduler.host_limit('dav.example.com')
+        self.assertIs(a, self.scheduler.host_limit('dav.example.com'))
+        self.assertIsNot(a, self.scheduler.host_limit('other.example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
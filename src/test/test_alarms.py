@@ -0,0 +1,137 @@
+'''
+Tests for harmony.alarms.
+'''
+
+import datetime
+import threading
+import time
+import unittest
+
+import pytz
+
+from harmony.alarms import Alarm, AlarmScheduler
+from harmony.calendar import Calendar, Event
+from harmony.persistence import db, schema
+from harmony.tz import epoch
+
+
+BASE = datetime.datetime(2013, 3, 1, tzinfo=pytz.utc)
+T0 = epoch(BASE)
+HOUR = 60 * 60
+
+
+class AlarmTestCase(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.cal = Calendar.create(name='Work')
+
+    def tearDown(self):
+        db.db.close()
+
+    def event(self, hours, alarm_offsets=(-600,)):
+        '''An event {hours} after BASE, with alarms at {alarm_offsets}
+        seconds from its start.'''
+        start = BASE + datetime.timedelta(hours=hours)
+        event = Event.create(summary=u'At {}'.format(hours), calendar=self.cal,
+                             start=start,
+                             end=start + datetime.timedelta(hours=1))
+        for offset in alarm_offsets:
+            alarm = Alarm(event=event, offset=offset)
+            alarm.schedule(event)
+            alarm.save()
+        return event
+
+
+class AlarmTest(AlarmTestCase):
+    def test_follows_event(self):
+        event = self.event(2)
+        alarm, = Alarm.for_event(event)
+        self.assertEqual(alarm.due, BASE + datetime.timedelta(hours=1,
+                                                              minutes=50))
+        event.start = BASE + datetime.timedelta(hours=5)
+        event.save()
+        alarm, = Alarm.for_event(event)
+        self.assertEqual(alarm.due, BASE + datetime.timedelta(hours=4,
+                                                              minutes=50))
+        event_id = event.id
+        event.delete()
+        self.assertEqual(Alarm.for_event(event_id), [])
+
+
+class AlarmSchedulerTest(AlarmTestCase):
+    def setUp(self):
+        super(AlarmSchedulerTest, self).setUp()
+        self.fired = []
+        self.scheduler = AlarmScheduler(self.fired.append, window=6 * HOUR)
+        Alarm._meta.listeners.append(self.scheduler.alarm_changed)
+
+    def tearDown(self):
+        Alarm._meta.listeners.remove(self.scheduler.alarm_changed)
+        super(AlarmSchedulerTest, self).tearDown()
+
+    def test_window(self):
+        for hours in (1, 2, 5, 8, 30):
+            self.event(hours)
+        self.scheduler.load(T0)
+        # Only the alarms due in the first six hours are loaded.
+        self.assertEqual(len(self.scheduler), 3)
+        self.assertEqual(self.scheduler.next_wakeup(), T0 + 50 * 60)
+        self.assertEqual(self.scheduler.run_pending(T0 + 50 * 60 - 1), [])
+        self.scheduler.run_pending(T0 + 2 * HOUR)
+        self.assertEqual([a.due.hour for a in self.fired], [0, 1])
+        self.scheduler.run_pending(T0 + 6 * HOUR)
+        self.assertEqual(len(self.fired), 3)
+        # Past the window: the next one is loaded.
+        self.assertEqual(len(self.scheduler), 1)
+        self.scheduler.run_pending(T0 + 12 * HOUR)
+        self.assertEqual(len(self.fired), 4)
+        # Nothing for the next day; skip ahead rather than wake every window.
+        self.assertEqual(self.scheduler.next_wakeup(), T0 + 29 * HOUR + 50 * 60)
+        self.scheduler.run_pending(T0 + 30 * HOUR)
+        self.assertEqual(len(self.fired), 5)
+        # With none left, wait for one to be added.
+        self.scheduler.run_pending(self.scheduler.next_wakeup())
+        self.assertEqual(self.scheduler.next_wakeup(), float('inf'))
+
+    def test_changes(self):
+        late = self.event(5)
+        self.scheduler.load(T0)
+        early = self.event(1)
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.next_wakeup(), T0 + 50 * 60)
+        # Alarms outside the window wait for it.
+        self.event(10)
+        self.assertEqual(len(self.scheduler), 2)
+        early.delete()
+        late.start = BASE + datetime.timedelta(hours=3)
+        late.save()
+        self.assertEqual(self.scheduler.next_wakeup(), T0 + 2 * HOUR + 50 * 60)
+        self.scheduler.run_pending(T0 + 6 * HOUR)
+        self.assertEqual([a.event for a in self.fired], [late.id])
+
+    def test_past_alarms_dont_fire(self):
+        self.event(1)
+        self.scheduler.load(T0 + HOUR)
+        self.assertEqual(self.scheduler.run_pending(T0 + 2 * HOUR), [])
+
+
+class AlarmSchedulerThreadTest(AlarmTestCase):
+    def test_fires(self):
+        fired = threading.Event()
+        scheduler = AlarmScheduler(lambda alarm: fired.set())
+        scheduler.start()
+        try:
+            # Added after the scheduler went to sleep with nothing to wait
+            # for, which wakes it up.
+            soon = datetime.datetime.utcfromtimestamp(int(time.time()) + 1)
+            alarm = Alarm(event=self.event(1), at=soon.replace(tzinfo=pytz.utc))
+            alarm.schedule(None)
+            alarm.save()
+            self.assertTrue(fired.wait(5))
+        finally:
+            scheduler.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
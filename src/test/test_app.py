@@ -0,0 +1,193 @@
+'''
+Tests for harmony.app.
+'''
+
+import datetime
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pytz
+
+import harmony.app as app
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=pytz.utc)
+
+
+class AgendaTest(unittest.TestCase):
+    def setUp(self):
+        self.app = app.Application(dbpath=':memory:')
+        self.app.create_calendar('Work')
+        self.cal = self.app.find_calendar('Work')
+
+    def tearDown(self):
+        self.app.close_store()
+
+    def test_conflicts(self):
+        first, conflicts = self.app.create_event('Standup', self.cal.id,
+                                                 utc(2013, 3, 1, 9),
+                                                 utc(2013, 3, 1, 10))
+        self.assertEqual(conflicts, [])
+        second, conflicts = self.app.create_event('Review', self.cal.id,
+                                                  utc(2013, 3, 1, 9, 30),
+                                                  utc(2013, 3, 1, 11))
+        self.assertEqual([e.id for e in conflicts], [first.id])
+        _, conflicts = self.app.create_event('Lunch', self.cal.id,
+                                             utc(2013, 3, 1, 11),
+                                             utc(2013, 3, 1, 12))
+        self.assertEqual(conflicts, [])
+
+    def test_tree_follows_changes(self):
+        event, _ = self.app.create_event('Standup', self.cal.id,
+                                         utc(2013, 3, 1, 9), utc(2013, 3, 1, 10))
+        day = (utc(2013, 3, 1), utc(2013, 3, 2))
+        self.assertEqual(len(self.app.events_between(self.cal.id, *day)), 1)
+        event.start = utc(2013, 3, 2, 9)
+        event.end = utc(2013, 3, 2, 10)
+        event.save()
+        self.assertEqual(self.app.events_between(self.cal.id, *day), [])
+        self.app.delete_event(event)
+        self.assertEqual(len(self.app.agenda(self.cal.id)), 0)
+
+
+class LazyLoadingTest(unittest.TestCase):
+    def setUp(self):
+        self.app = app.Application(dbpath=':memory:', event_cache_size=5)
+
+    def tearDown(self):
+        self.app.close_store()
+
+    def test_store_opened_on_demand(self):
+        self.assertFalse(self.app._store_open)
+        self.assertFalse(self.app.calendars.loaded)
+        self.assertEqual(len(self.app.calendars), 0)
+        self.assertTrue(self.app._store_open)
+
+    def test_paging(self):
+        self.app.create_calendar('Work')
+        cal = self.app.find_calendar('Work')
+        for hour in range(12):
+            self.app.create_event('Event {}'.format(hour), cal.id,
+                                  utc(2013, 3, 1, hour), utc(2013, 3, 1, hour, 30))
+        first = self.app.events(cal.id, limit=5)
+        self.assertEqual([e.summary for e in first],
+                         ['Event {}'.format(h) for h in range(5)])
+        second = self.app.events(cal.id, after=utc(2013, 3, 1, 5), limit=5)
+        self.assertEqual(second[0].summary, 'Event 5')
+        self.assertEqual(len(self.app._events), 5)
+
+
+class DefaultCalendarTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'calendars.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_loaded_from_store(self):
+        application = app.Application(dbpath=self.path)
+        application.create_calendar('Home')
+        application.create_calendar('Work', default=True)
+        application.close_store()
+        # As a new process would see it.
+        application = app.Application(dbpath=self.path)
+        try:
+            self.assertFalse(application.calendars.loaded)
+            self.assertEqual(application.default_calendar.name, u'Work')
+        finally:
+            application.close_store()
+
+    def test_none_set(self):
+        application = app.Application(dbpath=self.path)
+        try:
+            application.create_calendar('Home')
+            self.assertIsNone(application.default_calendar)
+        finally:
+            application.close_store()
+
+
+class RefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'calendars.db')
+        self.app = app.Application(dbpath=self.path)
+        self.app.create_calendar('Work')
+        self.cal = self.app.find_calendar('Work')
+        self.event, _ = self.app.create_event('Standup', self.cal.id,
+                                              utc(2013, 3, 1, 9),
+                                              utc(2013, 3, 1, 10))
+        self.day = (utc(2013, 3, 1), utc(2013, 3, 2))
+        self.assertEqual(len(self.app.events_between(self.cal.id, *self.day)),
+                         1)
+        # Another process, writing to the store behind the app's back.
+        self.other = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.other.close()
+        self.app.close_store()
+        shutil.rmtree(self.directory)
+
+    def write(self, sql, values, action, columns=''):
+        with self.other:
+            self.other.execute(sql, values)
+            self.other.execute(
+                    'INSERT INTO change (model, row, action, columns, time) '
+                    "VALUES ('event', ?, ?, ?, '2013-03-01 00:00:00')",
+                    (self.event.id, action, columns))
+
+    def test_nothing_changed(self):
+        self.assertFalse(self.app.refresh())
+
+    def test_update(self):
+        self.write('UPDATE event SET summary = ?, start = ?, "end" = ? '
+                   'WHERE id = ?', ('Retro', '2013-03-02 09:00:00',
+                                    '2013-03-02 10:00:00', self.event.id),
+                   'update', 'end start summary')
+        self.assertTrue(self.app.refresh())
+        self.assertEqual(self.app.get_event(self.event.id).summary, u'Retro')
+        self.assertEqual(self.app.events_between(self.cal.id, *self.day), [])
+
+    def test_delete(self):
+        self.write('DELETE FROM event WHERE id = ?', (self.event.id,),
+                   'delete')
+        self.assertTrue(self.app.refresh())
+        self.assertIsNone(self.app.get_event(self.event.id))
+        self.assertEqual(len(self.app.agenda(self.cal.id)), 0)
+
+
+class ListenerTest(unittest.TestCase):
+    def test_removed_on_close(self):
+        from harmony.calendar import Calendar, Event
+        before = (len(Calendar._meta.listeners), len(Event._meta.listeners))
+        for _ in range(3):
+            application = app.Application(dbpath=':memory:')
+            application.open_store()
+            application.open_store()
+            application.close_store()
+        self.assertEqual((len(Calendar._meta.listeners),
+                          len(Event._meta.listeners)), before)
+
+    def test_model_listeners_on_open(self):
+        # The alarms module keeps alarms in step with events, so it has to be
+        # loaded once the store is open, even when there's nothing to migrate.
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'calendars.db')
+            application = app.Application(dbpath=path)
+            application.open_store()
+            application.close_store()
+            src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            out = subprocess.check_output([sys.executable, '-c',
+                'import sys; from harmony import app; '
+                'app.Application(dbpath=sys.argv[1]).open_store(); '
+                'print("harmony.alarms" in sys.modules)', path], cwd=src)
+            self.assertEqual(out.strip(), 'True')
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,129 @@
+'''
+Tests for harmony.blobs.
+'''
+
+import datetime
+import unittest
+import zlib
+
+import pytz
+
+from harmony import blobs
+from harmony.calendar import Calendar, Event
+from harmony.persistence import db, schema
+
+
+def vevent(i):
+    return '\r\n'.join([
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'BEGIN:VEVENT',
+        'UID:event-{:d}@example.com'.format(i),
+        'DTSTAMP:20130226T090000Z', 'SUMMARY:Meeting {:d}'.format(i),
+        'DTSTART;TZID=America/Los_Angeles:20130301T090000',
+        'ORGANIZER;CN=Boss:mailto:boss@example.com',
+        'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT=NEEDS-ACTION;'
+        'RSVP=TRUE;CN=Eryn:mailto:eryn@example.com',
+        'END:VEVENT', 'END:VCALENDAR', ''])
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        codec = blobs.Codec(blobs.DEFAULT_DICTIONARY)
+        for data in (vevent(1), '', 'x' * 100000):
+            self.assertEqual(codec.decompress(codec.compress(data)), data)
+
+    def test_dictionary_helps(self):
+        data = vevent(1)
+        with_dictionary = blobs.Codec(blobs.DEFAULT_DICTIONARY).compress(data)
+        self.assertLess(len(with_dictionary), len(zlib.compress(data, 9)))
+
+    def test_train(self):
+        samples = [vevent(i) for i in range(20)]
+        dictionary = blobs.train(samples)
+        self.assertIn('ORGANIZER;CN=Boss:mailto:boss@example.com', dictionary)
+        self.assertNotIn('Meeting 3', dictionary)
+        self.assertLessEqual(len(blobs.train(samples, size=50)), 50)
+        trained = blobs.Codec(dictionary).compress(vevent(21))
+        default = blobs.Codec(blobs.DEFAULT_DICTIONARY).compress(vevent(21))
+        self.assertLess(len(trained), len(default))
+
+
+class EventDataTest(unittest.TestCase):
+    def setUp(self):
+        blobs._untrained.clear()
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        cal = Calendar.create(name='Work')
+        start = datetime.datetime(2013, 3, 1, 9, tzinfo=pytz.utc)
+        self.events = [Event.create(calendar=cal, start=start, end=start)
+                       for _ in range(3)]
+
+    def tearDown(self):
+        db.db.close()
+
+    def test_store_and_load(self):
+        event = self.events[0]
+        blobs.EventData.store(event, vevent(0)).save()
+        blob = blobs.EventData.load(event)
+        self.assertNotIn('_ical', blob.__dict__)
+        self.assertEqual(blob.size, len(vevent(0)))
+        self.assertLess(len(blob.data), blob.size)
+        self.assertEqual(blob.ical, vevent(0))
+        # Storing again replaces it.
+        blobs.EventData.store(event, vevent(1)).save()
+        self.assertEqual(blobs.event_ical(event), vevent(1))
+        self.assertEqual(len(list(blobs.EventData.select())), 1)
+
+    def test_retrain(self):
+        for i, event in enumerate(self.events[:2]):
+            blobs.EventData.store(event, vevent(i)).save()
+        dictionary = blobs.retrain()
+        self.assertEqual(blobs.Dictionary.latest(), dictionary.id)
+        blobs.EventData.store(self.events[2], vevent(2)).save()
+        # Old blobs still read back, with the dictionary they were made with.
+        self.assertEqual([blobs.event_ical(e) for e in self.events],
+                         [vevent(i) for i in range(3)])
+        self.assertEqual(blobs.EventData.load(self.events[2]).dictionary,
+                         dictionary.id)
+
+    def test_retrain_on_newest(self):
+        blobs.EventData.store(self.events[0], vevent(0)).save()
+        for event in self.events[1:]:
+            data = vevent(1).replace('Boss', 'Chief')
+            blobs.EventData.store(event, data).save()
+        dictionary = blobs.retrain(sample_size=2)
+        self.assertIn('Chief', dictionary.data)
+        self.assertNotIn('Boss', dictionary.data)
+        # Nothing new to learn from, so no new dictionary.
+        self.assertIsNone(blobs.retrain(sample_size=2))
+        self.assertEqual(blobs.Dictionary.latest(), dictionary.id)
+
+    def test_retrain_if_due(self):
+        for i, event in enumerate(self.events[:2]):
+            blobs.EventData.store(event, vevent(i)).save()
+        self.assertIsNone(blobs.retrain_if_due(every=3))
+        blobs.EventData.store(self.events[2], vevent(2)).save()
+        dictionary = blobs.retrain_if_due(every=3)
+        self.assertEqual(blobs.Dictionary.latest(), dictionary.id)
+        # The count starts over with the new dictionary.
+        self.assertIsNone(blobs.retrain_if_due(every=3))
+        # Training that comes to nothing waits for as many blobs again.
+        for event in self.events:
+            blobs.EventData.store(event, vevent(0)).save()
+        calls = []
+        retrain = blobs.retrain
+        blobs.retrain = lambda: calls.append(1)
+        try:
+            self.assertIsNone(blobs.retrain_if_due(every=3))
+            self.assertIsNone(blobs.retrain_if_due(every=3))
+        finally:
+            blobs.retrain = retrain
+        self.assertEqual(len(calls), 1)
+
+    def test_deleted_with_event(self):
+        blobs.EventData.store(self.events[0], vevent(0)).save()
+        self.events[0].delete()
+        self.assertEqual(list(blobs.EventData.select()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
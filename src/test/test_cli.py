@@ -0,0 +1,138 @@
+'''
+Tests for harmony.cli.
+'''
+
+import datetime
+import os
+import subprocess
+import sys
+import unittest
+from StringIO import StringIO
+
+import pytz
+
+from harmony import app, cli
+
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StartupImportTest(unittest.TestCase):
+
+    def test_cli_defers_heavy_imports(self):
+        # Starting the shell shouldn't pay for modules that only some commands
+        # use.
+        out = subprocess.check_output([sys.executable, '-c',
+            'import sys, harmony.cli; '
+            'print(" ".join(m for m in sys.modules if sys.modules[m]))'],
+            cwd=SRC)
+        loaded = set(out.decode('utf-8').split())
+        for module in ('pytz', 'pkg_resources', 'icalendar', 'requests',
+                       'urlobject', 'sqlite3', 'argparse', 'SocketServer',
+                       'harmony.alarms', 'harmony.sync'):
+            self.assertNotIn(module, loaded)
+
+
+class ExecuteTest(unittest.TestCase):
+    def setUp(self):
+        self.out = StringIO()
+        self.shell = cli.HarmonyCmd(stdout=self.out)
+
+    def test_syntax_error(self):
+        self.assertEqual(self.shell.execute('FROBNICATE'), 1)
+        self.assertIn('Error:', self.out.getvalue())
+
+    def test_unknown_timezone(self):
+        status = self.shell.execute('CREATE CALENDAR Foo IN TIMEZONE Nowhere')
+        self.assertEqual(status, 1)
+        self.assertIn('Error: Unknown timezone: Nowhere', self.out.getvalue())
+
+    def test_status_resets(self):
+        self.shell.execute('FROBNICATE')
+        self.assertEqual(self.shell.execute('QUIT'), 0)
+
+
+class ListTest(unittest.TestCase):
+    def setUp(self):
+        self.old_app = app.app
+        app.app = app.Application(dbpath=':memory:')
+        self.out = StringIO()
+        self.shell = cli.HarmonyCmd(stdout=self.out)
+
+    def tearDown(self):
+        app.app.close_store()
+        app.app = self.old_app
+
+    def test_store_error(self):
+        self.assertEqual(self.shell.execute('CREATE CALENDAR Work'), 0)
+        self.assertEqual(self.shell.execute('CREATE CALENDAR Work'), 1)
+        self.assertIn('Error:', self.out.getvalue())
+
+    def test_list_calendars(self):
+        app.app.create_calendar('Work', 'UTC')
+        self.assertEqual(self.shell.execute('LIST CALENDARS'), 0)
+        self.assertEqual(self.out.getvalue(), '[1] (UTC) Work\n')
+
+    def test_list_events(self):
+        app.app.create_calendar('Work', 'UTC')
+        cal = app.app.find_calendar('Work')
+        for day in (3, 1, 2):
+            app.app.create_event('Day {:d}'.format(day), cal.id,
+                                 datetime.datetime(2013, 3, day, 9,
+                                                   tzinfo=pytz.utc),
+                                 datetime.datetime(2013, 3, day, 10,
+                                                   tzinfo=pytz.utc))
+        self.assertEqual(self.shell.execute('LIST EVENTS'), 0)
+        self.assertEqual(self.out.getvalue().splitlines(), [
+            '[2] 2013-03-01 09:00 - 2013-03-01 10:00 UTC  Work  Day 1',
+            '[3] 2013-03-02 09:00 - 2013-03-02 10:00 UTC  Work  Day 2',
+            '[1] 2013-03-03 09:00 - 2013-03-03 10:00 UTC  Work  Day 3'])
+
+
+class CompletionTest(unittest.TestCase):
+    def setUp(self):
+        self.old_app = app.app
+        app.app = app.Application(dbpath=':memory:')
+        app.app.create_calendar('Work')
+        app.app.create_calendar('Work trips')
+        app.app.create_calendar('Home')
+        self.shell = cli.HarmonyCmd(stdout=StringIO())
+
+    def tearDown(self):
+        app.app.close_store()
+        app.app = self.old_app
+
+    def complete(self, line, text=None):
+        if text is None:
+            text = line.split(' ')[-1]
+        return self.shell.completions(text, line, len(line) - len(text),
+                                      len(line))
+
+    def test_statements(self):
+        self.assertEqual(self.complete('cr'), ['create'])
+        self.assertEqual(self.complete('F'), ['FREEBUSY'])
+
+    def test_keywords(self):
+        self.assertEqual(self.complete('CREATE EV'), ['EVENT'])
+        self.assertEqual(self.complete('LIST cal'), ['calendars'])
+        self.assertEqual(self.complete('CREATE EVENT x FROM 9:00 UN'), ['UNTIL'])
+
+    def test_settings(self):
+        self.assertEqual(self.complete('SET tim'), ['timezone'])
+
+    def test_calendars(self):
+        line = 'CREATE EVENT Standup IN CALENDAR W'
+        self.assertEqual(self.complete(line), ['Work', '"Work trips"'])
+        self.assertEqual(self.complete('FREEBUSY FOR Work H'), ['Home'])
+        self.assertEqual(self.complete('FREEBUSY FOR Home F'), ['FROM'])
+
+    def test_quoted(self):
+        # readline hands over only what's after the space.
+        line = 'CREATE EVENT x IN CALENDAR "Work t'
+        self.assertEqual(self.complete(line, 't'), ['trips'])
+
+    def test_summaries(self):
+        cal = app.app.find_calendar('Work')
+        start = datetime.datetime(2013, 3, 1, 9, tzinfo=pytz.utc)
+        app.app.create_event('Standup', cal.id, start, start)
+        self.assertEqual(self.complete('CREATE EVENT St'), ['Standup'])
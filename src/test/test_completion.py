@@ -0,0 +1,74 @@
+'''
+Tests for harmony.completion.
+'''
+
+import datetime
+import unittest
+
+import pytz
+
+import harmony.app as app
+from harmony.calendar import Event
+from harmony.completion import CompletionIndex
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=pytz.utc)
+
+
+class CompletionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.app = app.Application(dbpath=':memory:')
+        self.app.create_calendar('Work')
+        self.app.create_calendar('Home')
+        self.cal = self.app.find_calendar('Work')
+
+    def tearDown(self):
+        self.app.close_store()
+
+    def create_event(self, summary):
+        event, _ = self.app.create_event(summary, self.cal.id,
+                                         utc(2013, 3, 1, 9), utc(2013, 3, 1, 10))
+        return event
+
+    def test_load(self):
+        for summary in ('Standup', 'Sprint review', 'Lunch'):
+            self.create_event(summary)
+        index = CompletionIndex.load(recent_events=2)
+        self.assertEqual(index.complete('calendar', u'w'), [u'Work'])
+        # Only the newest two events count.
+        self.assertEqual(index.complete('summary', u's'), [u'Sprint review'])
+        self.assertEqual(index.complete('setting', u'time'), [u'timezone'])
+        self.assertEqual(index.complete('statement', u'F'), [u'FREEBUSY'])
+
+    def test_follows_changes(self):
+        index = self.app.completion_index()
+        self.app.create_calendar('Weekend')
+        self.assertEqual(index.complete('calendar', u'w'),
+                         [u'Weekend', u'Work'])
+        self.cal.name = u'Office'
+        self.cal.save()
+        self.assertEqual(index.complete('calendar', u'w'), [u'Weekend'])
+        self.assertEqual(index.complete('calendar', u'o'), [u'Office'])
+        event = self.create_event('Standup')
+        self.assertEqual(index.complete('summary', u'st'), [u'Standup'])
+        event.summary = u'Stand-up'
+        event.save()
+        self.assertEqual(index.complete('summary', u'st'), [u'Stand-up'])
+        self.app.delete_event(event)
+        self.assertEqual(index.complete('summary', u'st'), [])
+
+    def test_recent_events(self):
+        index = CompletionIndex(recent_events=3)
+        for i, summary in enumerate(['Standup', 'Standup', 'Lunch', 'Review']):
+            index.event_changed('save', Event(id=i + 1, summary=summary))
+        # The first standup has dropped out, but the second keeps it there.
+        self.assertEqual(index.complete('summary', u''),
+                         [u'Lunch', u'Review', u'Standup'])
+        index.event_changed('save', Event(id=5, summary=u'Retro'))
+        self.assertEqual(index.complete('summary', u''),
+                         [u'Lunch', u'Retro', u'Review'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+'''
+Tests for harmony.config.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import harmony.config as config
+import harmony.settings as settings
+
+
+class UnfoldTest(unittest.TestCase):
+    def test_folding(self):
+        lines = ['# A comment\n',
+                 'SET realname =\n',
+                 '    "Eryn Wells"\n',
+                 '\n',
+                 'SET color = no\n']
+        self.assertEqual(list(config.unfold(lines)),
+                         [(2, 'SET realname = "Eryn Wells"'),
+                          (5, 'SET color = no')])
+
+
+class ParseTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = settings.Settings()
+
+    def test_parse(self):
+        values = config.parse(['SET realname = "Eryn Wells"',
+                               'set color = no'], self.settings)
+        self.assertEqual(values, {'realname': u'Eryn Wells', 'color': u'no'})
+
+    def test_errors(self):
+        for line in ('SET nosuchsetting = 1', 'SET color = maybe',
+                     'SET timezone = Mars/Olympus_Mons', 'SET color',
+                     'LIST CALENDARS', 'SET realname = "unterminated'):
+            with self.assertRaises(config.ConfigError) as cm:
+                config.parse(['# first', line], self.settings, 'harmony.conf')
+            self.assertEqual(cm.exception.lineno, 2)
+            self.assertTrue(str(cm.exception).startswith('harmony.conf:2: '))
+
+
+class LoadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'harmony.conf')
+        self.write('SET realname = Eryn\nSET color = no\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text, mtime=None):
+        with open(self.path, 'w') as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_snapshot(self):
+        s = settings.Settings()
+        self.assertFalse(config.load(s, self.path))
+        self.assertEqual(s.realname, u'Eryn')
+        self.assertFalse(s.color)
+        self.assertTrue(os.path.exists(config.snapshot_path(self.path)))
+
+        # A fresh process would read the snapshot instead of parsing.
+        other = settings.Settings()
+        self.assertTrue(config.load(other, self.path))
+        self.assertEqual(other.realname, u'Eryn')
+        self.assertFalse(other.color)
+
+    def test_changed_file(self):
+        s = settings.Settings()
+        config.load(s, self.path)
+        self.write('SET realname = "Someone Else"\n', mtime=1)
+        self.assertFalse(config.load(s, self.path))
+        self.assertEqual(s.realname, u'Someone Else')
+        # Settings that are no longer in the file go back to their defaults.
+        self.assertTrue(s.color)
+
+    def test_error_leaves_settings(self):
+        s = settings.Settings()
+        config.load(s, self.path)
+        self.write('SET color = maybe\n', mtime=1)
+        self.assertRaises(config.ConfigError, config.load, s, self.path)
+        self.assertEqual(s.realname, u'Eryn')
+
+    def test_missing_file(self):
+        s = settings.Settings()
+        self.assertFalse(config.load(s, os.path.join(self.directory, 'nope')))
+        self.assertEqual(s.realname, u'')
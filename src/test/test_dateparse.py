@@ -0,0 +1,73 @@
+'''
+Tests for harmony.dateparse.
+'''
+
+import datetime
+import unittest
+
+import harmony.dateparse as dateparse
+
+
+class ParseTest(unittest.TestCase):
+    def assertMatchesStrptime(self, s, fmt):
+        try:
+            expected = datetime.datetime.strptime(s, fmt)
+        except ValueError:
+            self.assertRaises(ValueError, dateparse.parse, s, fmt)
+        else:
+            self.assertEqual(dateparse.parse(s, fmt), expected)
+
+    def test_fast_formats(self):
+        cases = {
+            '%Y-%m-%d': ('2013-03-01', '2013-3-1', '2013-13-01', '2013/03/01',
+                         '2013-02-30'),
+            '%d/%m/%Y': ('01/03/2013', '31/12/2013', '12/31/2013', '1/3/2013'),
+            '%m/%d/%Y': ('12/31/2013', '31/12/2013'),
+            '%H:%M': ('13:45', '9:05', '24:00', '1345'),
+            dateparse.STORAGE_FORMAT: ('2013-03-01 09:30:00',
+                                       '2013-03-01T09:30:00'),
+            dateparse.ICAL_DATETIME_FORMAT: ('20130301T093000',
+                                             '20130301 093000'),
+        }
+        for fmt, strings in cases.items():
+            for s in strings:
+                self.assertMatchesStrptime(s, fmt)
+
+    def test_stored_round_trip(self):
+        dt = datetime.datetime(1850, 7, 4, 12, 0, 1)
+        s = dateparse.format_stored(dt)
+        self.assertEqual(s, '1850-07-04 12:00:01')
+        self.assertEqual(dateparse.parse_stored(s), dt)
+
+    def test_stored_to_epoch(self):
+        self.assertEqual(dateparse.stored_to_epoch('1970-01-02 00:00:01'),
+                         86401)
+
+
+class ParserTest(unittest.TestCase):
+    fmts = ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y')
+
+    def test_first_match_wins(self):
+        parser = dateparse.Parser(self.fmts, remember=False)
+        parser.parse('12/31/2013')
+        self.assertEqual(parser.parse('01/02/2013'),
+                         datetime.datetime(2013, 2, 1))
+
+    def test_remember(self):
+        parser = dateparse.Parser(self.fmts)
+        parser.parse('12/31/2013')
+        self.assertEqual(parser.last_fmt, '%m/%d/%Y')
+        self.assertEqual(parser.parse('01/02/2013'),
+                         datetime.datetime(2013, 1, 2))
+
+    def test_parse_many(self):
+        parser = dateparse.Parser(self.fmts)
+        self.assertEqual(parser.parse_many(['2013-03-01', '12/31/2013',
+                                            '01/02/2013']),
+                         [datetime.datetime(2013, 3, 1),
+                          datetime.datetime(2013, 12, 31),
+                          datetime.datetime(2013, 1, 2)])
+
+    def test_invalid(self):
+        parser = dateparse.Parser(self.fmts)
+        self.assertRaises(ValueError, parser.parse, 'tomorrow')
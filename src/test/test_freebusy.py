@@ -0,0 +1,61 @@
+'''
+Tests for harmony.freebusy.
+'''
+
+import datetime
+import unittest
+
+import pytz
+
+import harmony.freebusy as freebusy
+import harmony.persistence.db as db
+import harmony.persistence.schema as schema
+from harmony.calendar import Calendar, Event
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=pytz.utc)
+
+
+class MergeIntervalsTest(unittest.TestCase):
+    def test_merge(self):
+        self.assertEqual(freebusy.merge_intervals([(5, 7), (1, 3), (2, 4),
+                                                   (4, 5), (9, 10), (9, 9)]),
+                         [(1, 7), (9, 10)])
+
+    def test_empty(self):
+        self.assertEqual(freebusy.merge_intervals([]), [])
+
+
+class FreeBusyTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.work = Calendar.create(name='Work')
+        self.home = Calendar.create(name='Home')
+        self.other = Calendar.create(name='Other')
+        for cal, start, end in ((self.work, utc(2013, 3, 1, 9), utc(2013, 3, 1, 10)),
+                                (self.home, utc(2013, 3, 1, 9, 30), utc(2013, 3, 1, 11)),
+                                (self.work, utc(2013, 3, 1, 14), utc(2013, 3, 1, 15)),
+                                (self.work, utc(2013, 2, 28, 23), utc(2013, 3, 1, 1)),
+                                (self.other, utc(2013, 3, 1, 12), utc(2013, 3, 1, 13))):
+            Event.create(calendar=cal, start=start, end=end)
+
+    def tearDown(self):
+        db.db.close()
+
+    def test_freebusy(self):
+        fb = freebusy.freebusy([self.work, self.home], utc(2013, 3, 1),
+                               utc(2013, 3, 2))
+        self.assertEqual(fb.busy, [(utc(2013, 3, 1, 0), utc(2013, 3, 1, 1)),
+                                   (utc(2013, 3, 1, 9), utc(2013, 3, 1, 11)),
+                                   (utc(2013, 3, 1, 14), utc(2013, 3, 1, 15))])
+        self.assertEqual(fb.free[0], (utc(2013, 3, 1, 1), utc(2013, 3, 1, 9)))
+        self.assertEqual(fb.free[-1], (utc(2013, 3, 1, 15), utc(2013, 3, 2)))
+
+    def test_to_ical(self):
+        fb = freebusy.freebusy([self.work.id], utc(2013, 3, 1, 8),
+                               utc(2013, 3, 1, 12))
+        ical = fb.to_ical().to_ical()
+        self.assertTrue('BEGIN:VFREEBUSY' in ical)
+        self.assertTrue('20130301T090000Z/20130301T100000Z' in ical)
@@ -0,0 +1,129 @@
+'''
+Tests for harmony.ical.
+'''
+
+import datetime
+import unittest
+
+import pytz
+
+from harmony import blobs, ical
+from harmony.alarms import Alarm
+from harmony.calendar import Calendar, Event
+from harmony.persistence import db, schema
+
+
+def invite(summary, sequence=0, uid='standup@example.com', stamp=9,
+           alarms=(), hour=9):
+    return '\r\n'.join([
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'METHOD:REQUEST', 'BEGIN:VEVENT',
+        'UID:{}'.format(uid),
+        'SEQUENCE:{:d}'.format(sequence),
+        'DTSTAMP:20130226T{:02d}0000Z'.format(stamp),
+        'SUMMARY:{}'.format(summary),
+        'DTSTART:20130301T{:02d}0000Z'.format(hour),
+        'DTEND:20130301T{:02d}1500Z'.format(hour)] +
+        ['BEGIN:VALARM\r\nACTION:DISPLAY\r\n{}\r\nEND:VALARM'.format(trigger)
+         for trigger in alarms] +
+        ['END:VEVENT', 'END:VCALENDAR', ''])
+
+
+class ImportEventsTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.cal = Calendar.create(name='Invites')
+
+    def tearDown(self):
+        db.db.close()
+
+    def save(self, events):
+        for event in events:
+            event.save()
+        return events
+
+    def test_import(self):
+        event, blob = self.save(ical.import_events(invite('Standup'),
+                                                   self.cal))
+        self.assertEqual(event.summary, u'Standup')
+        self.assertEqual(event.calendar, self.cal)
+        self.assertEqual(event.start,
+                         datetime.datetime(2013, 3, 1, 9, tzinfo=pytz.utc))
+        self.assertEqual(len(event.content_hash), 40)
+        # The original is kept, minus the METHOD that made it an invite.
+        stored = blobs.event_ical(event)
+        self.assertIn('UID:standup@example.com', stored)
+        self.assertNotIn('METHOD', stored)
+
+    def test_alarms(self):
+        triggers = ['TRIGGER:-PT10M', 'TRIGGER;RELATED=END:PT5M',
+                    'TRIGGER;VALUE=DATE-TIME:20130228T120000Z']
+        instances = self.save(ical.import_events(
+                invite('Standup', alarms=triggers), self.cal))
+        event = instances[0]
+        alarms = instances[2:]
+        self.assertEqual([a.due for a in alarms], [
+            datetime.datetime(2013, 3, 1, 8, 50, tzinfo=pytz.utc),
+            datetime.datetime(2013, 3, 1, 9, 20, tzinfo=pytz.utc),
+            datetime.datetime(2013, 2, 28, 12, tzinfo=pytz.utc)])
+        self.assertEqual([a.related for a in alarms[:2]], [u'start', u'end'])
+        # A new copy brings its own alarms, and the old ones go.
+        self.save(ical.import_events(
+                invite('Standup', sequence=1, alarms=triggers[:1]), self.cal))
+        self.assertEqual([a.offset for a in Alarm.for_event(event)], [-600])
+
+    def test_unchanged_is_skipped(self):
+        self.save(ical.import_events(invite('Standup'), self.cal))
+        # Sent again: only the DTSTAMP differs.
+        self.assertEqual(ical.import_events(invite('Standup', stamp=10),
+                                            self.cal), [])
+
+    def test_sequence(self):
+        self.save(ical.import_events(invite('Standup', sequence=2), self.cal))
+        # Older copies are ignored, newer ones update the event.
+        self.assertEqual(ical.import_events(invite('Old', sequence=1),
+                                            self.cal), [])
+        events = self.save(ical.import_events(invite('New', sequence=3),
+                                              self.cal))
+        self.assertEqual([e.summary for e in Event.select()], [u'New'])
+        self.assertEqual(events[0].sequence, 3)
+
+    def test_seen(self):
+        seen = {}
+        first = ical.import_events(invite('Standup'), self.cal, seen)
+        second = ical.import_events(invite('Renamed'), self.cal, seen)
+        self.assertIs(first[0], second[0])
+        self.assertEqual(ical.import_events(invite('Renamed'), self.cal, seen),
+                         [])
+
+    def test_seen_alarms(self):
+        # A newer copy later in the same pull replaces the earlier copy's
+        # alarms, whether those have been saved yet or not.
+        for save_first in (False, True):
+            seen = {}
+            first = ical.import_events(
+                    invite('Standup', alarms=['TRIGGER:-PT10M',
+                                              'TRIGGER:-PT5M']),
+                    self.cal, seen)
+            if save_first:
+                self.save(first)
+                first = []
+            second = ical.import_events(
+                    invite('Standup', sequence=1, hour=10,
+                           alarms=['TRIGGER:-PT15M']),
+                    self.cal, seen)
+            event = self.save(first + second)[0]
+            self.assertEqual(
+                    [a.due for a in Alarm.for_event(event)],
+                    [datetime.datetime(2013, 3, 1, 9, 45, tzinfo=pytz.utc)])
+            event.delete()
+
+    def test_other_calendar(self):
+        self.save(ical.import_events(invite('Standup'), self.cal))
+        other = Calendar.create(name='Other')
+        self.save(ical.import_events(invite('Standup'), other))
+        self.assertEqual(len(list(Event.select())), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+Tests for harmony.intervaltree.
+'''
+
+import random
+import unittest
+
+import harmony.intervaltree as intervaltree
+
+
+class IntervalTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(4)
+        self.intervals = {}
+        for key in range(500):
+            start = self.rng.randint(0, 10000)
+            self.intervals[key] = (start, start + self.rng.randint(0, 300))
+        self.tree = intervaltree.IntervalTree(
+                (k, s, e) for k, (s, e) in self.intervals.items())
+
+    def check(self):
+        self.assertEqual(len(self.tree), len(self.intervals))
+        for _ in range(50):
+            a = self.rng.randint(0, 10000)
+            b = a + self.rng.randint(0, 500)
+            found = self.tree.overlapping(a, b)
+            self.assertEqual(sorted(k for k, _, _ in found),
+                             sorted(k for k, (s, e) in self.intervals.items()
+                                    if s < b and e > a))
+            self.assertEqual([s for _, s, _ in found],
+                             sorted(s for _, s, _ in found))
+            self.assertEqual(sorted(k for k, _, _ in self.tree.at(a)),
+                             sorted(k for k, (s, e) in self.intervals.items()
+                                    if s <= a < e))
+
+    def test_build(self):
+        self.check()
+
+    def test_add_and_discard(self):
+        for _ in range(300):
+            key = self.rng.randint(0, 700)
+            if self.rng.random() < 0.5:
+                start = self.rng.randint(0, 10000)
+                end = start + self.rng.randint(0, 300)
+                self.intervals[key] = (start, end)
+                self.tree.add(key, start, end)
+            else:
+                self.intervals.pop(key, None)
+                self.tree.discard(key)
+        self.check()
+
+    def test_half_open(self):
+        tree = intervaltree.IntervalTree([('a', 0, 10)])
+        self.assertEqual(tree.overlapping(10, 20), [])
+        self.assertEqual(tree.overlapping(-5, 0), [])
+        self.assertEqual(tree.at(0), [('a', 0, 10)])
+        self.assertEqual(tree.at(10), [])
@@ -0,0 +1,135 @@
+'''
+Tests for harmony.maildir.
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from harmony import maildir
+
+
+INVITE = '''BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+UID:standup@example.com
+SUMMARY:Standup
+DTSTART:20130301T090000Z
+DTEND:20130301T091500Z
+END:VEVENT
+END:VCALENDAR
+'''
+
+PLAIN = '''From: someone@example.com
+Subject: Hello
+Content-Type: text/plain
+
+Nothing to see here.
+'''
+
+MULTIPART = '''From: someone@example.com
+Subject: Invitation: Standup
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="XX"
+
+--XX
+Content-Type: text/plain
+
+You're invited.
+--XX
+Content-Type: text/calendar; method=REQUEST
+Content-Transfer-Encoding: base64
+
+{}
+--XX--
+'''.format(INVITE.encode('base64'))
+
+
+def make_maildir():
+    path = tempfile.mkdtemp()
+    for sub in ('tmp', 'new', 'cur'):
+        os.mkdir(os.path.join(path, sub))
+    return path
+
+
+def deliver(path, content, name, subdir='new'):
+    tmp = os.path.join(path, 'tmp', name)
+    with open(tmp, 'w') as f:
+        f.write(content)
+    dest = os.path.join(path, subdir, name)
+    os.rename(tmp, dest)
+    return dest
+
+
+class CalendarPartsTest(unittest.TestCase):
+    def setUp(self):
+        self.path = make_maildir()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parts(self):
+        invite = deliver(self.path, MULTIPART, '1.a.host')
+        self.assertEqual(maildir.calendar_parts(invite), [INVITE])
+        plain = deliver(self.path, PLAIN, '2.a.host')
+        self.assertEqual(maildir.calendar_parts(plain), [])
+
+    def test_message_key(self):
+        self.assertEqual(maildir.message_key('/m/cur/123.M4.host:2,S'),
+                         '123.M4.host')
+        self.assertEqual(maildir.message_key('/m/new/123.M4.host'),
+                         '123.M4.host')
+
+
+class MaildirTest(unittest.TestCase):
+    def setUp(self):
+        self.path = make_maildir()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def names(self, paths):
+        return sorted(os.path.basename(p) for p in paths)
+
+    def test_inotify(self):
+        deliver(self.path, PLAIN, '1.a.host')
+        box = maildir.Maildir(self.path)
+        paths, complete = box.changes()
+        try:
+            if box._inotify is None:
+                self.skipTest('inotify is not available')
+            self.assertEqual(self.names(paths), ['1.a.host'])
+            self.assertTrue(complete)
+            deliver(self.path, PLAIN, '2.a.host')
+            os.rename(os.path.join(self.path, 'new', '1.a.host'),
+                      os.path.join(self.path, 'cur', '1.a.host:2,S'))
+            paths, complete = box.changes()
+            self.assertEqual(self.names(paths), ['1.a.host:2,S', '2.a.host'])
+            self.assertFalse(complete)
+            self.assertEqual(box.changes(), ([], False))
+        finally:
+            box.close()
+
+    def test_mtime_scan(self):
+        deliver(self.path, PLAIN, '1.a.host')
+        box = maildir.Maildir(self.path, use_inotify=False)
+        paths, complete = box.changes()
+        self.assertEqual(self.names(paths), ['1.a.host'])
+        self.assertTrue(complete)
+        # Pretend both directories were last changed long ago.
+        past = time.time() - 60
+        for sub in ('new', 'cur'):
+            os.utime(os.path.join(self.path, sub), (past, past))
+        box.changes()
+        self.assertEqual(box.changes(), ([], False))
+        # A delivery changes new/, so new/ is listed again, but not cur/.
+        deliver(self.path, PLAIN, '2.a.host')
+        paths, complete = box.changes()
+        self.assertEqual(self.names(paths), ['1.a.host', '2.a.host'])
+        self.assertFalse(complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+'''
+Tests for harmony.output.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from harmony import output
+
+
+class WriteTableTest(unittest.TestCase):
+    def test_aligns_columns(self):
+        out = StringIO()
+        rows = [(u'1', u'Work', u'a'), (u'10', u'Home', u'bb'),
+                (u'100', u'Gym', u'c')]
+        self.assertEqual(output.write_table(rows, out, align='><<'), 3)
+        self.assertEqual(out.getvalue(), u'  1  Work  a\n'
+                                         u' 10  Home  bb\n'
+                                         u'100  Gym   c\n')
+
+    def test_template(self):
+        out = StringIO()
+        output.write_table([(u'1', u'UTC', u'Work'), (u'22', u'EST', u'Home')],
+                           out, template=u'[{0}] ({1}) {2}', align='><')
+        self.assertEqual(out.getvalue(), u'[ 1] (UTC) Work\n'
+                                         u'[22] (EST) Home\n')
+
+    def test_streams(self):
+        read = []
+
+        def rows():
+            for i in range(1000):
+                read.append(i)
+                yield (unicode(i), u'x')
+
+        class Out(object):
+            def write(self, data):
+                # Only the lookahead window has been read before the first
+                # row is written.
+                self.first = getattr(self, 'first', len(read))
+
+        out = Out()
+        output.write_table(rows(), out, lookahead=10)
+        self.assertEqual(out.first, 10)
+
+    def test_widens_after_lookahead(self):
+        out = StringIO()
+        rows = [(u'a', u'1'), (u'b', u'2'), (u'long', u'3'), (u'c', u'4')]
+        output.write_table(rows, out, lookahead=2)
+        self.assertEqual(out.getvalue().splitlines(),
+                         [u'a  1', u'b  2', u'long  3', u'c     4'])
+
+    def test_empty(self):
+        out = StringIO()
+        self.assertEqual(output.write_table(iter([]), out), 0)
+        self.assertEqual(out.getvalue(), u'')
+
+
+class Terminal(StringIO):
+    def isatty(self):
+        return True
+
+
+class PagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_not_a_terminal(self):
+        out = StringIO()
+        with output.pager(out, command='less') as paged:
+            self.assertIs(paged, out)
+
+    def test_pipes_through_pager(self):
+        path = os.path.join(self.tmp, 'paged')
+        with output.pager(Terminal(), command='cat > ' + path) as paged:
+            paged.write(u'caf\xe9\n')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'caf\xc3\xa9\n')
+
+    def test_reader_quits(self):
+        with output.pager(Terminal(), command='true') as paged:
+            while True:
+                paged.write(u'x' * 4096 + u'\n')
+                paged.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+Tests for harmony.server.
+'''
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from harmony import server
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'harmony.sock')
+        self.statements = []
+        self.server = server.HarmonyServer(self.path, self.execute)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def execute(self, statement, out):
+        self.statements.append(statement)
+        if statement == 'fail':
+            raise ValueError('failed')
+        out.write(u'ran {}\n'.format(statement))
+        return 0
+
+    def test_send(self):
+        status, output = server.send(u'LIST CALENDARS', self.path)
+        self.assertEqual(status, 0)
+        self.assertEqual(output, 'ran LIST CALENDARS\n')
+        self.assertEqual(self.statements, [u'LIST CALENDARS'])
+
+    def test_unicode(self):
+        status, output = server.send(u'LIST \xe9v\xe9nements', self.path)
+        self.assertEqual(output.decode('utf-8'), u'ran LIST \xe9v\xe9nements\n')
+
+    def test_error_keeps_serving(self):
+        status, output = server.send('fail', self.path)
+        self.assertEqual(status, 1)
+        self.assertEqual(output, 'Error: failed\n')
+        status, _ = server.send('again', self.path)
+        self.assertEqual(status, 0)
+
+    def test_already_running(self):
+        with self.assertRaises(server.ServerRunningError):
+            server.HarmonyServer(self.path, self.execute)
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o077, 0)
+
+
+class NoServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'harmony.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_no_socket(self):
+        with self.assertRaises(server.NoServerError):
+            server.send('LIST CALENDARS', self.path)
+
+    def test_stale_socket(self):
+        # A socket left behind by a server that didn't shut down cleanly.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        with self.assertRaises(server.NoServerError):
+            server.send('LIST CALENDARS', self.path)
+        srv = server.HarmonyServer(self.path, lambda statement, out: 0)
+        srv.server_close()
+        self.assertFalse(os.path.exists(self.path))
@@ -3,6 +3,8 @@ Tests for harmony.settings.
 '''
 
 import unittest
+from datetime import tzinfo
+
 import harmony.settings as settings
 
 
@@ -120,3 +122,36 @@ class BooleanSettingTest(SettingTest):
         self.assertRaises(ValueError, self.s.transform, 'foo')
         self.assertRaises(ValueError, self.s.transform, 5)
         self.assertRaises(ValueError, self.s.transform, '5')
+
+
+class SettingsTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = settings.Settings()
+
+    def test_defaults(self):
+        '''Defaults are filled in, transformed, when first read.'''
+        self.assertEqual(self.settings.realname, u'')
+        self.assertEqual(self.settings.timezone.zone, 'UTC')
+        self.assertTrue(self.settings.color)
+
+    def test_singleton_defaults(self):
+        '''The app's settings read their defaults through the class-level
+        Setting descriptors, not past them.'''
+        from harmony import app
+        fresh = settings.Settings()
+        self.assertIsInstance(fresh.timezone, tzinfo)
+        self.assertIsInstance(app.settings.timezone, tzinfo)
+        self.assertIsInstance(app.settings.color, bool)
+
+    def test_load_checked(self):
+        self.settings.realname = 'Eryn'
+        self.settings.load_checked({'timezone': u'America/Los_Angeles'})
+        self.assertEqual(self.settings.timezone.zone, 'America/Los_Angeles')
+        self.assertEqual(self.settings.realname, u'')
+
+    def test_check(self):
+        self.assertEqual(self.settings.check('color', 'no'), False)
+        self.assertRaises(ValueError, self.settings.check, 'color', 'maybe')
+        self.assertRaises(ValueError, self.settings.check, 'nope', 'no')
+        self.assertRaises(ValueError, self.settings.check, 'timezone',
+                          'Mars/Olympus_Mons')
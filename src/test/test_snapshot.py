@@ -0,0 +1,134 @@
+'''
+Tests for harmony.snapshot.
+'''
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytz
+
+import harmony.app as app
+from harmony import snapshot
+from harmony.calendar import Event
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+# 2013-03-01 00:00 UTC
+NOW = 1362096000
+
+
+def utc(seconds):
+    return (datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+            + datetime.timedelta(seconds=seconds))
+
+
+class ReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'events.snapshot')
+        self.records = [
+            (0, 10 * DAY, 1, 1, u'Vacation'),
+            (DAY, DAY + HOUR, 2, 1, u'Standup'),
+            (DAY + HOUR, DAY + 2 * HOUR, 3, 2, u'R\xe9sum\xe9 review'),
+            (2 * DAY, 2 * DAY + HOUR, 4, 2, u''),
+        ]
+        snapshot.write(self.path, (0, 30 * DAY), self.records)
+        self.reader = snapshot.SnapshotReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.directory)
+
+    def test_records(self):
+        self.assertEqual(len(self.reader), 4)
+        self.assertEqual(list(self.reader.records()), self.records)
+        self.assertEqual(self.reader.window, (0, 30 * DAY))
+
+    def test_between(self):
+        ids = lambda found: [r[2] for r in found]
+        self.assertEqual(ids(self.reader.between(DAY, DAY + HOUR)), [1, 2])
+        # Only the long event started before the range.
+        self.assertEqual(ids(self.reader.between(5 * DAY, 6 * DAY)), [1])
+        self.assertEqual(ids(self.reader.between(DAY, 3 * DAY, set([2]))),
+                         [3, 4])
+        self.assertEqual(self.reader.between(20 * DAY, 21 * DAY), [])
+
+    def test_refresh(self):
+        self.assertFalse(self.reader.refresh())
+        snapshot.write(self.path, (0, 30 * DAY), self.records[1:])
+        self.assertTrue(self.reader.refresh())
+        self.assertEqual(len(self.reader), 3)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write('x' * 100)
+        self.assertRaises(snapshot.SnapshotError, self.reader.refresh)
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'events.snapshot')
+        self.app = app.Application(dbpath=':memory:')
+        self.app.create_calendar('Work')
+        self.cal = self.app.find_calendar('Work')
+        self.writer = snapshot.SnapshotWriter(self.path, past=DAY,
+                                              future=7 * DAY)
+        Event._meta.listeners.append(self.writer.event_changed)
+
+    def tearDown(self):
+        Event._meta.listeners.remove(self.writer.event_changed)
+        self.app.close_store()
+        shutil.rmtree(self.directory)
+
+    def create(self, summary, start, end):
+        event, _ = self.app.create_event(summary, self.cal.id, utc(start),
+                                         utc(end))
+        return event
+
+    def read(self):
+        reader = snapshot.SnapshotReader(self.path)
+        try:
+            return [(r[2], r[4]) for r in reader.records()]
+        finally:
+            reader.close()
+
+    def test_build(self):
+        old = self.create('Old', NOW - 3 * DAY, NOW - 3 * DAY + HOUR)
+        soon = self.create('Soon', NOW + HOUR, NOW + 2 * HOUR)
+        self.create('Later', NOW + 30 * DAY, NOW + 30 * DAY + HOUR)
+        self.writer.invalidate()
+        self.assertTrue(self.writer.update(now=NOW))
+        self.assertEqual(self.read(), [(soon.id, u'Soon')])
+        self.assertFalse(self.writer.update(now=NOW))
+
+    def test_incremental(self):
+        first = self.create('First', NOW + HOUR, NOW + 2 * HOUR)
+        self.writer.update(now=NOW)
+        second = self.create('Second', NOW, NOW + HOUR)
+        first.summary = 'Renamed'
+        first.save()
+        self.writer.update(now=NOW)
+        self.assertEqual(self.read(), [(second.id, u'Second'),
+                                       (first.id, u'Renamed')])
+        second.delete()
+        self.writer.update(now=NOW)
+        self.assertEqual(self.read(), [(first.id, u'Renamed')])
+
+    def test_window_moves(self):
+        first = self.create('First', NOW + HOUR, NOW + 2 * HOUR)
+        self.writer.update(now=NOW)
+        # Written behind the writer's back, but past the end of the window.
+        Event._meta.listeners.remove(self.writer.event_changed)
+        later = self.create('Later', NOW + 7 * DAY + 6 * HOUR,
+                            NOW + 7 * DAY + 7 * HOUR)
+        Event._meta.listeners.append(self.writer.event_changed)
+        self.assertTrue(self.writer.update(now=NOW + 12 * HOUR))
+        self.assertEqual(self.read(), [(first.id, u'First'),
+                                       (later.id, u'Later')])
+        self.writer.update(now=NOW + 3 * DAY)
+        self.assertEqual(self.read(), [(later.id, u'Later')])
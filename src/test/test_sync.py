@@ -0,0 +1,474 @@
+'''
+Tests for harmony.sync.
+'''
+
+import datetime
+import itertools
+import os
+import shutil
+import threading
+import time
+import unittest
+
+import pytz
+
+import harmony.blobs as blobs
+import harmony.ical as ical
+import harmony.maildir as maildir
+import harmony.sync as sync
+from harmony.calendar import Calendar, Event
+from harmony.persistence import db, schema
+from harmony.remote import imap
+from harmony.remote.dav import CalDAVClient
+from harmony.remote.pool import WorkerPool
+from test import test_maildir
+from test.remote.imapserver import FakeIMAPServer, Part, message
+
+
+class FakeSource(sync.SyncSource):
+    def __init__(self, incoming=(), fail_push=False):
+        self.incoming = list(incoming)
+        self.fail_push = fail_push
+        self.pushed = []
+
+    def pull(self):
+        incoming, self.incoming = self.incoming, []
+        return incoming
+
+    def push(self, changes):
+        if self.fail_push:
+            return changes
+        self.pushed.extend(changes)
+        return []
+
+
+class SyncServiceTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.commits = 0
+        commit = db.db.db.commit
+        class CountingConnection(object):
+            def __getattr__(conn, name):
+                return getattr(self.connection, name)
+            def commit(conn):
+                self.commits += 1
+                commit()
+        self.connection = db.db.db
+        db.db.db = CountingConnection()
+
+    def test_batched_commits(self):
+        source = FakeSource([Calendar(name='cal{}'.format(i))
+                             for i in range(10)])
+        service = sync.SyncService([source], batch_size=4)
+        service.run_once()
+        self.assertEqual(len(db.db.select('calendar')), 10)
+        self.assertEqual(self.commits, 3)
+
+    def test_write_behind(self):
+        source = FakeSource(fail_push=True)
+        service = sync.SyncService([source])
+        service.queue_change(source, 'a')
+        service.queue_change(source, 'b')
+        service.run_once()
+        self.assertEqual(service.pending_changes(), 2)
+        source.fail_push = False
+        service.run_once()
+        self.assertEqual(service.pending_changes(), 0)
+        self.assertEqual(source.pushed, ['a', 'b'])
+
+    def test_background_thread(self):
+        source = FakeSource([Calendar(name='bg')])
+        service = sync.SyncService([source], interval=60)
+        service.start()
+        service.stop(5)
+        self.assertFalse(service.running)
+        self.assertEqual(len(db.db.select('calendar', {'name': 'bg'})), 1)
+
+
+class FakeCalDAVResponse(object):
+    def __init__(self, status_code, content='', etag=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {'etag': etag} if etag else {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+
+class FakeCalDAVClient(CalDAVClient):
+    '''A CalDAV client talking to an in-memory server, which keeps resources
+    as path: (data, etag).'''
+
+    def __init__(self):
+        CalDAVClient.__init__(self, 'http://dav.example.com/')
+        self.resources = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._etags = itertools.count(1)
+
+    def _send(self, method, url, headers=None, data=None, **kwargs):
+        headers = headers or {}
+        path = url[len('http://dav.example.com'):]
+        with self._lock:
+            self.requests.append((method, path, headers))
+            current = self.resources.get(path)
+            if method == 'PROPFIND':
+                return FakeCalDAVResponse(207, '<multistatus/>')
+            if method == 'OPTIONS':
+                r = FakeCalDAVResponse(200)
+                r.headers.update({'allow': 'OPTIONS, GET, PUT, PROPFIND',
+                                  'dav': '1, calendar-access'})
+                return r
+            if method == 'GET':
+                if current is None:
+                    return FakeCalDAVResponse(404)
+                return FakeCalDAVResponse(200, *current)
+            if 'If-Match' in headers and (
+                    current is None or current[1] != headers['If-Match']):
+                return FakeCalDAVResponse(412)
+            if headers.get('If-None-Match') == '*' and current is not None:
+                return FakeCalDAVResponse(412)
+            if method == 'DELETE':
+                del self.resources[path]
+                return FakeCalDAVResponse(204)
+            etag = '"{}"'.format(next(self._etags))
+            self.resources[path] = (data, etag)
+            return FakeCalDAVResponse(201, etag=etag)
+
+
+class CalDAVPushTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.client = FakeCalDAVClient()
+        self.source = sync.CalDAVSource(self.client, pool=WorkerPool(4))
+        self.service = sync.SyncService([self.source])
+        self.service.watch(Event)
+        self.cal = Calendar.create(name='Work', href='/cal/work/')
+        self.start = datetime.datetime(2013, 3, 1, 9, tzinfo=pytz.utc)
+
+    def tearDown(self):
+        self.service.unwatch()
+        self.source.pool.shutdown()
+        db.db.close()
+
+    def create(self, summary='Standup'):
+        return Event.create(summary=summary, calendar=self.cal,
+                            start=self.start,
+                            end=self.start + datetime.timedelta(hours=1))
+
+    def stored(self, event):
+        return next(Event.select(id=event.id))
+
+    def server_copy(self, event):
+        href = self.stored(event).href
+        return ical.event_values(self.client.resources[href][0])
+
+    def test_create_update_delete(self):
+        events = [self.create('Event {}'.format(i)) for i in range(20)]
+        self.service.run_once()
+        self.assertEqual(self.service.pending_changes(), 0)
+        self.assertEqual(len(self.client.resources), 20)
+        event = events[0]
+        stored = self.stored(event)
+        self.assertEqual(stored.href, u'/cal/work/{}.ics'.format(stored.uid))
+        self.assertEqual(stored.etag, self.client.resources[stored.href][1])
+        # The instances that were saved belong to the app, and are left alone.
+        self.assertIsNone(event.href)
+        self.assertTrue(all(h['If-None-Match'] == '*'
+                            for m, _, h in self.client.requests if m == 'PUT'))
+        # Saving what came back from the server isn't a change to push.
+        self.assertEqual(self.service.pending_changes(), 0)
+
+        etag = stored.etag
+        event.summary = 'Renamed'
+        event.save()
+        self.service.run_once()
+        self.assertEqual(self.server_copy(event)['summary'], u'Renamed')
+        put = [r for r in self.client.requests if r[0] == 'PUT'][-1]
+        self.assertEqual(put[2]['If-Match'], etag)
+
+        # Even an instance from before the event was written knows where to
+        # delete it from.
+        href = self.stored(event).href
+        event.delete()
+        self.service.run_once()
+        self.assertNotIn(href, self.client.resources)
+
+    def test_conflict_merges(self):
+        event = self.create()
+        self.service.run_once()
+        # Someone moves the event on the server...
+        href = self.stored(event).href
+        data, etag = self.client.resources[href]
+        moved = ical.event_to_ical({
+            'summary': u'Standup', 'all_day': False,
+            'start': self.start + datetime.timedelta(hours=2),
+            'end': self.start + datetime.timedelta(hours=3)},
+            self.stored(event).uid, base=data)
+        self.client.resources[href] = (moved, '"server"')
+        # ...while it's renamed here.
+        event.summary = 'Daily standup'
+        event.save()
+        self.service.run_once()
+        self.assertEqual(self.service.pending_changes(), 0)
+        server = self.server_copy(event)
+        self.assertEqual(server['summary'], u'Daily standup')
+        self.assertEqual(server['start'], self.start + datetime.timedelta(hours=2))
+        # The local copy picks up the server's change too.
+        stored = self.stored(event)
+        self.assertEqual(stored.start, self.start + datetime.timedelta(hours=2))
+        self.assertEqual(stored.etag, self.client.resources[href][1])
+
+    def test_keeps_unknown_properties(self):
+        data = invite('Standup').replace(
+                'END:VEVENT', 'ATTENDEE;CN=Eryn:mailto:eryn@example.com\r\n'
+                'END:VEVENT')
+        for instance in ical.import_events(data, self.cal):
+            instance.save()
+        event = next(Event.select())
+        event.summary = 'Renamed'
+        event.save()
+        self.service.run_once()
+        server = self.client.resources[self.stored(event).href][0]
+        self.assertIn('ATTENDEE;CN=Eryn:mailto:eryn@example.com', server)
+        self.assertIn('SUMMARY:Renamed', server)
+        # What was written is what's kept.
+        self.assertEqual(blobs.event_ical(event), server)
+
+    def test_coalesces_across_instances(self):
+        event = self.create()
+        self.service.run_once()
+        other = self.stored(event)
+        href = other.href
+        event.summary = 'Renamed'
+        event.save()
+        other.delete()
+        del self.client.requests[:]
+        self.service.run_once()
+        self.assertNotIn(href, self.client.resources)
+        self.assertNotIn('PUT', [r[0] for r in self.client.requests])
+
+    def test_deleted_on_server(self):
+        event = self.create()
+        self.service.run_once()
+        del self.client.resources[self.stored(event).href]
+        event.summary = 'Renamed'
+        event.save()
+        self.service.run_once()
+        self.assertEqual(list(Event.select()), [])
+
+    def test_missing_collection(self):
+        event = self.create()
+        self.service.run_once()
+        # A 404 on a PUT means the collection has gone, not the event.
+        put = self.client._send
+        def missing(method, url, **kwargs):
+            if method == 'PUT':
+                return FakeCalDAVResponse(404)
+            return put(method, url, **kwargs)
+        self.client._send = missing
+        event.summary = 'Renamed'
+        event.save()
+        self.service.run_once()
+        self.assertEqual([e.summary for e in Event.select()], [u'Renamed'])
+        self.assertEqual(self.service.pending_changes(), 1)
+
+    def test_deleted_on_both_sides(self):
+        event = self.create()
+        self.service.run_once()
+        del self.client.resources[self.stored(event).href]
+        event.delete()
+        self.service.run_once()
+        self.assertEqual(self.service.pending_changes(), 0)
+        methods = [r[0] for r in self.client.requests]
+        self.assertEqual(methods[methods.index('DELETE'):][:2],
+                         ['DELETE', 'GET'])
+
+
+def invite(summary, uid='standup@example.com'):
+    return ical.event_to_ical({
+        'summary': summary, 'all_day': False,
+        'start': datetime.datetime(2013, 3, 1, 9, tzinfo=pytz.utc),
+        'end': datetime.datetime(2013, 3, 1, 10, tzinfo=pytz.utc)}, uid)
+
+
+class IMAPSourceTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.cal = Calendar.create(name='Invites', is_default=True)
+        self.server = FakeIMAPServer().start()
+        self.source = sync.IMAPSource('127.0.0.1', 'eryn', 'secret',
+                                      port=self.server.port, ssl=False,
+                                      idle_timeout=5)
+        self.service = sync.SyncService([self.source])
+
+    def tearDown(self):
+        self.source.stop_listening()
+        self.server.stop()
+        db.db.close()
+
+    def add_invite(self, summary, uid='standup@example.com'):
+        return self.server.add(message(
+                Part('text', 'plain', 'You are invited'),
+                Part('text', 'calendar', invite(summary, uid),
+                     encoding='base64')))
+
+    def test_import(self):
+        self.add_invite('Standup')
+        self.server.add(message(Part('text', 'plain', 'Not an invite')))
+        self.service.run_once()
+        events = list(Event.select())
+        self.assertEqual([e.summary for e in events], [u'Standup'])
+        self.assertEqual(events[0].calendar, self.cal.id)
+        state = imap.MailboxState.load(self.source.name)
+        self.assertEqual(state.last_uid, 2)
+
+        # An update to the invite, and a new one. Only the new message is
+        # looked at.
+        del self.server.log[:]
+        self.add_invite('Daily standup')
+        self.add_invite('Retro', uid='retro@example.com')
+        self.service.run_once()
+        self.assertEqual(sorted(e.summary for e in Event.select()),
+                         [u'Daily standup', u'Retro'])
+        self.assertEqual(self.server.commands('UID SEARCH'),
+                         ['UID SEARCH UID 3:*'])
+        self.assertEqual(self.server.commands('UID FETCH'),
+                         ['UID FETCH 3,4 (BODYSTRUCTURE)',
+                          'UID FETCH 3,4 (BODY.PEEK[2])'])
+
+        # Nothing new: no fetches at all.
+        del self.server.log[:]
+        self.service.run_once()
+        self.assertEqual(self.server.commands('UID FETCH'), [])
+
+    def test_uidvalidity_change(self):
+        self.add_invite('Standup')
+        self.service.run_once()
+        self.server.uidvalidity = 2
+        del self.server.log[:]
+        self.service.run_once()
+        self.assertEqual(self.server.commands('UID SEARCH'),
+                         ['UID SEARCH UID 1:*'])
+        self.assertEqual(len(list(Event.select())), 1)
+
+    def test_idle_triggers_sync(self):
+        arrived = threading.Event()
+        self.source.listen(arrived.set)
+        # Wait for the IDLE to start before the mail arrives.
+        for _ in range(500):
+            if self.server.commands('IDLE'):
+                break
+            time.sleep(0.01)
+        self.add_invite('Standup')
+        self.assertTrue(arrived.wait(5))
+        self.source.stop_listening()
+
+
+class MaildirSourceTest(unittest.TestCase):
+    def setUp(self):
+        db.initialize_sqlite(':memory:')
+        schema.migrate()
+        self.cal = Calendar.create(name='Invites', is_default=True)
+        self.path = test_maildir.make_maildir()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        db.db.close()
+
+    def invite(self, summary, name, uid='standup@example.com'):
+        data = invite(summary, uid)
+        return test_maildir.deliver(self.path, (
+                'Content-Type: multipart/mixed; boundary="XX"\n\n'
+                '--XX\nContent-Type: text/calendar\n\n{}\n--XX--\n').format(
+                        data), name)
+
+    def run_source(self, source):
+        sync.SyncService([source]).run_once()
+
+    def test_import_once(self):
+        for use_inotify in (True, False):
+            source = sync.MaildirSource(self.path, use_inotify=use_inotify)
+            self.invite('Standup', '1.a.host')
+            test_maildir.deliver(self.path, test_maildir.PLAIN, '2.a.host')
+            self.run_source(source)
+            self.assertEqual([e.summary for e in Event.select()],
+                             [u'Standup'])
+            self.assertEqual(maildir.SeenMessage.keys(source.path),
+                             set(['1.a.host', '2.a.host']))
+
+            # Messages already seen aren't read again, even when they move.
+            # An updated invite is.
+            read = []
+            calendar_parts = maildir.calendar_parts
+            maildir.calendar_parts = lambda path: (read.append(path)
+                                                   or calendar_parts(path))
+            try:
+                os.rename(os.path.join(self.path, 'new', '1.a.host'),
+                          os.path.join(self.path, 'cur', '1.a.host:2,S'))
+                self.invite('Daily standup', '3.a.host')
+                self.run_source(source)
+                # A new source starts from what's in the store.
+                self.run_source(sync.MaildirSource(self.path,
+                                                   use_inotify=use_inotify))
+            finally:
+                maildir.calendar_parts = calendar_parts
+            self.assertEqual([os.path.basename(p) for p in read],
+                             ['3.a.host'])
+            self.assertEqual([e.summary for e in Event.select()],
+                             [u'Daily standup'])
+            source.maildir.close()
+            shutil.rmtree(self.path)
+            db.db.delete('seenmessage')
+            db.db.delete('event')
+            self.path = test_maildir.make_maildir()
+
+    def test_failed_pull_lists_again(self):
+        for use_inotify in (True, False):
+            source = sync.MaildirSource(self.path, use_inotify=use_inotify)
+            self.run_source(source)
+            self.invite('Standup', '1.a.host')
+            # Pretend both directories were last changed long ago.
+            past = time.time() - 60
+            for sub in ('new', 'cur'):
+                os.utime(os.path.join(self.path, sub), (past, past))
+            service = sync.SyncService([source], batch_size=1)
+            def fail(batch):
+                raise IOError('disk full')
+            service._commit = fail
+            self.assertRaises(IOError, service._pull, source)
+            self.run_source(source)
+            self.assertEqual([e.summary for e in Event.select()],
+                             [u'Standup'])
+            source.maildir.close()
+            shutil.rmtree(self.path)
+            db.db.delete('seenmessage')
+            db.db.delete('event')
+            self.path = test_maildir.make_maildir()
+
+    def test_forgets_removed_messages(self):
+        source = sync.MaildirSource(self.path, use_inotify=False)
+        self.invite('Standup', '1.a.host')
+        self.run_source(source)
+        os.unlink(os.path.join(self.path, 'new', '1.a.host'))
+        self.run_source(source)
+        self.assertEqual(maildir.SeenMessage.keys(source.path), set())
+
+    def test_listen(self):
+        source = sync.MaildirSource(self.path)
+        inotify = source.maildir.watch()
+        if inotify is None:
+            self.skipTest('inotify is not available')
+        inotify.close()
+        source.WATCH_POLL = 0.05
+        arrived = threading.Event()
+        source.listen(arrived.set)
+        try:
+            self.invite('Standup', '1.a.host')
+            self.assertTrue(arrived.wait(5))
+        finally:
+            source.stop_listening()
@@ -0,0 +1,47 @@
+'''
+Tests for harmony.trie.
+'''
+
+import unittest
+
+from harmony.trie import Trie
+
+
+class TrieTest(unittest.TestCase):
+    def test_complete(self):
+        trie = Trie([u'Work', u'Weekend', u'work trips', u'Home'])
+        self.assertEqual(trie.complete(u'w'),
+                         [u'Weekend', u'Work', u'work trips'])
+        self.assertEqual(trie.complete(u'WOR'), [u'Work', u'work trips'])
+        self.assertEqual(trie.complete(u'x'), [])
+        self.assertEqual(len(trie.complete(u'')), 4)
+        self.assertEqual(trie.complete(u'w', limit=2), [u'Weekend', u'Work'])
+
+    def test_counts(self):
+        trie = Trie([u'Standup', u'Standup'])
+        self.assertEqual(len(trie), 1)
+        trie.discard(u'Standup')
+        self.assertIn(u'Standup', trie)
+        trie.discard(u'Standup')
+        self.assertNotIn(u'Standup', trie)
+        self.assertEqual(len(trie), 0)
+
+    def test_discard_prunes(self):
+        trie = Trie([u'Work', u'Workout'])
+        trie.discard(u'Workout')
+        self.assertEqual(trie.complete(u'Work'), [u'Work'])
+        trie.discard(u'Work')
+        self.assertEqual(trie._root.children, {})
+        # Words that aren't there are ignored.
+        trie.discard(u'Work')
+        trie.discard(u'Nope')
+
+    def test_case(self):
+        trie = Trie([u'work', u'Work'])
+        self.assertEqual(len(trie), 2)
+        trie.discard(u'WORK')
+        self.assertEqual(trie.complete(u'w'), [u'Work', u'work'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+'''
+Tests for harmony.tz.
+'''
+
+import datetime
+import unittest
+
+import pytz
+
+import harmony.tz as tz
+
+
+class GetTimezoneTest(unittest.TestCase):
+    def test_cached(self):
+        self.assertTrue(tz.get_timezone('Europe/Paris')
+                        is tz.get_timezone('Europe/Paris'))
+
+    def test_passthrough(self):
+        self.assertTrue(tz.get_timezone(pytz.utc) is pytz.utc)
+
+    def test_unknown(self):
+        self.assertRaises(pytz.UnknownTimeZoneError, tz.get_timezone, 'Nowhere')
+
+
+class TransitionTableTest(unittest.TestCase):
+    zone = 'America/New_York'
+
+    def setUp(self):
+        self.tz = pytz.timezone(self.zone)
+        # Hourly, across both 2012 DST transitions.
+        start = datetime.datetime(2012, 3, 10)
+        self.utc = [start + datetime.timedelta(hours=h)
+                    for h in range(24 * 250)]
+
+    def test_to_local(self):
+        local = tz.to_local(self.utc, self.zone)
+        expected = [pytz.utc.localize(dt).astimezone(self.tz) for dt in self.utc]
+        self.assertEqual(local, expected)
+        self.assertEqual([dt.tzname() for dt in local],
+                         [dt.tzname() for dt in expected])
+
+    def test_to_utc(self):
+        naive = [dt.replace(tzinfo=None)
+                 for dt in tz.to_local(self.utc, self.zone)]
+        for is_dst in (False, True):
+            expected = [self.tz.localize(dt, is_dst=is_dst).astimezone(pytz.utc)
+                        for dt in naive]
+            self.assertEqual(tz.to_utc(naive, self.zone, is_dst=is_dst),
+                             expected)
+
+    def test_nonexistent_time(self):
+        gap = datetime.datetime(2012, 3, 11, 2, 30)
+        # EST before the clocks go forward, EDT after.
+        self.assertEqual(tz.to_utc([gap], self.zone)[0],
+                         pytz.utc.localize(datetime.datetime(2012, 3, 11, 7, 30)))
+        self.assertEqual(tz.to_utc([gap], self.zone, is_dst=True)[0],
+                         pytz.utc.localize(datetime.datetime(2012, 3, 11, 6, 30)))
+        for is_dst in (False, True):
+            expected = self.tz.normalize(self.tz.localize(gap, is_dst=is_dst))
+            self.assertEqual(tz.to_utc([gap], self.zone, is_dst=is_dst)[0],
+                             expected.astimezone(pytz.utc))
+
+    def test_static_zone(self):
+        table = tz.get_transitions('UTC')
+        self.assertEqual(table.utcoffset(0), 0)